@@ -3,3 +3,4 @@
 from . import res_company
 from . import res_config_settings
 from . import account_invoice
+from . import ir_actions_report
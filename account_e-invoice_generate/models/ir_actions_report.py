@@ -0,0 +1,74 @@
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from io import BytesIO
+import logging
+
+from PyPDF2 import PdfFileReader, PdfFileWriter
+
+from odoo import api, models
+
+logger = logging.getLogger(__name__)
+
+
+class IrActionsReport(models.Model):
+    _inherit = 'ir.actions.report'
+
+    @api.model
+    def _split_pdf_per_record(self, pdf_content, nb_records):
+        """Split the PDF of a report rendered for several records into
+        one PDF per record, with the top-level outlines generated by
+        wkhtmltopdf, the same way as _post_pdf() does before saving the
+        attachments.
+        Returns the list of the PDF contents, in the order of the records,
+        or False if the outlines don't match the records"""
+        reader = PdfFileReader(BytesIO(pdf_content), strict=False)
+        root = reader.trailer['/Root']
+        if '/Outlines' not in root or '/First' not in root['/Outlines']:
+            logger.warning(
+                'Cannot split the PDF report per record: no outlines')
+            return False
+        # Only the top-level headings are used: one per record
+        outlines_pages = []
+        node = root['/Outlines']['/First']
+        while True:
+            outlines_pages.append(root['/Dests'][node['/Dest']][0])
+            if '/Next' not in node:
+                break
+            node = node['/Next']
+        outlines_pages = sorted(set(outlines_pages))
+        if len(outlines_pages) != nb_records or outlines_pages[0] != 0:
+            logger.warning(
+                'Cannot split the PDF report per record: %d top-level '
+                'outlines starting at page %d for %d records',
+                len(outlines_pages), outlines_pages[0], nb_records)
+            return False
+        res = []
+        for i, first_page in enumerate(outlines_pages):
+            if i + 1 < len(outlines_pages):
+                last_page = outlines_pages[i + 1]
+            else:
+                last_page = reader.numPages
+            writer = PdfFileWriter()
+            for page in range(first_page, last_page):
+                writer.addPage(reader.getPage(page))
+            stream = BytesIO()
+            writer.write(stream)
+            res.append(stream.getvalue())
+        return res
+
+    @api.multi
+    def postprocess_pdf_report(self, record, buffer):
+        """When a report is rendered for several invoices, _post_pdf()
+        may prepare the PDF with the embedded XML file of each invoice in
+        the 'e_invoice_pdf_contents' key of the context (dict with
+        key = invoice ID, value = PDF content). This PDF replaces the
+        part of the report of the invoice, before it is saved as
+        attachment"""
+        pdf_contents = self._context.get('e_invoice_pdf_contents')
+        if (
+                pdf_contents and
+                record._name == 'account.invoice' and
+                record.id in pdf_contents):
+            buffer = BytesIO(pdf_contents[record.id])
+        return super().postprocess_pdf_report(record, buffer)
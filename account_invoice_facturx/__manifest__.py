@@ -4,7 +4,7 @@
 
 {
     'name': 'Account Invoice Factur-X',
-    'version': '12.0.1.0.0',
+    'version': '12.0.1.1.0',
     'category': 'Invoicing Management',
     'license': 'AGPL-3',
     'summary': 'Generate Factur-X/ZUGFeRD customer invoices',
@@ -6,6 +6,7 @@ from odoo import api, fields, models, _
 from odoo.exceptions import UserError
 from odoo.tools import float_compare, float_is_zero, float_round
 from lxml import etree
+from copy import deepcopy
 import logging
 logger = logging.getLogger(__name__)
 
@@ -174,6 +175,38 @@ class AccountInvoice(models.Model):
     def _cii_trade_agreement_buyer_ref(self, partner):
         return None
 
+    @api.model
+    def _cii_add_seller_party_block(self, company, parent_node, ns):
+        """Adds the SellerTradeParty block of the company, without its
+        DefinedTradeContact which depends on the invoice, and returns it.
+        When several invoices are generated at once, the caller gives a
+        dict in the context key 'facturx_seller_parties': the block is
+        then built for the first invoice and copied in the others
+        (cf _facturx_batch_pdf() of ir.actions.report)"""
+        memo = self._context.get('facturx_seller_parties')
+        key = (company.id, ns['level'], self._context.get('lang'))
+        if memo is not None and key in memo:
+            seller = deepcopy(memo[key])
+            parent_node.append(seller)
+            return seller
+        seller = etree.SubElement(
+            parent_node, ns['ram'] + 'SellerTradeParty')
+        seller_name = etree.SubElement(
+            seller, ns['ram'] + 'Name')
+        seller_name.text = company.name
+        self._cii_add_party_identification(
+            company.partner_id, seller, ns)
+        self._cii_add_address_block(company.partner_id, seller, ns)
+        if company.vat:
+            seller_tax_reg = etree.SubElement(
+                seller, ns['ram'] + 'SpecifiedTaxRegistration')
+            seller_tax_reg_id = etree.SubElement(
+                seller_tax_reg, ns['ram'] + 'ID', schemeID='VA')
+            seller_tax_reg_id.text = company.vat
+        if memo is not None:
+            memo[key] = deepcopy(seller)
+        return seller
+
     @api.multi
     def _cii_add_trade_agreement_block(self, trade_transaction, ns):
         self.ensure_one()
@@ -186,23 +219,15 @@ class AccountInvoice(models.Model):
             buyer_reference = etree.SubElement(
                 trade_agreement, ns['ram'] + 'BuyerReference')
             buyer_reference.text = buyer_ref
-        seller = etree.SubElement(
-            trade_agreement, ns['ram'] + 'SellerTradeParty')
-        seller_name = etree.SubElement(
-            seller, ns['ram'] + 'Name')
-        seller_name.text = company.name
-        self._cii_add_party_identification(
-            company.partner_id, seller, ns)
+        seller = self._cii_add_seller_party_block(
+            company, trade_agreement, ns)
         if ns['level'] in PROFILES_EN_UP:
             self._cii_add_trade_contact_block(
                 self.user_id.partner_id or company.partner_id, seller, ns)
-        self._cii_add_address_block(company.partner_id, seller, ns)
-        if company.vat:
-            seller_tax_reg = etree.SubElement(
-                seller, ns['ram'] + 'SpecifiedTaxRegistration')
-            seller_tax_reg_id = etree.SubElement(
-                seller_tax_reg, ns['ram'] + 'ID', schemeID='VA')
-            seller_tax_reg_id.text = company.vat
+            # DefinedTradeContact must be placed before PostalTradeAddress
+            seller.insert(
+                seller.index(seller.find(ns['ram'] + 'PostalTradeAddress')),
+                seller[-1])
         buyer = etree.SubElement(
             trade_agreement, ns['ram'] + 'BuyerTradeParty')
         if ns['level'] != 'minimum' and self.commercial_partner_id.ref:
@@ -742,6 +767,30 @@ class AccountInvoice(models.Model):
         logger.debug(xml_string)
         return (xml_string, level)
 
+    @api.multi
+    def _cii_prefetch(self):
+        """Read in a few queries, for all the invoices of the recordset,
+        the related records that are used to generate their Factur-X XML
+        file, instead of reading them invoice per invoice"""
+        invoice_ids_by_lang = {}
+        for inv in self:
+            lang = inv.partner_id.lang or self.env.user.lang or 'en_US'
+            invoice_ids_by_lang.setdefault(lang, []).append(inv.id)
+        # The data is read in the lang used by generate_facturx_xml()
+        for lang, invoice_ids in invoice_ids_by_lang.items():
+            invs = self.with_context(lang=lang).browse(invoice_ids)
+            invs.mapped('partner_id.commercial_partner_id.country_id')
+            if 'partner_shipping_id' in self._fields:
+                invs.mapped('partner_shipping_id.country_id')
+            invs.mapped('partner_bank_id.bank_id')
+            invs.mapped('payment_mode_id.payment_method_id')
+            invs.mapped('payment_term_id')
+            invs.mapped('tax_line_ids.tax_id')
+            lines = invs.mapped('invoice_line_ids')
+            lines.mapped('uom_id')
+            lines.mapped('invoice_line_tax_ids')
+            lines.mapped('product_id.product_tmpl_id')
+
     @api.multi
     def _prepare_pdf_metadata(self):
         self.ensure_one()
@@ -2,8 +2,12 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import logging
+
 from odoo import api, models
 
+logger = logging.getLogger(__name__)
+
 
 class IrActionsReport(models.Model):
     _inherit = 'ir.actions.report'
@@ -28,5 +32,54 @@ class IrActionsReport(models.Model):
                     inv.company_id.xml_format_in_pdf_invoice == 'factur-x'):
                 pdf_content = inv.regular_pdf_invoice_to_facturx_invoice(
                     pdf_content=pdf_content)
-        return super()._post_pdf(
+        elif (
+                len(self) == 1 and
+                self.report_name in invoice_reports and
+                self.attachment and
+                pdf_content and
+                res_ids and
+                len(res_ids) > 1 and
+                not self.env.context.get('no_embedded_factur-x_xml')):
+            facturx_pdfs = self._facturx_batch_pdf(pdf_content, res_ids)
+            if facturx_pdfs:
+                # keep the PDF files prepared for the invoices of the
+                # companies that use another format
+                pdf_contents = dict(
+                    self._context.get('e_invoice_pdf_contents') or {})
+                pdf_contents.update(facturx_pdfs)
+                self = self.with_context(e_invoice_pdf_contents=pdf_contents)
+        return super(IrActionsReport, self)._post_pdf(
             save_in_attachment, pdf_content=pdf_content, res_ids=res_ids)
+
+    @api.multi
+    def _facturx_batch_pdf(self, pdf_content, res_ids):
+        """Generate the Factur-X PDF file of each invoice of a report
+        rendered for several invoices in its part of the PDF, with
+        regular_pdf_invoice_to_facturx_invoice() like for a single
+        invoice. The data of the invoices is read once for all the
+        XML files.
+        Returns a dict with key = invoice ID, value = Factur-X PDF"""
+        self.ensure_one()
+        invoices = self.env['account.invoice'].browse(res_ids)
+        to_convert = [
+            i for (i, inv) in enumerate(invoices)
+            if inv.type in ('out_invoice', 'out_refund') and
+            inv.company_id.xml_format_in_pdf_invoice == 'factur-x']
+        if not to_convert:
+            return {}
+        pdf_contents = self._split_pdf_per_record(pdf_content, len(res_ids))
+        if not pdf_contents:
+            return {}
+        invoices.browse([invoices[i].id for i in to_convert])._cii_prefetch()
+        # the SellerTradeParty block of the company is built once for the
+        # batch (cf _cii_add_seller_party_block())
+        invoices = invoices.with_context(facturx_seller_parties={})
+        res = {}
+        for i in to_convert:
+            inv = invoices[i]
+            res[inv.id] = inv.regular_pdf_invoice_to_facturx_invoice(
+                pdf_contents[i])
+        logger.info(
+            '%d Factur-X PDF files generated for report %s',
+            len(res), self.report_name)
+        return res
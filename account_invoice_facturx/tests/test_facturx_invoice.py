@@ -2,6 +2,8 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import base64
+
 from odoo.addons.account_tax_unece.tests.test_account_invoice import \
     TestAccountInvoice
 from facturx import get_facturx_xml_from_pdf, get_facturx_level
@@ -27,3 +29,53 @@ class TestFacturXInvoice(TestAccountInvoice):
             xml_root = etree.fromstring(xml_string)
             facturx_level = get_facturx_level(xml_root)
             self.assertEqual(facturx_level, level)
+
+    def test_seller_party_memo(self):
+        invoice = self.test_only_create_invoice()
+        company = invoice.company_id
+        company.facturx_level = 'en16931'
+        xml_string, level = invoice.generate_facturx_xml()
+        seller_xpath = "//*[local-name()='SellerTradeParty']"
+        seller = etree.fromstring(xml_string).xpath(seller_xpath)[0]
+        # the contact of the invoice is inserted before the address
+        names = [etree.QName(child).localname for child in seller]
+        self.assertEqual(
+            names.index('DefinedTradeContact') + 1,
+            names.index('PostalTradeAddress'))
+        # the block is built once for the invoices of a batch
+        batch_invoice = invoice.with_context(facturx_seller_parties={})
+        for i in range(2):
+            batch_xml_string, level = batch_invoice.generate_facturx_xml()
+            self.assertEqual(batch_xml_string.count(b'xmlns:ram='), 1)
+            batch_seller = etree.fromstring(batch_xml_string).xpath(
+                seller_xpath)[0]
+            self.assertEqual(
+                etree.tostring(batch_seller), etree.tostring(seller))
+        self.assertEqual(
+            len(batch_invoice._context['facturx_seller_parties']), 1)
+        # the next batch sees the modification of the company partner
+        company.partner_id.city = 'Test City Factur-X'
+        xml_string, level = invoice.with_context(
+            facturx_seller_parties={}).generate_facturx_xml()
+        self.assertIn(b'Test City Factur-X', xml_string)
+
+    def test_facturx_batch_pdf(self):
+        invoices = self.test_only_create_invoice()
+        invoices |= self.test_only_create_invoice()
+        company = invoices[0].company_id
+        if company.xml_format_in_pdf_invoice != 'factur-x':
+            company.xml_format_in_pdf_invoice = 'factur-x'
+        inv_report = self.env.ref('account.account_invoices').with_context(
+            force_report_rendering=True)
+        inv_report.render_qweb_pdf(res_ids=invoices.ids)
+        for invoice in invoices:
+            attach = self.env['ir.attachment'].search([
+                ('res_model', '=', 'account.invoice'),
+                ('res_id', '=', invoice.id),
+                ('mimetype', '=', 'application/pdf'),
+                ])
+            self.assertEqual(len(attach), 1)
+            xml_filename, xml_string = get_facturx_xml_from_pdf(
+                base64.b64decode(attach.datas), check_xsd=True)
+            self.assertEqual(xml_filename, 'factur-x.xml')
+            self.assertIn(invoice.number.encode('utf-8'), xml_string)
@@ -0,0 +1,75 @@
+# Copyright 2019 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import base64
+import json
+import logging
+import mimetypes
+
+from odoo import http
+from odoo.http import request
+
+logger = logging.getLogger(__name__)
+
+# Maximum size of an uploaded invoice file (in bytes), unless the system
+# parameter account_invoice_import.upload_max_size is set
+UPLOAD_MAX_SIZE = 50 * 1024 * 1024
+
+
+class AccountInvoiceImportController(http.Controller):
+
+    @http.route(
+        '/account_invoice_import/upload_token', type='json', auth='user')
+    def upload_invoice_file_token(self, **kwargs):
+        """Returns the CSRF token to give to the upload route, as the
+        csrf_token argument of the URL"""
+        return request.csrf_token()
+
+    def _json_response(self, data, status=200):
+        return request.make_response(
+            json.dumps(data),
+            headers=[('Content-Type', 'application/json')], status=status)
+
+    @http.route(
+        '/account_invoice_import/upload', type='http', auth='user',
+        methods=['POST'])
+    def upload_invoice_file(self, filename=None, **kwargs):
+        """Receive an invoice file as the raw body of the request and
+        store it in an attachment, so that the file is not sent in base64
+        inside a JSON-RPC call.
+        The CSRF token given by /account_invoice_import/upload_token must
+        be in the csrf_token argument of the URL.
+        Returns {"attachment_id": ID} ; the attachment ID can then be
+        given to the wizard account.invoice.import (invoice_attachment_id)
+        instead of the base64 of the file.
+        """
+        if not filename:
+            return self._json_response(
+                {'error': 'Missing filename argument'}, status=400)
+        max_size = int(request.env['ir.config_parameter'].sudo().get_param(
+            'account_invoice_import.upload_max_size', UPLOAD_MAX_SIZE))
+        content_length = request.httprequest.content_length
+        if content_length and content_length > max_size:
+            content = None
+        else:
+            content = request.httprequest.stream.read(max_size + 1)
+        if content is None or len(content) > max_size:
+            logger.warning(
+                'Invoice file %s refused: it is bigger than %d bytes',
+                filename, max_size)
+            return self._json_response(
+                {'error': 'The file is bigger than %d bytes' % max_size},
+                status=413)
+        attachment = request.env['ir.attachment'].create({
+            'name': filename,
+            'datas_fname': filename,
+            'datas': base64.b64encode(content),
+            'res_model': 'account.invoice.import',
+            'mimetype': mimetypes.guess_type(filename)[0] or
+            'application/octet-stream',
+            })
+        logger.info(
+            'Invoice file %s uploaded in attachment ID %d (%d bytes)',
+            filename, attachment.id, attachment.file_size)
+        return self._json_response({'attachment_id': attachment.id})
@@ -1,12 +1,19 @@
 # © 2015-2016 Akretion (Alexis de Lattre <alexis.delattre@akretion.com>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-from odoo import models, api, _
+from odoo import models, fields, api, _
 
 
 class AccountInvoice(models.Model):
     _inherit = 'account.invoice'
 
+    import_file_sha256 = fields.Char(
+        string='SHA-256 of Imported File', index=True, copy=False,
+        readonly=True,
+        help="SHA-256 hash of the PDF or XML file from which this invoice "
+        "has been imported. It is used to detect the files that have "
+        "already been imported before parsing them.")
+
     @api.multi
     def name_get(self):
         """Add amount_untaxed in name_get of invoices"""
@@ -7,6 +7,7 @@ Mass import of PDF/XML invoice.
 The module OCA/edi/account_invoice_import must be installed on Odoo.
 """
 import base64
+import json
 import odoorpc
 import sys
 from optparse import OptionParser
@@ -14,6 +15,10 @@ import logging
 import os
 import getpass
 import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
 
 __author__ = "Alexis de Lattre <alexis.delattre@akretion.com>"
 __date__ = "June 2017"
@@ -49,6 +54,23 @@ options = [
     {'names': ('-k', '--fail-subdir-name'), 'dest': 'fail_subdir',
         'action': 'store', 'default': 'odoo-import_fail',
         'help': "Fail sub-directory name. Default value: 'odoo-import_fail'."},
+    {'names': ('-t', '--workers'), 'dest': 'workers', 'type': 'int',
+        'action': 'store', 'default': 1,
+        'help': "Number of files imported in parallel, each worker using its "
+        "own connection to Odoo. Should not be higher than the number of "
+        "workers of the Odoo server. Default value: 1."},
+    {'names': ('-b', '--batch-size'), 'dest': 'batch_size', 'type': 'int',
+        'action': 'store', 'default': 0,
+        'help': "Send the files by batches of N files to Odoo, with one call "
+        "per batch (import_invoice_files). If a file of the batch fails, "
+        "the other files are imported anyway. Default value: 0 (one wizard "
+        "per file)."},
+    {'names': ('-S', '--stream-upload'), 'dest': 'stream_upload',
+        'action': 'store_true', 'default': False,
+        'help': "Upload the files as raw data to the controller "
+        "/account_invoice_import/upload instead of sending them in base64 "
+        "inside the JSON-RPC call, to avoid loading the whole file in "
+        "memory. Not compatible with --batch-size."},
     {'names': ('-l', '--log-level'), 'dest': 'log_level',
         'action': 'store', 'default': 'info',
         'help': "Set log level. Possible values: debug, info, warn, error. "
@@ -57,50 +79,202 @@ options = [
 fail_subdir_ok = {}  # key = directory, value: failsubdir or False
 invoice_ids = []
 fail_files = []
+# protects fail_subdir_ok, invoice_ids and fail_files in --workers mode
+result_lock = threading.Lock()
+# one odoorpc connection (and one HTTP session with --stream-upload)
+# per worker thread
+thread_data = threading.local()
+# timeout of the HTTP requests of --stream-upload, in seconds
+HTTP_TIMEOUT = 120
+
+
+def connect(options, pwd):
+    proto = options.no_ssl and 'jsonrpc' or 'jsonrpc+ssl'
+    odoo = odoorpc.ODOO(options.server, proto, options.port)
+    odoo.login(options.database, options.username, pwd)
+    return odoo
+
 
+def get_thread_odoo(options, pwd):
+    if getattr(thread_data, 'odoo', None) is None:
+        logger.debug(
+            'Opening connection to Odoo for thread %s',
+            threading.current_thread().name)
+        thread_data.odoo = connect(options, pwd)
+    return thread_data.odoo
 
-def send_file(odoo, file_path):
+
+def check_invoice_file(file_path):
     filename = os.path.basename(file_path)
     filetype = mimetypes.guess_type(filename)
     logger.debug('filetype of file %s=%s', filename, filetype)
     inv_mime = ['application/xml', 'text/xml', 'application/pdf']
-    if filetype and filetype[0] in inv_mime:
-        logger.info('Starting to upload file %s to Odoo', filename)
-        if not os.access(file_path, os.R_OK):
-            logger.error('No read access on file %s. Skipping.', filename)
-            return False
-        f = open(file_path)
-        f.seek(0)
+    if not filetype or filetype[0] not in inv_mime:
+        logger.warning(
+            'Filetype of file %s is %s. Skipping.', filename, filetype)
+        return False
+    if not os.access(file_path, os.R_OK):
+        logger.error('No read access on file %s. Skipping.', filename)
+        return False
+    return True
+
+
+def read_invoice_file(file_path):
+    """Returns the content of the file in base64 or False if the
+    file must be skipped"""
+    if not check_invoice_file(file_path):
+        return False
+    with open(file_path, 'rb') as f:
         invoice = f.read()
-        f.close()
-        inv_b64 = base64.b64encode(invoice)
-        wiz_id = odoo.execute(
-            'account.invoice.import', 'create',
-            {'invoice_file': inv_b64, 'invoice_filename': filename})
+    return base64.b64encode(invoice).decode('ascii')
+
+
+def json_call(opener, url, params):
+    """JSON-RPC call of a route of Odoo with the session of the opener"""
+    request = Request(url, data=json.dumps({
+        'jsonrpc': '2.0', 'method': 'call', 'params': params,
+        }).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    response = opener.open(request, timeout=HTTP_TIMEOUT)
+    res = json.loads(response.read().decode('utf-8'))
+    if res.get('error'):
+        error = res['error']
+        raise Exception(
+            error.get('data', {}).get('message') or error.get('message'))
+    return res['result']
+
+
+def http_connect(base_url, database, username, pwd):
+    """Returns an URL opener that has a session on Odoo, used to upload
+    the files to the controller /account_invoice_import/upload"""
+    opener = build_opener(HTTPCookieProcessor())
+    session_info = json_call(
+        opener, base_url + '/web/session/authenticate',
+        {'db': database, 'login': username, 'password': pwd})
+    if not session_info.get('uid'):
+        raise Exception('Authentication failed for user %s' % username)
+    return opener
+
+
+def get_thread_http_session(options, pwd):
+    """Returns (opener, base_url) for the upload of the files"""
+    if getattr(thread_data, 'http_session', None) is None:
+        base_url = '%s://%s:%d' % (
+            options.no_ssl and 'http' or 'https', options.server,
+            options.port)
+        thread_data.http_session = (http_connect(
+            base_url, options.database, options.username, pwd), base_url)
+    return thread_data.http_session
+
+
+def upload_file(opener, base_url, file_path):
+    """Stream the file to Odoo and returns the ID of the attachment"""
+    filename = os.path.basename(file_path)
+    csrf_token = json_call(
+        opener, base_url + '/account_invoice_import/upload_token', {})
+    url = base_url + '/account_invoice_import/upload?%s' % urlencode(
+        {'filename': filename, 'csrf_token': csrf_token})
+    with open(file_path, 'rb') as f:
+        request = Request(url, data=f, headers={
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': str(os.path.getsize(file_path)),
+            })
+        response = opener.open(request, timeout=HTTP_TIMEOUT)
+        res = json.loads(response.read().decode('utf-8'))
+    logger.debug('File %s uploaded in attachment ID %d', filename,
+                 res['attachment_id'])
+    return res['attachment_id']
+
+
+def send_file(odoo, file_path, http_session=None):
+    """http_session is (opener, base_url) to upload the file to the
+    controller of the module (--stream-upload)"""
+    filename = os.path.basename(file_path)
+    try:
+        if http_session:
+            if not check_invoice_file(file_path):
+                return False
+            logger.info('Starting to upload file %s to Odoo', filename)
+            wiz_vals = {'invoice_attachment_id': upload_file(
+                http_session[0], http_session[1], file_path)}
+        else:
+            inv_b64 = read_invoice_file(file_path)
+            if not inv_b64:
+                return False
+            logger.info('Starting to upload file %s to Odoo', filename)
+            wiz_vals = {'invoice_file': inv_b64}
+        wiz_vals['invoice_filename'] = filename
+        wiz_id = odoo.execute('account.invoice.import', 'create', wiz_vals)
         logger.debug("account.invoice.import wizard_id=%d", wiz_id)
-        try:
-            action = odoo.execute(
-                'account.invoice.import', 'create_invoice_action', wiz_id)
-            if action.get('res_id'):
-                logger.info(
-                    'Invoice ID %d successfully created in Odoo',
-                    action['res_id'])
+        action = odoo.execute(
+            'account.invoice.import', 'create_invoice_action', wiz_id)
+        if action.get('res_id'):
+            logger.info(
+                'Invoice ID %d successfully created in Odoo',
+                action['res_id'])
+            with result_lock:
                 invoice_ids.append(action['res_id'])
-                return 'success'
-            else:
-                logger.debug("action=%s", action)
-                logger.warning('Very strange: no res_id key in action')
+            return 'success'
+        else:
+            logger.debug("action=%s", action)
+            logger.warning('Very strange: no res_id key in action')
+            with result_lock:
                 fail_files.append(filename)
-                return 'failure'
-        except Exception as e:
-            logger.warning(
-                'Odoo failed to import file %s. Reason: %s', filename, e)
-            fail_files.append(filename)
             return 'failure'
-    else:
+    except Exception as e:
         logger.warning(
-            'Filetype of file %s is %s. Skipping.', filename, filetype)
-        return False
+            'Odoo failed to import file %s. Reason: %s', filename, e)
+        with result_lock:
+            fail_files.append(filename)
+        return 'failure'
+
+
+def send_files(odoo, directory, entries):
+    """Import the files with one call to Odoo.
+    Returns the list of the entries that failed"""
+    invoice_files = []
+    failed_entries = []
+    for entry in entries:
+        try:
+            inv_b64 = read_invoice_file(os.path.join(directory, entry))
+        except Exception as e:
+            logger.warning('Failed to read file %s. Reason: %s', entry, e)
+            with result_lock:
+                fail_files.append(entry)
+            failed_entries.append(entry)
+            continue
+        if inv_b64:
+            invoice_files.append((entry, inv_b64))
+    if not invoice_files:
+        return failed_entries
+    logger.info('Starting to upload %d files to Odoo', len(invoice_files))
+    try:
+        results = odoo.execute(
+            'account.invoice.import', 'import_invoice_files', invoice_files)
+    except Exception as e:
+        logger.warning(
+            'Odoo failed to import the batch of files %s. Reason: %s',
+            ', '.join([entry for (entry, inv_b64) in invoice_files]), e)
+        results = [{
+            'filename': entry,
+            'state': 'error',
+            'invoice_id': False,
+            'message': str(e),
+            } for (entry, inv_b64) in invoice_files]
+    for result in results:
+        if result['state'] == 'created':
+            logger.info(
+                'Invoice ID %d successfully created in Odoo from file %s',
+                result['invoice_id'], result['filename'])
+            with result_lock:
+                invoice_ids.append(result['invoice_id'])
+        else:
+            logger.warning(
+                'Odoo failed to import file %s. Reason: %s',
+                result['filename'], result['message'])
+            with result_lock:
+                fail_files.append(result['filename'])
+            failed_entries.append(result['filename'])
+    return failed_entries
 
 
 def update_fail_subdir(directory, fail_subdir):
@@ -126,6 +300,88 @@ def update_fail_subdir(directory, fail_subdir):
     return True
 
 
+def move_failed_file(directory, entry, options):
+    file_path = os.path.join(directory, entry)
+    with result_lock:
+        if directory not in fail_subdir_ok:
+            update_fail_subdir(directory, options.fail_subdir)
+        fail_dir_path = fail_subdir_ok[directory]
+    if fail_dir_path:
+        logger.info(
+            'Moving file %s to sub-directory %s', entry, options.fail_subdir)
+        os.rename(file_path, os.path.join(fail_dir_path, entry))
+
+
+def iter_dir_chunks(directory, options):
+    """Yields the lists of files of the directory that are sent together
+    to Odoo (one file per list without --batch-size)"""
+    size = max(options.batch_size, 1)
+    chunk = []
+    for entry in os.listdir(directory):
+        file_path = os.path.join(directory, entry)
+        logger.debug('file_path=%s', entry)
+        if os.path.isfile(file_path):
+            chunk.append(entry)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_dir_files(odoo, directory, entries, options, http_session=None):
+    if options.batch_size > 1:
+        failed_entries = send_files(odoo, directory, entries)
+    else:
+        failed_entries = [
+            entry for entry in entries
+            if send_file(
+                odoo, os.path.join(directory, entry),
+                http_session=http_session) == 'failure']
+    if not options.no_move_failed:
+        for entry in failed_entries:
+            move_failed_file(directory, entry, options)
+
+
+def parallel_import_dir_files(directory, entries, options, pwd):
+    try:
+        odoo = get_thread_odoo(options, pwd)
+        http_session = options.stream_upload and\
+            get_thread_http_session(options, pwd) or None
+    except Exception as e:
+        logger.error(
+            "Failed to connect to Odoo to import files %s. Error: %s",
+            ', '.join(entries), e)
+        with result_lock:
+            fail_files.extend(entries)
+        return
+    import_dir_files(
+        odoo, directory, entries, options, http_session=http_session)
+
+
+def parallel_import(directories, options, pwd):
+    """Import the files of the directories with options.workers threads.
+    At most 2 files (or batches of files) per worker are in-flight, so
+    that the listing of a big directory is not loaded at once in the
+    queue of the pool"""
+    in_flight = threading.BoundedSemaphore(options.workers * 2)
+
+    def release(future):
+        in_flight.release()
+        if future.exception():
+            logger.error('Unexpected error: %s', future.exception())
+
+    with ThreadPoolExecutor(max_workers=options.workers) as executor:
+        for directory in directories:
+            logger.info("Start working on directory %s", directory)
+            for entries in iter_dir_chunks(directory, options):
+                in_flight.acquire()
+                future = executor.submit(
+                    parallel_import_dir_files, directory, entries, options,
+                    pwd)
+                future.add_done_callback(release)
+
+
 def main(options, arguments):
     # print 'options = %s' % options
     # print 'arguments = %s' % arguments
@@ -162,6 +418,12 @@ def main(options, arguments):
             logger.error(
                 "Cannot connect with an empty password. Re-enter a password.")
         first_login = False
+    if options.stream_upload and options.batch_size > 1:
+        logger.error('--stream-upload and --batch-size are not compatible.')
+        sys.exit(1)
+    if options.workers < 1:
+        logger.error('The number of workers must be at least 1.')
+        sys.exit(1)
     if not arguments:
         logger.error(
             "Missing directory argument. You should pass to the "
@@ -173,38 +435,30 @@ def main(options, arguments):
         options.server, options.port, proto, options.database,
         options.username)
     try:
-        odoo = odoorpc.ODOO(options.server, proto, options.port)
-        odoo.login(options.database, options.username, pwd)
+        odoo = connect(options, pwd)
+        http_session = options.stream_upload and\
+            get_thread_http_session(options, pwd) or None
         logger.info('Successfully connected to Odoo')
     except Exception as e:
         logger.error("Failed to connect to Odoo. Error: %s", e)
         sys.exit(1)
 
+    if options.workers > 1:
+        logger.info('Importing files with %d workers', options.workers)
+        parallel_import([
+            directory for directory in arguments
+            if os.path.isdir(directory)], options, pwd)
     for directory in arguments:
         if os.path.isdir(directory):
+            if options.workers > 1:
+                continue
             logger.info("Start working on directory %s", directory)
-            fail_dir_path = False
-            for entry in os.listdir(directory):
-                file_path = os.path.join(directory, entry)
-                logger.debug('file_path=%s', entry)
-                if os.path.isfile(file_path):
-                    res = send_file(odoo, file_path)
-                    if res == 'failure':
-                        if not options.no_move_failed:
-                            if directory not in fail_subdir_ok:
-                                update_fail_subdir(
-                                    directory, options.fail_subdir)
-                            fail_dir_path = fail_subdir_ok[directory]
-                            if fail_dir_path:
-                                logger.info(
-                                    'Moving file %s to sub-directory %s',
-                                    entry, options.fail_subdir)
-                                os.rename(
-                                    file_path,
-                                    os.path.join(fail_dir_path, entry))
-
+            for entries in iter_dir_chunks(directory, options):
+                import_dir_files(
+                    odoo, directory, entries, options,
+                    http_session=http_session)
         elif os.path.isfile(directory):
-            res = send_file(odoo, directory)
+            send_file(odoo, directory, http_session=http_session)
         else:
             logger.warning(
                 "%s is not a directory nor a file. Skipped." % directory)
@@ -1,9 +1,24 @@
 # © 2017 Akretion (Alexis de Lattre <alexis.delattre@akretion.com>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-from odoo.tests.common import TransactionCase
+import base64
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+
+from odoo.exceptions import UserError
+from odoo.modules.module import get_module_resource
+from odoo.tests.common import HOST, PORT, HttpCase, TransactionCase,\
+    get_db_name
 from odoo.tools import float_compare
 
+try:
+    import odoorpc
+except ImportError:
+    odoorpc = None
+
 
 class TestInvoiceImport(TransactionCase):
 
@@ -133,3 +148,161 @@ class TestInvoiceImport(TransactionCase):
                 inv.amount_untaxed, 30.66, precision_rounding=prec))
             self.assertFalse(float_compare(
                 inv.amount_total, 30.97, precision_rounding=prec))
+
+    def test_import_in_invoice_many_lines(self):
+        parsed_inv = {
+            'type': 'in_invoice',
+            'amount_untaxed': 100.0,
+            'amount_total': 101.0,
+            'invoice_number': 'INV-2017-9877',
+            'date_invoice': '2017-08-16',
+            'partner': {
+                'name': 'Wood Corner',
+            },
+            'lines': [{
+                'product': {'code': 'AII-TEST-PRODUCT'},
+                'name': 'Test product line %d' % i,
+                'qty': 1,
+                'price_unit': 5,
+                'taxes': [{
+                    'amount_type': 'percent',
+                    'amount': 1.0,
+                    'unece_type_code': 'VAT',
+                    'unece_categ_code': 'S',
+                }],
+            } for i in range(20)]
+        }
+        for import_config in self.all_import_config:
+            if not import_config['invoice_line_method'].startswith('nline'):
+                continue
+            inv = self.env['account.invoice.import'].create_invoice(
+                dict(parsed_inv), import_config)
+            prec = inv.currency_id.rounding
+            self.assertEqual(len(inv.invoice_line_ids), 20)
+            self.assertEqual(
+                inv.invoice_line_ids.mapped('name'),
+                ['Test product line %d' % i for i in range(20)])
+            self.assertEqual(len(inv.tax_line_ids), 1)
+            self.assertFalse(float_compare(
+                inv.amount_untaxed, 100.0, precision_rounding=prec))
+            self.assertFalse(float_compare(
+                inv.amount_total, 101.0, precision_rounding=prec))
+
+    def test_line_product_onchange_cache(self):
+        aiio = self.env['account.invoice.import']
+        partner = self.env.ref('base.res_partner_1')
+        invoice_vals = {
+            'type': 'in_invoice',
+            'partner_id': partner.id,
+            'company_id': self.env.user.company_id.id,
+            'currency_id': self.env.user.company_id.currency_id.id,
+            'fiscal_position_id': False,
+            }
+        onchange_cache = {}
+        il_vals = aiio._get_line_product_onchange_vals(
+            self.product, invoice_vals, onchange_cache=onchange_cache)
+        self.assertEqual(il_vals['account_id'], self.expense_account.id)
+        self.assertEqual(len(onchange_cache), 1)
+        self.assertTrue(il_vals['invoice_line_tax_ids'])
+        # the cached values are returned as a deep copy
+        il_vals['name'] = 'Modified'
+        il_vals['invoice_line_tax_ids'][:] = []
+        il_vals2 = aiio._get_line_product_onchange_vals(
+            self.product, invoice_vals, onchange_cache=onchange_cache)
+        self.assertNotEqual(il_vals2['name'], 'Modified')
+        self.assertTrue(il_vals2['invoice_line_tax_ids'])
+        self.assertEqual(len(onchange_cache), 1)
+        invoice_vals['date_invoice'] = '2017-08-16'
+        aiio._get_line_product_onchange_vals(
+            self.product, invoice_vals, onchange_cache=onchange_cache)
+        self.assertEqual(len(onchange_cache), 2)
+        invoice_vals['type'] = 'out_invoice'
+        il_vals3 = aiio._get_line_product_onchange_vals(
+            self.product, invoice_vals, onchange_cache=onchange_cache)
+        self.assertEqual(il_vals3['account_id'], self.income_account.id)
+        self.assertEqual(len(onchange_cache), 3)
+
+    def test_mail_invalid_attachment(self):
+        company = self.env.user.company_id
+        company.invoice_import_email = 'invoices@example.com'
+        attachment = self.env['mail.thread']._Attachment(
+            'invoice.xml', b'<Invoice><ID>INV-1</ID>', {})
+        msg_dict = {
+            'email_from': 'supplier@example.com',
+            'to': 'invoices@example.com',
+            'cc': '',
+            'subject': 'Invoice INV-1',
+            'date': '2017-08-16 10:00:00',
+            'message_id': '<invoice-1@example.com>',
+            'attachments': [attachment],
+            }
+        invoice_count = self.env['account.invoice'].search_count([])
+        # as before, an attachment that can't be imported aborts the email
+        with self.assertRaises(UserError):
+            self.env['account.invoice.import'].message_new(msg_dict)
+        self.assertEqual(
+            self.env['account.invoice'].search_count([]), invoice_count)
+
+
+class TestInvoiceImportUpload(HttpCase):
+
+    def _get_upload_token(self):
+        response = self.url_open(
+            '/account_invoice_import/upload_token',
+            data=json.dumps({'params': {}}),
+            headers={'Content-Type': 'application/json'})
+        return response.json()['result']
+
+    def test_upload_invoice_file(self):
+        self.authenticate('admin', 'admin')
+        content = b'<?xml version="1.0"?><Invoice>' + b'X' * 3000000 +\
+            b'</Invoice>'
+        # the upload is refused without CSRF token
+        response = self.url_open(
+            '/account_invoice_import/upload?filename=invoice.xml',
+            data=content)
+        self.assertEqual(response.status_code, 400)
+        response = self.url_open(
+            '/account_invoice_import/upload?filename=invoice.xml'
+            '&csrf_token=%s' % self._get_upload_token(),
+            data=content)
+        self.assertEqual(response.status_code, 200)
+        attachment = self.env['ir.attachment'].browse(
+            json.loads(response.text)['attachment_id'])
+        self.assertEqual(attachment.datas_fname, 'invoice.xml')
+        self.assertEqual(attachment.file_size, len(content))
+        self.assertEqual(base64.b64decode(attachment.datas), content)
+        wiz = self.env['account.invoice.import'].create({
+            'invoice_attachment_id': attachment.id,
+            })
+        invoice_file_b64, invoice_filename = wiz._get_invoice_file()
+        self.assertEqual(invoice_filename, 'invoice.xml')
+        self.assertEqual(base64.b64decode(invoice_file_b64), content)
+        # the files bigger than the maximum size are refused
+        self.env['ir.config_parameter'].set_param(
+            'account_invoice_import.upload_max_size', '1000000')
+        response = self.url_open(
+            '/account_invoice_import/upload?filename=invoice.xml'
+            '&csrf_token=%s' % self._get_upload_token(),
+            data=content)
+        self.assertEqual(response.status_code, 413)
+
+    @unittest.skipIf(odoorpc is None, 'odoorpc is not installed')
+    def test_mass_invoice_import_upload_file(self):
+        script_path = get_module_resource(
+            'account_invoice_import', 'scripts', 'mass_invoice_import.py')
+        spec = importlib.util.spec_from_file_location(
+            'mass_invoice_import', script_path)
+        script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(script)
+        base_url = 'http://%s:%s' % (HOST, PORT)
+        opener = script.http_connect(base_url, get_db_name(), 'admin', 'admin')
+        content = b'<?xml version="1.0"?><Invoice/>'
+        with tempfile.NamedTemporaryFile(suffix='.xml') as f:
+            f.write(content)
+            f.flush()
+            attachment_id = script.upload_file(opener, base_url, f.name)
+            filename = os.path.basename(f.name)
+        attachment = self.env['ir.attachment'].browse(attachment_id)
+        self.assertEqual(attachment.datas_fname, filename)
+        self.assertEqual(base64.b64decode(attachment.datas), content)
@@ -3,6 +3,8 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 import base64
+import copy
+import hashlib
 from odoo import api, fields, models, _
 import odoo.addons.decimal_precision as dp
 from odoo.tools import float_compare, float_round, float_is_zero, config
@@ -10,18 +12,30 @@ from odoo.exceptions import UserError
 from lxml import etree
 import logging
 from datetime import datetime
+from itertools import islice
 import mimetypes
 
 logger = logging.getLogger(__name__)
 
+# XML files imported from an attachment are parsed in streaming mode
+# (parse_xml_invoice_stream()) above this size, in bytes. It can be changed
+# with the system parameter account_invoice_import.stream_min_file_size
+STREAM_MIN_FILE_SIZE = 10 * 1024 * 1024
+# Number of invoice lines created at once in streaming mode. It can be
+# changed with the system parameter account_invoice_import.stream_batch_size
+STREAM_BATCH_SIZE = 500
+
 
 class AccountInvoiceImport(models.TransientModel):
     _name = 'account.invoice.import'
     _description = 'Wizard to import supplier invoices/refunds'
 
-    invoice_file = fields.Binary(
-        string='PDF or XML Invoice', required=True)
+    invoice_file = fields.Binary(string='PDF or XML Invoice')
     invoice_filename = fields.Char(string='Filename')
+    # Alternative to invoice_file, for files uploaded via the controller
+    # /account_invoice_import/upload
+    invoice_attachment_id = fields.Many2one(
+        'ir.attachment', string='Invoice Attachment', ondelete='cascade')
     state = fields.Selection([
         ('import', 'Import'),
         ('config', 'Select Invoice Import Configuration'),
@@ -69,18 +83,45 @@ class AccountInvoiceImport(models.TransientModel):
     def parse_xml_invoice(self, xml_root):
         return False
 
+    @api.model
+    def parse_xml_invoice_stream(self, attachment):
+        """Designed to be inherited by the modules of the XML formats that
+        support the import of very large files in streaming mode. It must
+        return the parsed invoice without its lines, with a generator
+        that yields the lines one by one in the 'lines_stream' key,
+        or False if the format of the file is not supported"""
+        return False
+
+    @api.model
+    def _use_stream_import(self, attachment, invoice_filename):
+        filetype = mimetypes.guess_type(invoice_filename)
+        if not filetype or filetype[0] not in ['application/xml', 'text/xml']:
+            return False
+        min_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'account_invoice_import.stream_min_file_size',
+            STREAM_MIN_FILE_SIZE))
+        return attachment.file_size >= min_size
+
     @api.model
     def parse_pdf_invoice(self, file_data):
         '''This method must be inherited by additional modules with
         the same kind of logic as the account_bank_statement_import_*
         modules'''
         bdio = self.env['business.document.import']
-        xml_files_dict = bdio.get_xml_files_from_pdf(file_data)
-        for xml_filename, xml_root in xml_files_dict.items():
+        # the embedded XML files are extracted one by one, and we stop
+        # at the first one that is supported
+        for xml_filename, xml_root in bdio.iter_xml_files_from_pdf(
+                file_data):
             logger.info('Trying to parse XML file %s', xml_filename)
             parsed_inv = self.parse_xml_invoice(xml_root)
             if parsed_inv:
                 return parsed_inv
+        # file_data is a file object when the invoice is imported from an
+        # attachment (cf parse_invoice_attachment()), but the fallback
+        # parsers work on the content of the file
+        if not isinstance(file_data, bytes):
+            file_data.seek(0)
+            file_data = file_data.read()
         parsed_inv = self.fallback_parse_pdf_invoice(file_data)
         if not parsed_inv:
             raise UserError(_(
@@ -169,18 +210,16 @@ class AccountInvoiceImport(models.TransientModel):
         # create_invoice() but only with 'nline_*' invoice import methods.
 
     @api.model
-    def _prepare_create_invoice_vals(self, parsed_inv, import_config=False):
+    def _prepare_create_invoice_vals(
+            self, parsed_inv, import_config=False, onchange_cache=None):
         assert parsed_inv.get('pre-processed'), 'pre-processing not done'
         # WARNING: on future versions, import_config will probably become
         # a required argument
         aio = self.env['account.invoice']
-        ailo = self.env['account.invoice.line']
         bdio = self.env['business.document.import']
         rpo = self.env['res.partner']
         company = self.env['res.company'].browse(
             self.env.context.get('force_company')) or self.env.user.company_id
-        start_end_dates_installed = hasattr(ailo, 'start_date') and\
-            hasattr(ailo, 'end_date')
         if parsed_inv['type'] in ('out_invoice', 'out_refund'):
             partner_type = 'customer'
         else:
@@ -204,6 +243,7 @@ class AccountInvoiceImport(models.TransientModel):
             'date_invoice': parsed_inv.get('date'),
             'journal_id': journal_id,
             'invoice_line_ids': [],
+            'import_file_sha256': parsed_inv.get('import_file_sha256'),
         }
         vals = aio.play_onchanges(vals, ['partner_id'])
         vals['invoice_line_ids'] = []
@@ -241,10 +281,8 @@ class AccountInvoiceImport(models.TransientModel):
                     'price_unit': parsed_inv.get('amount_untaxed'),
                     }
             elif config['invoice_line_method'] == '1line_static_product':
-                product = config['product']
-                il_vals = {'product_id': product.id, 'invoice_id': vals}
-                il_vals = ailo.play_onchanges(il_vals, ['product_id'])
-                il_vals.pop('invoice_id')
+                il_vals = self._get_line_product_onchange_vals(
+                    config['product'], vals, onchange_cache=onchange_cache)
             if config.get('label'):
                 il_vals['name'] = config['label']
             elif parsed_inv.get('description'):
@@ -255,66 +293,135 @@ class AccountInvoiceImport(models.TransientModel):
             self.set_1line_start_end_dates(il_vals, parsed_inv)
             vals['invoice_line_ids'].append((0, 0, il_vals))
         elif config['invoice_line_method'].startswith('nline'):
-            if not parsed_inv.get('lines'):
+            # In streaming mode, the lines are created after the invoice
+            # by _create_invoice_lines_stream()
+            if 'lines_stream' in parsed_inv:
+                pass
+            elif not parsed_inv.get('lines'):
                 raise UserError(_(
                     "You have selected a Multi Line method for this import "
                     "but Odoo could not extract/read any XML file inside "
                     "the PDF invoice."))
+            else:
+                vals['invoice_line_ids'] += [
+                    (0, 0, il_vals) for il_vals in
+                    self._prepare_create_invoice_lines_vals(
+                        parsed_inv, parsed_inv['lines'], vals, config,
+                        partner, onchange_cache=onchange_cache)]
+        # Write analytic account + fix syntax for taxes
+        aacount_id = config.get('account_analytic') and\
+            config['account_analytic'].id or False
+        if aacount_id:
+            for line in vals['invoice_line_ids']:
+                line[2]['account_analytic_id'] = aacount_id
+        return (vals, config)
+
+    @api.model
+    def _get_line_product_onchange_vals(
+            self, product, invoice_vals, onchange_cache=None):
+        """Returns the vals of an invoice line given by the onchange of the
+        product. The result of the onchange only depends on the product and
+        on a few fields of the invoice, so it is kept in onchange_cache
+        (a dict shared by all the invoices of an import batch) and played
+        only once for the same inputs"""
+        key = (
+            product.id,
+            invoice_vals.get('type'),
+            invoice_vals.get('partner_id'),
+            invoice_vals.get('company_id'),
+            invoice_vals.get('fiscal_position_id'),
+            invoice_vals.get('currency_id'),
+            invoice_vals.get('date_invoice'),
+            )
+        if onchange_cache is None or key not in onchange_cache:
+            il_vals = {'product_id': product.id, 'invoice_id': invoice_vals}
+            il_vals = self.env['account.invoice.line'].play_onchanges(
+                il_vals, ['product_id'])
+            il_vals.pop('invoice_id')
+            if onchange_cache is None:
+                return il_vals
+            onchange_cache[key] = il_vals
+        # deep copy, because the vals contain lists of commands (taxes...)
+        return copy.deepcopy(onchange_cache[key])
+
+    @api.model
+    def _prepare_create_invoice_lines_vals(
+            self, parsed_inv, lines, invoice_vals, config, partner,
+            line_cache=None, onchange_cache=None):
+        """Returns the list of the vals of the invoice lines for a
+        Multi Line method. line_cache is a dict that keeps the data
+        shared by the lines between the calls, when the lines of the
+        same invoice are prepared by batches (streaming mode).
+        onchange_cache is the cache of _get_line_product_onchange_vals()"""
+        ailo = self.env['account.invoice.line']
+        bdio = self.env['business.document.import']
+        if line_cache is None:
+            line_cache = {}
+        if onchange_cache is None:
+            onchange_cache = {}
+        if 'static_vals' not in line_cache:
             if config['invoice_line_method'] == 'nline_no_product':
                 static_vals = {
                     'account_id': config['account'].id,
                     }
             elif config['invoice_line_method'] == 'nline_static_product':
-                sproduct = config['product']
-                static_vals = {'product_id': sproduct.id, 'invoice_id': vals}
-                static_vals = ailo.play_onchanges(static_vals, ['product_id'])
-                static_vals.pop('invoice_id')
+                static_vals = self._get_line_product_onchange_vals(
+                    config['product'], invoice_vals,
+                    onchange_cache=onchange_cache)
             else:
                 static_vals = {}
-            for line in parsed_inv['lines']:
-                il_vals = static_vals.copy()
-                if config['invoice_line_method'] == 'nline_auto_product':
-                    product = bdio._match_product(
-                        line['product'], parsed_inv['chatter_msg'],
-                        seller=partner)
-                    il_vals = {'product_id': product.id, 'invoice_id': vals}
-                    il_vals = ailo.play_onchanges(il_vals, ['product_id'])
-                    il_vals.pop('invoice_id')
-                elif config['invoice_line_method'] == 'nline_no_product':
-                    taxes = bdio._match_taxes(
-                        line.get('taxes'), parsed_inv['chatter_msg'])
-                    il_vals['invoice_line_tax_ids'] = [(6, 0, taxes.ids)]
-                if not il_vals.get('account_id') and il_vals.get('product_id'):
-                    product = self.env['product.product'].browse(
-                        il_vals['product_id'])
-                    raise UserError(_(
-                        "Account missing on product '%s' or on it's related "
-                        "category '%s'.") % (product.display_name,
-                                             product.categ_id.display_name))
-                if line.get('name'):
-                    il_vals['name'] = line['name']
-                elif not il_vals.get('name'):
-                    il_vals['name'] = _('MISSING DESCRIPTION')
-                if start_end_dates_installed:
-                    il_vals['start_date'] =\
-                        line.get('date_start') or parsed_inv.get('date_start')
-                    il_vals['end_date'] =\
-                        line.get('date_end') or parsed_inv.get('date_end')
-                uom = bdio._match_uom(
-                    line.get('uom'), parsed_inv['chatter_msg'])
-                il_vals['uom_id'] = uom.id
-                il_vals.update({
-                    'quantity': line['qty'],
-                    'price_unit': line['price_unit'],  # TODO fix for tax incl
-                    })
-                vals['invoice_line_ids'].append((0, 0, il_vals))
-        # Write analytic account + fix syntax for taxes
+            line_cache['static_vals'] = static_vals
+        static_vals = line_cache['static_vals']
+        if config['invoice_line_method'] == 'nline_auto_product':
+            product_speed_dict = bdio._prepare_product_speed_dict(
+                [line['product'] for line in lines])
+        start_end_dates_installed = hasattr(ailo, 'start_date') and\
+            hasattr(ailo, 'end_date')
+        if config['invoice_line_method'] == 'nline_no_product':
+            lines_taxes = bdio._match_taxes_lines(
+                [line.get('taxes') for line in lines],
+                parsed_inv['chatter_msg'])
         aacount_id = config.get('account_analytic') and\
             config['account_analytic'].id or False
-        if aacount_id:
-            for line in vals['invoice_line_ids']:
-                line[2]['account_analytic_id'] = aacount_id
-        return (vals, config)
+        lines_vals = []
+        for i, line in enumerate(lines):
+            il_vals = static_vals.copy()
+            if config['invoice_line_method'] == 'nline_auto_product':
+                product = bdio._match_product(
+                    line['product'], parsed_inv['chatter_msg'],
+                    seller=partner, speed_dict=product_speed_dict)
+                il_vals = self._get_line_product_onchange_vals(
+                    product, invoice_vals, onchange_cache=onchange_cache)
+            elif config['invoice_line_method'] == 'nline_no_product':
+                il_vals['invoice_line_tax_ids'] = [
+                    (6, 0, lines_taxes[i].ids)]
+            if not il_vals.get('account_id') and il_vals.get('product_id'):
+                product = self.env['product.product'].browse(
+                    il_vals['product_id'])
+                raise UserError(_(
+                    "Account missing on product '%s' or on it's related "
+                    "category '%s'.") % (product.display_name,
+                                         product.categ_id.display_name))
+            if line.get('name'):
+                il_vals['name'] = line['name']
+            elif not il_vals.get('name'):
+                il_vals['name'] = _('MISSING DESCRIPTION')
+            if start_end_dates_installed:
+                il_vals['start_date'] =\
+                    line.get('date_start') or parsed_inv.get('date_start')
+                il_vals['end_date'] =\
+                    line.get('date_end') or parsed_inv.get('date_end')
+            uom = bdio._match_uom(
+                line.get('uom'), parsed_inv['chatter_msg'])
+            il_vals['uom_id'] = uom.id
+            il_vals.update({
+                'quantity': line['qty'],
+                'price_unit': line['price_unit'],  # TODO fix for tax incl
+                })
+            if aacount_id:
+                il_vals['account_analytic_id'] = aacount_id
+            lines_vals.append(il_vals)
+        return lines_vals
 
     @api.model
     def set_1line_price_unit_and_quantity(self, il_vals, parsed_inv):
@@ -361,24 +468,98 @@ class AccountInvoiceImport(models.TransientModel):
             return True
         return False
 
+    @api.multi
+    def _get_invoice_file(self):
+        """Returns (invoice_file_b64, invoice_filename) of the wizard"""
+        self.ensure_one()
+        if self.invoice_file:
+            return self.invoice_file, self.invoice_filename
+        if self.invoice_attachment_id:
+            return (
+                self.invoice_attachment_id.datas,
+                self.invoice_filename or
+                self.invoice_attachment_id.datas_fname)
+        raise UserError(_("You must upload a PDF or XML invoice."))
+
     @api.model
-    def parse_invoice(self, invoice_file_b64, invoice_filename):
-        assert invoice_file_b64, 'No invoice file'
-        logger.info('Starting to import invoice %s', invoice_filename)
-        file_data = base64.b64decode(invoice_file_b64)
+    def _get_attachment_sha256(self, attachment):
+        """Returns the SHA-256 of the file of the attachment, read chunk by
+        chunk from the filestore"""
+        bdio = self.env['business.document.import']
+        sha = hashlib.sha256()
+        with bdio._open_attachment_file(attachment) as file_data:
+            while True:
+                chunk = file_data.read(1024 * 1024)
+                if not chunk:
+                    break
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @api.model
+    def invoice_already_imported(self, invoice_file_b64, file_sha256=None):
+        """Returns the invoice that has already been imported from the
+        same file (same SHA-256), without parsing the file.
+        When the SHA-256 of the file is given, invoice_file_b64 is not
+        used."""
+        company_id = self.env.context.get('force_company') or\
+            self.env.user.company_id.id
+        if not file_sha256:
+            file_sha256 = hashlib.sha256(
+                base64.b64decode(invoice_file_b64)).hexdigest()
+        return self.env['account.invoice'].search([
+            ('import_file_sha256', '=', file_sha256),
+            ('company_id', '=', company_id),
+            ], limit=1)
+
+    @api.model
+    def check_invoice_not_imported(self, invoice_file_b64, file_sha256=None):
+        existing_inv = self.invoice_already_imported(
+            invoice_file_b64, file_sha256=file_sha256)
+        if existing_inv:
+            raise UserError(_(
+                "This file has already been imported as invoice '%s'.")
+                % existing_inv.display_name)
+
+    @api.multi
+    def _parse_wizard_invoice(self, check_not_imported=True):
+        """Parse the file of the wizard. When the file has been uploaded
+        in an attachment, it is read from the filestore and the attachment
+        is then linked to the invoice"""
+        self.ensure_one()
+        if not self.invoice_file and self.invoice_attachment_id:
+            attachment = self.invoice_attachment_id
+            file_sha256 = self._get_attachment_sha256(attachment)
+            if check_not_imported:
+                self.check_invoice_not_imported(
+                    False, file_sha256=file_sha256)
+            return self.parse_invoice_attachment(
+                attachment, self.invoice_filename, file_sha256=file_sha256)
+        invoice_file_b64, invoice_filename = self._get_invoice_file()
+        if check_not_imported:
+            self.check_invoice_not_imported(invoice_file_b64)
+        return self.parse_invoice(invoice_file_b64, invoice_filename)
+
+    @api.model
+    def _parse_invoice_data(self, file_data, invoice_filename):
+        """file_data is the content of the file as bytes or as a binary
+        file object"""
         filetype = mimetypes.guess_type(invoice_filename)
         logger.debug('Invoice mimetype: %s', filetype)
         if filetype and filetype[0] in ['application/xml', 'text/xml']:
             try:
-                xml_root = etree.fromstring(file_data)
+                if isinstance(file_data, bytes):
+                    xml_root = etree.fromstring(file_data)
+                else:
+                    xml_root = etree.parse(file_data).getroot()
             except Exception as e:
                 raise UserError(_(
                     "This XML file is not XML-compliant. Error: %s") % e)
-            pretty_xml_string = etree.tostring(
-                xml_root, pretty_print=True, encoding='UTF-8',
-                xml_declaration=True)
-            logger.debug('Starting to import the following XML file:')
-            logger.debug(pretty_xml_string)
+            if logger.isEnabledFor(logging.DEBUG):
+                pretty_xml_string = etree.tostring(
+                    xml_root, pretty_print=True, encoding='UTF-8',
+                    xml_declaration=True)
+                logger.debug('Starting to import the following XML file:')
+                logger.debug(pretty_xml_string)
             parsed_inv = self.parse_xml_invoice(xml_root)
             if parsed_inv is False:
                 raise UserError(_(
@@ -388,14 +569,57 @@ class AccountInvoiceImport(models.TransientModel):
         # Fallback on PDF
         else:
             parsed_inv = self.parse_pdf_invoice(file_data)
+        return parsed_inv
+
+    @api.model
+    def parse_invoice(self, invoice_file_b64, invoice_filename):
+        assert invoice_file_b64, 'No invoice file'
+        logger.info('Starting to import invoice %s', invoice_filename)
+        file_data = base64.b64decode(invoice_file_b64)
+        parsed_inv = self._parse_invoice_data(file_data, invoice_filename)
         if 'attachments' not in parsed_inv:
             parsed_inv['attachments'] = {}
         parsed_inv['attachments'][invoice_filename] = invoice_file_b64
+        parsed_inv['import_file_sha256'] = hashlib.sha256(
+            file_data).hexdigest()
         # pre_process_parsed_inv() will be called again a second time,
         # but it's OK
         pp_parsed_inv = self.pre_process_parsed_inv(parsed_inv)
         return pp_parsed_inv
 
+    @api.model
+    def parse_invoice_attachment(
+            self, attachment, invoice_filename=None, file_sha256=None):
+        """Same as parse_invoice() for a file stored in an attachment.
+        The file is memory-mapped from the filestore instead of being
+        decoded from base64, and the attachment itself will be linked to
+        the invoice by post_create_or_update() instead of being copied."""
+        bdio = self.env['business.document.import']
+        invoice_filename = invoice_filename or attachment.datas_fname or\
+            attachment.name
+        logger.info(
+            'Starting to import invoice %s from attachment ID %d',
+            invoice_filename, attachment.id)
+        if not file_sha256:
+            file_sha256 = self._get_attachment_sha256(attachment)
+        parsed_inv = False
+        if self._use_stream_import(attachment, invoice_filename):
+            parsed_inv = self.parse_xml_invoice_stream(attachment)
+            if parsed_inv:
+                logger.info(
+                    'Invoice %s will be imported in streaming mode',
+                    invoice_filename)
+        if not parsed_inv:
+            with bdio._open_attachment_file(attachment) as file_data:
+                parsed_inv = self._parse_invoice_data(
+                    file_data, invoice_filename)
+        if 'attachments' not in parsed_inv:
+            parsed_inv['attachments'] = {}
+        parsed_inv['source_attachment'] = attachment
+        parsed_inv['import_file_sha256'] = file_sha256
+        pp_parsed_inv = self.pre_process_parsed_inv(parsed_inv)
+        return pp_parsed_inv
+
     @api.model
     def pre_process_parsed_inv(self, parsed_inv):
         if parsed_inv.get('pre-processed'):
@@ -406,9 +630,6 @@ class AccountInvoiceImport(models.TransientModel):
         if parsed_inv.get('type') in ('out_invoice', 'out_refund'):
             return parsed_inv
         prec_ac = self.env['decimal.precision'].precision_get('Account')
-        prec_pp = self.env['decimal.precision'].precision_get('Product Price')
-        prec_uom = self.env['decimal.precision'].precision_get(
-            'Product Unit of Measure')
         if 'amount_tax' in parsed_inv and 'amount_untaxed' not in parsed_inv:
             parsed_inv['amount_untaxed'] =\
                 parsed_inv['amount_total'] - parsed_inv['amount_tax']
@@ -426,40 +647,20 @@ class AccountInvoiceImport(models.TransientModel):
                 float_compare(
                 parsed_inv['amount_total'], 0, precision_digits=prec_ac) < 0):
             parsed_inv['type'] = 'in_refund'
+            parsed_inv['negative_refund'] = True
             for entry in ['amount_untaxed', 'amount_total']:
                 parsed_inv[entry] *= -1
-            for line in parsed_inv.get('lines', []):
-                line['qty'] *= -1
-                if 'price_subtotal' in line:
-                    line['price_subtotal'] *= -1
         # Handle the case where we import an invoice with VAT in a company that
         # cannot deduct VAT
         if self.company_cannot_refund_vat():
             parsed_inv['amount_tax'] = 0
             parsed_inv['amount_untaxed'] = parsed_inv['amount_total']
-            for line in parsed_inv.get('lines', []):
-                if line.get('taxes'):
-                    if len(line['taxes']) > 1:
-                        raise UserError(_(
-                            "You are importing an invoice in a company that "
-                            "cannot deduct VAT and the imported invoice has "
-                            "several VAT taxes on the same line (%s). We do "
-                            "not support this scenario for the moment.")
-                            % line.get('name'))
-                    vat_rate = line['taxes'][0].get('amount')
-                    if not float_is_zero(vat_rate, precision_digits=2):
-                        line['price_unit'] = line['price_unit'] *\
-                            (1 + vat_rate/100.0)
-                        line.pop('price_subtotal')
-                        line['taxes'] = []
         # Rounding work
         for entry in ['amount_untaxed', 'amount_total']:
             parsed_inv[entry] = float_round(
                 parsed_inv[entry], precision_digits=prec_ac)
-        for line in parsed_inv.get('lines', []):
-            line['qty'] = float_round(line['qty'], precision_digits=prec_uom)
-            line['price_unit'] = float_round(
-                line['price_unit'], precision_digits=prec_pp)
+        self.pre_process_parsed_inv_lines(
+            parsed_inv, parsed_inv.get('lines', []))
         logger.debug('Result of invoice parsing parsed_inv=%s', parsed_inv)
         # the 'company' dict in parsed_inv is NOT used to auto-detect
         # the company, but to check that we are not importing an
@@ -475,6 +676,41 @@ class AccountInvoiceImport(models.TransientModel):
                 parsed_inv['company'], parsed_inv['chatter_msg'])
         return parsed_inv
 
+    @api.model
+    def pre_process_parsed_inv_lines(self, parsed_inv, lines):
+        """Pre-processing of the lines, called by pre_process_parsed_inv()
+        or, in streaming mode, for each batch of lines"""
+        prec_pp = self.env['decimal.precision'].precision_get('Product Price')
+        prec_uom = self.env['decimal.precision'].precision_get(
+            'Product Unit of Measure')
+        if parsed_inv.get('negative_refund'):
+            for line in lines:
+                line['qty'] *= -1
+                if 'price_subtotal' in line:
+                    line['price_subtotal'] *= -1
+        if self.company_cannot_refund_vat():
+            for line in lines:
+                if line.get('taxes'):
+                    if len(line['taxes']) > 1:
+                        raise UserError(_(
+                            "You are importing an invoice in a company that "
+                            "cannot deduct VAT and the imported invoice has "
+                            "several VAT taxes on the same line (%s). We do "
+                            "not support this scenario for the moment.")
+                            % line.get('name'))
+                    vat_rate = line['taxes'][0].get('amount')
+                    if not float_is_zero(vat_rate, precision_digits=2):
+                        line['price_unit'] = line['price_unit'] *\
+                            (1 + vat_rate/100.0)
+                        line.pop('price_subtotal')
+                        line['taxes'] = []
+        # Rounding work
+        for line in lines:
+            line['qty'] = float_round(line['qty'], precision_digits=prec_uom)
+            line['price_unit'] = float_round(
+                line['price_unit'], precision_digits=prec_pp)
+        return lines
+
     @api.model
     def invoice_already_exists(self, commercial_partner, parsed_inv):
         company_id = self.env.context.get('force_company') or\
@@ -498,8 +734,7 @@ class AccountInvoiceImport(models.TransientModel):
         iaao = self.env['ir.actions.act_window']
         company_id = self.env.context.get('force_company') or\
             self.env.user.company_id.id
-        parsed_inv = self.parse_invoice(
-            self.invoice_file, self.invoice_filename)
+        parsed_inv = self._parse_wizard_invoice()
         partner = bdio._match_partner(
             parsed_inv['partner'], parsed_inv['chatter_msg'])
         partner = partner.commercial_partner_id
@@ -581,8 +816,7 @@ class AccountInvoiceImport(models.TransientModel):
         self.ensure_one()
         iaao = self.env['ir.actions.act_window']
         if parsed_inv is None:
-            parsed_inv = self.parse_invoice(
-                self.invoice_file, self.invoice_filename)
+            parsed_inv = self._parse_wizard_invoice()
         if import_config is None:
             assert self.import_config_id
             import_config = self.import_config_id.convert_to_import_config()
@@ -598,19 +832,240 @@ class AccountInvoiceImport(models.TransientModel):
         return action
 
     @api.model
-    def create_invoice(self, parsed_inv, import_config=False):
+    def import_invoice_files(self, invoice_files):
+        """Import several invoice files in one call. invoice_files is a
+        list of (filename, invoice_file_b64). The partner, product, tax and
+        import config lookups are shared by the files of the batch, and each
+        file is imported in its own savepoint, so that a file that fails
+        doesn't prevent the import of the others. All the files are parsed
+        first, so that the partners of the batch are searched by VAT
+        number with one query (cf _prefetch_partners_vat()).
+        Returns a list of dicts, one per file, in the same order:
+        {
+            'filename': 'invoice1.pdf',
+            'state': 'created',  # or 'exists' or 'error'
+            'invoice_id': 42,  # ID of the created or existing invoice
+            'message': False,  # reason of the failure
+        }
+        """
+        aiico = self.env['account.invoice.import.config']
+        bdio = self.env['business.document.import']
+        company_id = self.env.context.get('force_company') or\
+            self.env.user.company_id.id
+        partner_speed_dict = {}
+        import_configs = {}  # key = partner ID, value = import_config
+        onchange_cache = {}
+        res = []
+
+        def set_already_imported(result, existing_inv):
+            logger.warning(
+                "Batch import: invoice file %s has already "
+                "been imported as invoice ID %d",
+                result['filename'], existing_inv.id)
+            result.update({
+                'state': 'exists',
+                'invoice_id': existing_inv.id,
+                'message': _(
+                    "This file has already been imported as "
+                    "invoice '%s'.") % existing_inv.display_name,
+                })
+
+        # 1st pass: parse the files, so that the partners of the whole
+        # batch can be searched at once
+        parsed_invs = []  # list of (result, parsed_inv, partner_type)
+        file_sha256s = set()
+        duplicate_sha256s = set()  # same file several times in the batch
+        for (filename, invoice_file_b64) in invoice_files:
+            result = {
+                'filename': filename,
+                'state': 'error',
+                'invoice_id': False,
+                'message': False,
+                }
+            res.append(result)
+            try:
+                with self.env.cr.savepoint():
+                    existing_inv = self.invoice_already_imported(
+                        invoice_file_b64)
+                    if existing_inv:
+                        set_already_imported(result, existing_inv)
+                        continue
+                    parsed_inv = self.parse_invoice(
+                        invoice_file_b64, filename)
+                    if parsed_inv['type'] in ('out_invoice', 'out_refund'):
+                        partner_type = 'customer'
+                    else:
+                        partner_type = 'supplier'
+                    parsed_invs.append((result, parsed_inv, partner_type))
+                    file_sha256 = parsed_inv['import_file_sha256']
+                    if file_sha256 in file_sha256s:
+                        duplicate_sha256s.add(file_sha256)
+                    file_sha256s.add(file_sha256)
+            except Exception as e:
+                logger.warning(
+                    'Batch import: failed to parse invoice file %s. '
+                    'Reason: %s', filename, e)
+                result['message'] = isinstance(e, UserError) and e.name or\
+                    str(e)
+        for partner_type in ('customer', 'supplier'):
+            bdio._prefetch_partners_vat([
+                parsed_inv['partner']
+                for (result, parsed_inv, ptype) in parsed_invs
+                if ptype == partner_type],
+                partner_type=partner_type, speed_dict=partner_speed_dict)
+        # 2nd pass: create the invoices
+        for (result, parsed_inv, partner_type) in parsed_invs:
+            filename = result['filename']
+            try:
+                with self.env.cr.savepoint():
+                    file_sha256 = parsed_inv['import_file_sha256']
+                    if file_sha256 in duplicate_sha256s:
+                        existing_inv = self.invoice_already_imported(
+                            False, file_sha256=file_sha256)
+                        if existing_inv:
+                            set_already_imported(result, existing_inv)
+                            continue
+                    partner = bdio._match_partner(
+                        parsed_inv['partner'], parsed_inv['chatter_msg'],
+                        partner_type=partner_type,
+                        speed_dict=partner_speed_dict)
+                    partner = partner.commercial_partner_id
+                    parsed_inv['partner']['recordset'] = partner
+                    existing_inv = self.invoice_already_exists(
+                        partner, parsed_inv)
+                    if existing_inv:
+                        logger.warning(
+                            "Batch import: invoice file %s already exists "
+                            "in Odoo (ID %d number %s supplier number %s)",
+                            filename, existing_inv.id, existing_inv.number,
+                            parsed_inv.get('invoice_number'))
+                        result.update({
+                            'state': 'exists',
+                            'invoice_id': existing_inv.id,
+                            'message': _(
+                                "This invoice already exists in Odoo "
+                                "with number '%s'.") % existing_inv.number,
+                            })
+                        continue
+                    if partner.id not in import_configs:
+                        configs = aiico.search([
+                            ('partner_id', '=', partner.id),
+                            ('company_id', '=', company_id)])
+                        if len(configs) > 1:
+                            logger.info(
+                                "There are %d invoice import configs for "
+                                "partner %s. Using the first one '%s'",
+                                len(configs), partner.display_name,
+                                configs[0].name)
+                        import_configs[partner.id] = configs and\
+                            configs[0].convert_to_import_config() or False
+                    import_config = import_configs[partner.id]
+                    if not import_config:
+                        raise UserError(_(
+                            "Missing Invoice Import Configuration on "
+                            "partner '%s'.") % partner.display_name)
+                    invoice = self.create_invoice(
+                        parsed_inv, import_config,
+                        onchange_cache=onchange_cache)
+                    invoice.message_post(body=_(
+                        "This invoice has been created automatically via "
+                        "file import"))
+                    result.update({
+                        'state': 'created',
+                        'invoice_id': invoice.id,
+                        })
+            except Exception as e:
+                logger.warning(
+                    'Batch import: failed to import invoice file %s. '
+                    'Reason: %s', filename, e)
+                result['message'] = isinstance(e, UserError) and e.name or\
+                    str(e)
+        return res
+
+    @api.model
+    def create_invoice(
+            self, parsed_inv, import_config=False, onchange_cache=None):
         aio = self.env['account.invoice']
         bdio = self.env['business.document.import']
+        if onchange_cache is None:
+            onchange_cache = {}
         parsed_inv = self.pre_process_parsed_inv(parsed_inv)
         (vals, import_config) = self._prepare_create_invoice_vals(
-            parsed_inv, import_config=import_config)
+            parsed_inv, import_config=import_config,
+            onchange_cache=onchange_cache)
         logger.debug('Invoice vals for creation: %s', vals)
+        # The lines are created after the invoice in one multi-create,
+        # so that the taxes are computed only once for the whole invoice
+        lines_vals = [
+            line[2] for line in vals.pop('invoice_line_ids', [])
+            if line[0] == 0]
         invoice = aio.create(vals)
+        if lines_vals:
+            self._create_invoice_lines(invoice, lines_vals)
+        if 'lines_stream' in parsed_inv:
+            self._create_invoice_lines_stream(
+                parsed_inv, invoice, vals, import_config,
+                onchange_cache=onchange_cache)
+        if invoice.invoice_line_ids:
+            invoice.compute_taxes()
         self.post_process_invoice(parsed_inv, invoice, import_config)
         logger.info('Invoice ID %d created', invoice.id)
         bdio.post_create_or_update(parsed_inv, invoice)
         return invoice
 
+    @api.model
+    def _create_invoice_lines(self, invoice, lines_vals):
+        """Create the invoice lines with a single multi-create. The caller
+        must call compute_taxes() on the invoice once all the lines are
+        created"""
+        for il_vals in lines_vals:
+            il_vals['invoice_id'] = invoice.id
+        lines = self.env['account.invoice.line'].create(lines_vals)
+        invoice.invalidate_cache(['invoice_line_ids'], invoice.ids)
+        return lines
+
+    @api.model
+    def _create_invoice_lines_stream(
+            self, parsed_inv, invoice, invoice_vals, import_config,
+            onchange_cache=None):
+        """Streaming mode: create the lines of the invoice by batches, as
+        they are read from the file, so that the memory used doesn't
+        depend on the number of lines of the invoice"""
+        lines_stream = parsed_inv.pop('lines_stream')
+        # The lines are not kept in memory, so post_process_invoice()
+        # can only create a global adjustment line
+        parsed_inv['lines'] = []
+        if not import_config['invoice_line_method'].startswith('nline'):
+            # the lines are not used, but the file is read until the end
+            # to be fully validated
+            for line in lines_stream:
+                pass
+            return
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'account_invoice_import.stream_batch_size', STREAM_BATCH_SIZE))
+        partner = invoice.commercial_partner_id
+        line_cache = {}
+        nb_lines = 0
+        while True:
+            lines = list(islice(lines_stream, batch_size))
+            if not lines:
+                break
+            self.pre_process_parsed_inv_lines(parsed_inv, lines)
+            lines_vals = self._prepare_create_invoice_lines_vals(
+                parsed_inv, lines, invoice_vals, import_config, partner,
+                line_cache=line_cache, onchange_cache=onchange_cache)
+            self._create_invoice_lines(invoice, lines_vals)
+            nb_lines += len(lines)
+            logger.debug(
+                'Streaming import: %d lines created on invoice ID %d',
+                nb_lines, invoice.id)
+            # the created lines don't need to stay in the cache
+            self.env.invalidate_all()
+        if not nb_lines:
+            raise UserError(_(
+                "You have selected a Multi Line method for this import "
+                "but Odoo could not read any line in the XML file."))
+
     @api.model
     def _prepare_global_adjustment_line(
             self, diff_amount, invoice, import_config):
@@ -753,6 +1208,8 @@ class AccountInvoiceImport(models.TransientModel):
             existing_lines, parsed_inv['lines'], chatter, seller=seller)
         if not compare_res:
             return
+        # The lines that get the same values are written together
+        to_write = {}  # key = write_vals as a tuple, value = list of IDs
         for eline, cdict in list(compare_res['to_update'].items()):
             write_vals = {}
             if cdict.get('qty'):
@@ -772,7 +1229,10 @@ class AccountInvoiceImport(models.TransientModel):
                         invoice.currency_id.name))
                 write_vals['price_unit'] = cdict['price_unit'][1]
             if write_vals:
-                eline.write(write_vals)
+                to_write.setdefault(
+                    tuple(sorted(write_vals.items())), []).append(eline.id)
+        for write_vals, line_ids in to_write.items():
+            ailo.browse(line_ids).write(dict(write_vals))
         if compare_res['to_remove']:
             to_remove_label = [
                 '%s %s x %s' % (
@@ -784,15 +1244,15 @@ class AccountInvoiceImport(models.TransientModel):
                     ', '.join(to_remove_label)))
             compare_res['to_remove'].unlink()
         if compare_res['to_add']:
-            to_create_label = []
-            for add in compare_res['to_add']:
-                line_vals = self._prepare_create_invoice_line(
+            lines_vals = [
+                self._prepare_create_invoice_line(
                     add['product'], add['uom'], add['import_line'], invoice)
-                new_line = ailo.create(line_vals)
-                to_create_label.append('%s %s x %s' % (
-                    new_line.quantity,
-                    new_line.uom_id.name,
-                    new_line.name))
+                for add in compare_res['to_add']]
+            new_lines = ailo.create(lines_vals)
+            to_create_label = [
+                '%s %s x %s' % (
+                    new_line.quantity, new_line.uom_id.name, new_line.name)
+                for new_line in new_lines]
             chatter.append(_("%d new invoice line(s) created: %s") % (
                 len(compare_res['to_add']), ', '.join(to_create_label)))
         invoice.compute_taxes()
@@ -825,6 +1285,8 @@ class AccountInvoiceImport(models.TransientModel):
             'reference': parsed_inv.get('invoice_number'),
             'date_invoice': parsed_inv.get('date'),
         }
+        if parsed_inv.get('import_file_sha256'):
+            vals['import_file_sha256'] = parsed_inv['import_file_sha256']
         if parsed_inv.get('date_due'):
             vals['date_due'] = parsed_inv['date_due']
         if parsed_inv.get('iban'):
@@ -847,8 +1309,12 @@ class AccountInvoiceImport(models.TransientModel):
         if not invoice:
             raise UserError(_(
                 'You must select a supplier invoice or refund to update'))
-        parsed_inv = self.parse_invoice(
-            self.invoice_file, self.invoice_filename)
+        parsed_inv = self._parse_wizard_invoice(check_not_imported=False)
+        if 'lines_stream' in parsed_inv:
+            # the update of the lines needs all the lines
+            lines = list(parsed_inv.pop('lines_stream'))
+            parsed_inv['lines'] = self.pre_process_parsed_inv_lines(
+                parsed_inv, lines)
         if self.partner_id:
             # True if state='update' ; False when state='update-from-invoice'
             parsed_inv['partner']['recordset'] = self.partner_id
@@ -925,22 +1391,24 @@ class AccountInvoiceImport(models.TransientModel):
         for xpath in xpath_list:
             xpath_res = xml_root.xpath(xpath, namespaces=namespaces)
             if xpath_res and xpath_res[0].text:
-                if isdate:
-                    if (
-                            xpath_res[0].attrib and
-                            xpath_res[0].attrib.get('format') != '102'):
-                        raise UserError(_(
-                            "Only the date format 102 is supported "))
-                    date_dt = datetime.strptime(xpath_res[0].text, '%Y%m%d')
-                    date_str = fields.Date.to_string(date_dt)
-                    return date_str
-                elif isfloat:
-                    res_float = float(xpath_res[0].text)
-                    return res_float
-                else:
-                    return xpath_res[0].text
+                return self.xpath_node_value_helper(
+                    xpath_res[0], isdate=isdate, isfloat=isfloat)
         return False
 
+    def xpath_node_value_helper(self, node, isdate=False, isfloat=False):
+        if isdate:
+            if node.attrib and node.attrib.get('format') != '102':
+                raise UserError(_(
+                    "Only the date format 102 is supported "))
+            date_dt = datetime.strptime(node.text, '%Y%m%d')
+            date_str = fields.Date.to_string(date_dt)
+            return date_str
+        elif isfloat:
+            res_float = float(node.text)
+            return res_float
+        else:
+            return node.text
+
     def raw_multi_xpath_helper(self, xml_root, xpath_list, namespaces):
         for xpath in xpath_list:
             xpath_res = xml_root.xpath(xpath, namespaces=namespaces)
@@ -998,17 +1466,20 @@ class AccountInvoiceImport(models.TransientModel):
         self = self.with_context(force_company=company_id)
         aiico = self.env['account.invoice.import.config']
         bdio = self.env['business.document.import']
-        i = 0
+        # the partner matches and product onchanges are shared by the
+        # attachments of the email
+        partner_speed_dict = {}
+        onchange_cache = {}
         if msg_dict.get('attachments'):
-            i += 1
-            for attach in msg_dict['attachments']:
+            for i, attach in enumerate(msg_dict['attachments'], 1):
                 logger.info(
                     'Attachment %d: %s. Trying to import it as an invoice',
                     i, attach.fname)
                 parsed_inv = self.parse_invoice(
                     base64.b64encode(attach.content), attach.fname)
                 partner = bdio._match_partner(
-                    parsed_inv['partner'], parsed_inv['chatter_msg'])
+                    parsed_inv['partner'], parsed_inv['chatter_msg'],
+                    speed_dict=partner_speed_dict)
 
                 existing_inv = self.invoice_already_exists(partner, parsed_inv)
                 if existing_inv:
@@ -1035,7 +1506,8 @@ class AccountInvoiceImport(models.TransientModel):
                         partner.display_name, import_configs[0].name)
                     import_config =\
                         import_configs[0].convert_to_import_config()
-                invoice = self.create_invoice(parsed_inv, import_config)
+                invoice = self.create_invoice(
+                    parsed_inv, import_config, onchange_cache=onchange_cache)
                 logger.info('Invoice ID %d created from email', invoice.id)
                 invoice.message_post(body=_(
                     "Invoice successfully imported from email sent by "
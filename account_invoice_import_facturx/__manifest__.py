@@ -4,7 +4,7 @@
 
 {
     'name': 'Account Invoice Import Factur-X',
-    'version': '12.0.1.0.0',
+    'version': '12.0.1.0.1',
     'category': 'Invoicing Management',
     'license': 'AGPL-3',
     'summary': 'Import Factur-X/ZUGFeRD supplier invoices/refunds',
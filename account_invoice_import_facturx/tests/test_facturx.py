@@ -204,3 +204,60 @@ class TestFacturx(TransactionCase):
                 precision_rounding=cur_prec))
             # Delete because several sample invoices have the same number
             invoices.unlink()
+
+    def test_iter_xml_files_from_pdf(self):
+        bdio = self.env['business.document.import']
+        f = file_open(
+            'account_invoice_import_facturx/tests/files/'
+            'ZUGFeRD_1p0_COMFORT_Einfach.pdf', 'rb')
+        pdf_file = f.read()
+        f.close()
+        xml_files = bdio.iter_xml_files_from_pdf(pdf_file)
+        xml_filename, xml_root = next(xml_files)
+        self.assertEqual(xml_filename, 'ZUGFeRD-invoice.xml')
+        self.assertTrue(xml_root.tag.endswith('CrossIndustryDocument'))
+        self.assertEqual(
+            list(bdio.get_xml_files_from_pdf(pdf_file).keys()),
+            ['ZUGFeRD-invoice.xml'])
+        # Not a PDF with embedded files
+        self.assertEqual(list(bdio.iter_xml_files_from_pdf(b'not a pdf')), [])
+
+    def test_facturx_compiled_xpath(self):
+        aiio = self.env['account.invoice.import']
+        bdio = self.env['business.document.import']
+        # one sample file of each flavour
+        sample_files = {
+            'Facture_FR_EN16931.pdf': {
+                'invoice_number': 'FA-2017-0010',
+                'amount_untaxed': 624.90,
+                'amount_total': 671.15,
+                'date': '2017-11-13',
+                },
+            'ZUGFeRD_1p0_COMFORT_Einfach.pdf': {
+                'invoice_number': '471102',
+                'amount_untaxed': 473.0,
+                'amount_total': 529.87,
+                'date': '2013-03-05',
+                'date_due': '2013-04-04',
+                },
+            }
+        for (inv_file, res_dict) in sample_files.items():
+            f = file_open(
+                'account_invoice_import_facturx/tests/files/' +
+                inv_file, 'rb')
+            pdf_file = f.read()
+            f.close()
+            xml_root = list(bdio.get_xml_files_from_pdf(pdf_file).values())[0]
+            parsed_inv = aiio.parse_facturx_invoice(xml_root)
+            for key, value in res_dict.items():
+                if key.startswith('amount'):
+                    self.assertFalse(float_compare(
+                        parsed_inv[key], value, precision_digits=2))
+                else:
+                    self.assertEqual(parsed_inv[key], value)
+            self.assertTrue(parsed_inv['lines'])
+            # the XPath compiled by the 1st parsing give the same result
+            self.assertEqual(aiio.parse_facturx_invoice(xml_root), parsed_inv)
+        self.assertIs(
+            aiio._facturx_get_xpath(['ram:ID', 'ram:ID'], 'zugferd'),
+            aiio._facturx_get_xpath('ram:ID', 'zugferd'))
@@ -5,6 +5,7 @@
 from odoo import api, models, _
 from odoo.exceptions import UserError
 from odoo.tools import float_compare, float_is_zero
+from lxml import etree
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,6 +15,50 @@ try:
 except ImportError:
     logger.debug('Cannot import facturx')
 
+# Namespaces of the 2 flavours of Cross Industry Invoice supported by the
+# import: Factur-X (same XML as ZUGFeRD 2) and ZUGFeRD 1.0
+FACTURX_NAMESPACES = {
+    'factur-x': {
+        'rsm': 'urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100',
+        'ram': 'urn:un:unece:uncefact:data:standard:'
+               'ReusableAggregateBusinessInformationEntity:100',
+        'udt': 'urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100',
+        },
+    'zugferd': {
+        'rsm': 'urn:ferd:CrossIndustryDocument:invoice:1p0',
+        'ram': 'urn:un:unece:uncefact:data:standard:'
+               'ReusableAggregateBusinessInformationEntity:12',
+        'udt': 'urn:un:unece:uncefact:data:standard:UnqualifiedDataType:15',
+        },
+    }
+FACTURX_ROOT_TAGS = {
+    '{%s}CrossIndustryInvoice' % FACTURX_NAMESPACES['factur-x']['rsm']:
+    'factur-x',
+    '{%s}CrossIndustryDocument' % FACTURX_NAMESPACES['zugferd']['rsm']:
+    'zugferd',
+    }
+# In the XPath definitions, a string is an XPath common to the 2 flavours
+# and a list is [Factur-X XPath, ZUGFeRD XPath] (False when the element
+# doesn't exist in the flavour)
+FACTURX_FLAVOUR_INDEX = {'factur-x': 0, 'zugferd': 1}
+# The XPath are compiled once per process
+# key = (flavour, xpath), value = etree.XPath
+FACTURX_XPATHS = {}
+
+# Absolute paths of the main blocks of the XML file
+FX_DOCUMENT = '/rsm:CrossIndustryInvoice/rsm:ExchangedDocument'
+ZF_DOCUMENT = '/rsm:CrossIndustryDocument/rsm:HeaderExchangedDocument'
+FX_TRANSACTION = '/rsm:CrossIndustryInvoice/rsm:SupplyChainTradeTransaction'
+ZF_TRANSACTION = '/rsm:CrossIndustryDocument'\
+    '/rsm:SpecifiedSupplyChainTradeTransaction'
+FX_AGREEMENT = FX_TRANSACTION + '/ram:ApplicableHeaderTradeAgreement'
+ZF_AGREEMENT = ZF_TRANSACTION + '/ram:ApplicableSupplyChainTradeAgreement'
+FX_SETTLEMENT = FX_TRANSACTION + '/ram:ApplicableHeaderTradeSettlement'
+ZF_SETTLEMENT = ZF_TRANSACTION + '/ram:ApplicableSupplyChainTradeSettlement'
+FX_SUMMATION = FX_SETTLEMENT +\
+    '/ram:SpecifiedTradeSettlementHeaderMonetarySummation'
+ZF_SUMMATION = ZF_SETTLEMENT + '/ram:SpecifiedTradeSettlementMonetarySummation'
+
 
 class AccountInvoiceImport(models.TransientModel):
     _name = 'account.invoice.import'
@@ -34,119 +79,169 @@ class AccountInvoiceImport(models.TransientModel):
         xpath_dict = {
             'partner': {
                 'vat': [
-                    "//ram:ApplicableHeaderTradeAgreement"
+                    FX_AGREEMENT +
                     "/ram:SellerTradeParty"
                     "/ram:SpecifiedTaxRegistration"
-                    "/ram:ID[@schemeID='VA']",  # Factur-X
-                    "//ram:ApplicableSupplyChainTradeAgreement"
+                    "/ram:ID[@schemeID='VA']",
+                    ZF_AGREEMENT +
                     "/ram:SellerTradeParty"
                     "/ram:SpecifiedTaxRegistration"
-                    "/ram:ID[@schemeID='VA']",  # ZUGFeRD
+                    "/ram:ID[@schemeID='VA']",
                     ],
                 'name': [
-                    '//ram:ApplicableHeaderTradeAgreement'
-                    '/ram:SellerTradeParty'
-                    '/ram:Name',  # Factur-X
-                    '//ram:ApplicableSupplyChainTradeAgreement'
-                    '/ram:SellerTradeParty'
-                    '/ram:Name',  # ZUGFeRD
+                    FX_AGREEMENT + '/ram:SellerTradeParty/ram:Name',
+                    ZF_AGREEMENT + '/ram:SellerTradeParty/ram:Name',
                     ],
                 'email': [
-                    "//ram:ApplicableHeaderTradeAgreement"
+                    FX_AGREEMENT +
                     "/ram:SellerTradeParty"
                     "/ram:DefinedTradeContact"
                     "/ram:EmailURIUniversalCommunication"
-                    "/ram:URIID",  # Factur-X
-                    "//ram:ApplicableSupplyChainTradeAgreement"
+                    "/ram:URIID",
+                    ZF_AGREEMENT +
                     "/ram:SellerTradeParty"
                     "/ram:DefinedTradeContact"
                     "/ram:EmailURIUniversalCommunication"
-                    "/ram:URIID",  # ZUGFeRD
+                    "/ram:URIID",
                     ],
                 },
             'company': {
                 'vat': [
-                    "//ram:ApplicableHeaderTradeAgreement"
+                    FX_AGREEMENT +
                     "/ram:BuyerTradeParty"
                     "/ram:SpecifiedTaxRegistration"
-                    "/ram:ID[@schemeID='VA']",  # Factur-X
-                    "//ram:ApplicableSupplyChainTradeAgreement"
+                    "/ram:ID[@schemeID='VA']",
+                    ZF_AGREEMENT +
                     "/ram:BuyerTradeParty"
                     "/ram:SpecifiedTaxRegistration"
-                    "/ram:ID[@schemeID='VA']",  # ZUGFeRD
+                    "/ram:ID[@schemeID='VA']",
                     ],
                 },
             'invoice_number': [
-                '//rsm:ExchangedDocument/ram:ID',  # Factur-X
-                '//rsm:HeaderExchangedDocument/ram:ID',  # ZUGFeRD
+                FX_DOCUMENT + '/ram:ID',
+                ZF_DOCUMENT + '/ram:ID',
                 ],
             'date': [
-                '//rsm:ExchangedDocument'
-                '/ram:IssueDateTime/udt:DateTimeString',  # Factur-X
-                '//rsm:HeaderExchangedDocument'
-                '/ram:IssueDateTime/udt:DateTimeString',  # ZUGFeRD
+                FX_DOCUMENT + '/ram:IssueDateTime/udt:DateTimeString',
+                ZF_DOCUMENT + '/ram:IssueDateTime/udt:DateTimeString',
                 ],
             'date_due': [
-                "//ram:ApplicableHeaderTradeSettlement"
+                FX_SETTLEMENT +
                 "/ram:SpecifiedTradePaymentTerms"
                 "/ram:DueDateDateTime"
-                "/udt:DateTimeString",  # Factur-X
-                "//ram:ApplicableSupplyChainTradeSettlement"
+                "/udt:DateTimeString",
+                ZF_SETTLEMENT +
                 "/ram:SpecifiedTradePaymentTerms"
                 "/ram:DueDateDateTime"
-                "/udt:DateTimeString",  # ZUGFeRD
+                "/udt:DateTimeString",
                 ],
             'date_start': [
-                "//ram:ApplicableHeaderTradeSettlement"
+                FX_SETTLEMENT +
                 "/ram:BillingSpecifiedPeriod"
                 "/ram:StartDateTime/udt:DateTimeString",
-                "//ram:ApplicableSupplyChainTradeSettlement"
+                ZF_SETTLEMENT +
                 "/ram:BillingSpecifiedPeriod"
                 "/ram:StartDateTime/udt:DateTimeString",
                 ],
             'date_end': [
-                "//ram:ApplicableHeaderTradeSettlement"
+                FX_SETTLEMENT +
                 "/ram:BillingSpecifiedPeriod"
                 "/ram:EndDateTime/udt:DateTimeString",
-                "//ram:ApplicableSupplyChainTradeSettlement"
+                ZF_SETTLEMENT +
                 "/ram:BillingSpecifiedPeriod"
                 "/ram:EndDateTime/udt:DateTimeString",
                 ],
             'currency': {
                 'iso': [
-                    "//ram:ApplicableHeaderTradeSettlement"
-                    "/ram:InvoiceCurrencyCode",  # Factur-X
-                    "//ram:ApplicableSupplyChainTradeSettlement"
-                    "/ram:InvoiceCurrencyCode",  # ZUGFeRD
+                    FX_SETTLEMENT + "/ram:InvoiceCurrencyCode",
+                    ZF_SETTLEMENT + "/ram:InvoiceCurrencyCode",
                     ],
                 },
             'amount_total': [
-                "//ram:ApplicableHeaderTradeSettlement"
-                "/ram:SpecifiedTradeSettlementHeaderMonetarySummation"
-                "/ram:GrandTotalAmount",  # Factur-X
-                "//ram:ApplicableSupplyChainTradeSettlement"
-                "/ram:SpecifiedTradeSettlementMonetarySummation"
-                "/ram:GrandTotalAmount",  # ZUGFeRD
+                FX_SUMMATION + "/ram:GrandTotalAmount",
+                ZF_SUMMATION + "/ram:GrandTotalAmount",
                 ],
             }
         return xpath_dict
 
+    @api.model
+    def _facturx_get_flavour(self, xml_root):
+        flavour = FACTURX_ROOT_TAGS.get(xml_root.tag)
+        if not flavour:
+            raise UserError(_(
+                "The root tag of the XML file (%s) is not a Factur-X nor "
+                "a ZUGFeRD 1.0 root tag.") % xml_root.tag)
+        return flavour
+
+    @api.model
+    def _facturx_get_node_flavour(self, node):
+        """Flavour of the XML file of the node, for the methods that
+        receive the namespaces of the file as argument"""
+        return self._facturx_get_flavour(node.getroottree().getroot())
+
+    @api.model
+    def _facturx_get_xpath(self, xpaths, flavour):
+        """Returns the compiled XPath of the flavour (None if the element
+        doesn't exist in this flavour). xpaths is a string or a list
+        [Factur-X XPath, ZUGFeRD XPath]"""
+        if isinstance(xpaths, list):
+            xpath = xpaths[FACTURX_FLAVOUR_INDEX[flavour]]
+        else:
+            xpath = xpaths
+        if not xpath:
+            return None
+        key = (flavour, xpath)
+        if key not in FACTURX_XPATHS:
+            FACTURX_XPATHS[key] = etree.XPath(
+                xpath, namespaces=FACTURX_NAMESPACES[flavour])
+        return FACTURX_XPATHS[key]
+
+    @api.model
+    def facturx_xpath_nodes(self, node, xpaths, flavour):
+        xpath = self._facturx_get_xpath(xpaths, flavour)
+        if xpath is None:
+            return []
+        return xpath(node)
+
+    @api.model
+    def facturx_xpath_value(
+            self, node, xpaths, flavour, isdate=False, isfloat=False):
+        xpath_res = self.facturx_xpath_nodes(node, xpaths, flavour)
+        if xpath_res and xpath_res[0].text:
+            return self.xpath_node_value_helper(
+                xpath_res[0], isdate=isdate, isfloat=isfloat)
+        return False
+
+    @api.model
+    def facturx_xpath_to_dict(self, node, xpath_dict, flavour):
+        res = {}
+        for key, value in xpath_dict.items():
+            if isinstance(value, dict):
+                res[key] = self.facturx_xpath_to_dict(node, value, flavour)
+            else:
+                res[key] = self.facturx_xpath_value(
+                    node, value, flavour, isdate='date' in key,
+                    isfloat='date' not in key and 'amount' in key)
+        return res
+
     @api.model
     def parse_facturx_taxes(self, taxes_xpath, namespaces):
         taxes = []
+        if not taxes_xpath:
+            return taxes
+        flavour = self._facturx_get_node_flavour(taxes_xpath[0])
         for tax in taxes_xpath:
-            type_code = self.multi_xpath_helper(
-                tax, ["ram:TypeCode"], namespaces) or 'VAT'
+            type_code = self.facturx_xpath_value(
+                tax, "ram:TypeCode", flavour) or 'VAT'
             # CategoryCode not available at Basic level
-            categ_code = self.multi_xpath_helper(
-                tax, ["ram:CategoryCode"], namespaces)
-            percentage = self.multi_xpath_helper(
+            categ_code = self.facturx_xpath_value(
+                tax, "ram:CategoryCode", flavour)
+            percentage = self.facturx_xpath_value(
                 tax,
-                ["ram:RateApplicablePercent",  # Factur-X
-                 "ram:ApplicablePercent",  # ZUGFeRD
-                 ], namespaces, isfloat=True) or 0.0
-            due_date_code = self.multi_xpath_helper(
-                tax, ["ram:DueDateTypeCode"], namespaces)
+                ["ram:RateApplicablePercent", "ram:ApplicablePercent"],
+                flavour, isfloat=True) or 0.0
+            due_date_code = self.facturx_xpath_value(
+                tax, "ram:DueDateTypeCode", flavour)
             if due_date_code == '29':
                 due_date_code = '5'
             taxes.append({
@@ -163,15 +258,16 @@ class AccountInvoiceImport(models.TransientModel):
             self, acline, global_taxes, label_suffix, ac_qty_dict, counters,
             namespaces):
         # This method is designed to work for global AND line charges/allowance
+        flavour = self._facturx_get_node_flavour(acline)
         acentry = {}
-        reason = self.multi_xpath_helper(acline, ["ram:Reason"], namespaces)
+        reason = self.facturx_xpath_value(acline, "ram:Reason", flavour)
         if reason:
             acentry['name'] = reason
         # ChargeIndicator and ActualAmount are required field
-        acentry['price_unit'] = self.multi_xpath_helper(
-            acline, ['ram:ActualAmount'], namespaces, isfloat=True)
-        ch_indic = self.multi_xpath_helper(
-            acline, ["ram:ChargeIndicator/udt:Indicator"], namespaces)
+        acentry['price_unit'] = self.facturx_xpath_value(
+            acline, 'ram:ActualAmount', flavour, isfloat=True)
+        ch_indic = self.facturx_xpath_value(
+            acline, "ram:ChargeIndicator/udt:Indicator", flavour)
         if ch_indic == 'false':  # allowance
             acentry['qty'] = ac_qty_dict['allowances']
             acentry['product'] = {'code': 'EDI-ALLOWANCE'}
@@ -189,8 +285,8 @@ class AccountInvoiceImport(models.TransientModel):
         else:
             raise UserError(_('Unknown ChargeIndicator %s', ch_indic))
         acentry['name'] = u'%s (%s)' % (acentry['name'], label_suffix)
-        taxes_xpath = self.raw_multi_xpath_helper(
-            acline, ["ram:CategoryTradeTax"], namespaces)
+        taxes_xpath = self.facturx_xpath_nodes(
+            acline, "ram:CategoryTradeTax", flavour)
         if taxes_xpath:
             acentry['taxes'] = self.parse_facturx_taxes(
                 taxes_xpath, namespaces)
@@ -201,50 +297,55 @@ class AccountInvoiceImport(models.TransientModel):
     @api.model
     def parse_facturx_invoice_line(
             self, iline, global_taxes, ac_qty_dict, counters, namespaces):
+        flavour = self._facturx_get_node_flavour(iline)
         xpath_dict = {
             'product': {
-                'barcode': ["ram:SpecifiedTradeProduct/ram:GlobalID"],
-                'code': ["ram:SpecifiedTradeProduct/ram:SellerAssignedID"],
+                'barcode': "ram:SpecifiedTradeProduct/ram:GlobalID",
+                'code': "ram:SpecifiedTradeProduct/ram:SellerAssignedID",
                 },
-            'name': ["ram:SpecifiedTradeProduct/ram:Name"],
+            'name': "ram:SpecifiedTradeProduct/ram:Name",
             'date_start': [
                 "ram:SpecifiedLineTradeSettlement"
                 "/ram:BillingSpecifiedPeriod"
-                "/ram:StartDateTime/udt:DateTimeString"],
+                "/ram:StartDateTime/udt:DateTimeString",
+                False],
             'date_end': [
                 "ram:SpecifiedLineTradeSettlement"
                 "/ram:BillingSpecifiedPeriod"
-                "/ram:EndDateTime/udt:DateTimeString"],
+                "/ram:EndDateTime/udt:DateTimeString",
+                False],
             }
-        vals = self.xpath_to_dict_helper(iline, xpath_dict, namespaces)
-        price_unit_xpath = iline.xpath(
-            "ram:SpecifiedSupplyChainTradeAgreement"
-            "/ram:NetPriceProductTradePrice"
-            "/ram:ChargeAmount",
-            namespaces=namespaces)
-        qty_xpath_list = [
-            "ram:SpecifiedLineTradeDelivery/ram:BilledQuantity",  # Factur-X
-            "ram:SpecifiedSupplyChainTradeDelivery/ram:BilledQuantity",  # ZF
-            ]
-        qty = self.multi_xpath_helper(
-            iline, qty_xpath_list, namespaces, isfloat=True)
+        vals = self.facturx_xpath_to_dict(iline, xpath_dict, flavour)
+        price_unit_xpath = self.facturx_xpath_nodes(
+            iline,
+            [False,
+             "ram:SpecifiedSupplyChainTradeAgreement"
+             "/ram:NetPriceProductTradePrice"
+             "/ram:ChargeAmount"],
+            flavour)
+        qty_xpath = self.facturx_xpath_nodes(
+            iline,
+            ["ram:SpecifiedLineTradeDelivery/ram:BilledQuantity",
+             "ram:SpecifiedSupplyChainTradeDelivery/ram:BilledQuantity"],
+            flavour)
+        if not qty_xpath or not qty_xpath[0].text:
+            return False
+        qty = self.xpath_node_value_helper(qty_xpath[0], isfloat=True)
         if not qty:
             return False
         uom = {}
-        qty_xpath = self.raw_multi_xpath_helper(
-            iline, qty_xpath_list, namespaces)
         if qty_xpath[0].attrib and qty_xpath[0].attrib.get('unitCode'):
             unece_uom = qty_xpath[0].attrib['unitCode']
             uom = {'unece_code': unece_uom}
-        price_subtotal = self.multi_xpath_helper(
+        price_subtotal = self.facturx_xpath_value(
             iline,
             ["ram:SpecifiedLineTradeSettlement"
              "/ram:SpecifiedTradeSettlementLineMonetarySummation"
-             "/ram:LineTotalAmount",  # Factur-X
+             "/ram:LineTotalAmount",
              "ram:SpecifiedSupplyChainTradeSettlement"
              "/ram:SpecifiedTradeSettlementMonetarySummation"
-             "/ram:LineTotalAmount",  # ZUGFeRD
-             ], namespaces, isfloat=True)
+             "/ram:LineTotalAmount",
+             ], flavour, isfloat=True)
         if price_unit_xpath:
             price_unit = float(price_unit_xpath[0].text)
         else:
@@ -252,13 +353,13 @@ class AccountInvoiceImport(models.TransientModel):
         counters['lines'] += price_subtotal
         # Reminder : ApplicableTradeTax not available on lines
         # at Basic level
-        taxes_xpath = self.raw_multi_xpath_helper(
+        taxes_xpath = self.facturx_xpath_nodes(
             iline,
             ["ram:SpecifiedLineTradeSettlement"
-             "/ram:ApplicableTradeTax",  # Factur-X
+             "/ram:ApplicableTradeTax",
              "ram:SpecifiedSupplyChainTradeSettlement"
-             "//ram:ApplicableTradeTax",  # ZUGFeRD
-             ], namespaces)
+             "/ram:ApplicableTradeTax",
+             ], flavour)
         taxes = self.parse_facturx_taxes(taxes_xpath, namespaces)
         vals.update({
             'qty': qty,
@@ -267,11 +368,11 @@ class AccountInvoiceImport(models.TransientModel):
             'price_subtotal': price_subtotal,
             'taxes': taxes or global_taxes,
             })
-        iline_allowance_charge_xpath = self.raw_multi_xpath_helper(
+        iline_allowance_charge_xpath = self.facturx_xpath_nodes(
             iline,
             ["ram:SpecifiedLineTradeSettlement"
-             "/ram:SpecifiedTradeAllowanceCharge",  # Factur-X
-             ], namespaces)
+             "/ram:SpecifiedTradeAllowanceCharge",
+             False], flavour)
         res = [vals]
         for ac_element in iline_allowance_charge_xpath:
             acentry = self.parse_facturx_allowance_charge(
@@ -285,7 +386,6 @@ class AccountInvoiceImport(models.TransientModel):
     def parse_facturx_invoice(self, xml_root):
         """Parse Cross Industry Invoice XML file"""
         logger.debug('Starting to parse XML file as Factur-X/ZUGFeRD file')
-        namespaces = xml_root.nsmap
         # Check XML schema to avoid headaches trying to import invalid files
         try:
             check_facturx_xsd(xml_root)
@@ -294,12 +394,16 @@ class AccountInvoiceImport(models.TransientModel):
                 "The XML file embedded in the Factur-X invoice is invalid "
                 "according to the official XML Schema Definition."))
         prec = self.env['decimal.precision'].precision_get('Account')  # TODO
-        logger.debug('XML file namespaces=%s', namespaces)
-        doc_type = self.multi_xpath_helper(
+        # The flavour is detected once, and only the XPath of this flavour
+        # are evaluated
+        flavour = self._facturx_get_flavour(xml_root)
+        logger.debug('XML file flavour=%s', flavour)
+        namespaces = xml_root.nsmap
+        doc_type = self.facturx_xpath_value(
             xml_root,
-            ['//rsm:ExchangedDocument/ram:TypeCode',  # Factur-X
-             '//rsm:HeaderExchangedDocument/ram:TypeCode',  # ZUGFeRD
-             ], namespaces)
+            [FX_DOCUMENT + '/ram:TypeCode',
+             ZF_DOCUMENT + '/ram:TypeCode',
+             ], flavour)
         if doc_type == '380':
             inv_type = 'in_invoice'
             # Reminder: the module account_invoice_import supports
@@ -313,7 +417,7 @@ class AccountInvoiceImport(models.TransientModel):
                 "type code 380 and 381. (TypeCode is %s)") % doc_type)
 
         xpath_dict = self.prepare_facturx_xpath_dict()
-        res = self.xpath_to_dict_helper(xml_root, xpath_dict, namespaces)
+        res = self.facturx_xpath_to_dict(xml_root, xpath_dict, flavour)
         amount_total = res['amount_total']
         ac_qty_dict = {
             'charges': 1,
@@ -325,43 +429,27 @@ class AccountInvoiceImport(models.TransientModel):
                 'charges': -1,
                 'allowances': 1}
 
-        total_line = self.multi_xpath_helper(
+        total_line = self.facturx_xpath_value(
             xml_root,
-            ["//ram:ApplicableHeaderTradeSettlement"
-             "/ram:SpecifiedTradeSettlementHeaderMonetarySummation"
-             "/ram:LineTotalAmount",  # Factur-X
-             "//ram:ApplicableSupplyChainTradeSettlement"
-             "/ram:SpecifiedTradeSettlementMonetarySummation"
-             "/ram:LineTotalAmount",  # ZUGFeRD
-             ], namespaces, isfloat=True)
+            [FX_SUMMATION + "/ram:LineTotalAmount",
+             ZF_SUMMATION + "/ram:LineTotalAmount",
+             ], flavour, isfloat=True)
         # reminder : total_line is not present in MINIMUM profile
-        total_charge = self.multi_xpath_helper(
+        total_charge = self.facturx_xpath_value(
             xml_root,
-            ["//ram:ApplicableHeaderTradeSettlement"
-             "/ram:SpecifiedTradeSettlementHeaderMonetarySummation"
-             "/ram:ChargeTotalAmount",  # Factur-X
-             "//ram:ApplicableSupplyChainTradeSettlement"
-             "/ram:SpecifiedTradeSettlementMonetarySummation"
-             "/ram:ChargeTotalAmount",  # ZUGFeRD
-             ], namespaces, isfloat=True)
-        total_tradeallowance = self.multi_xpath_helper(
+            [FX_SUMMATION + "/ram:ChargeTotalAmount",
+             ZF_SUMMATION + "/ram:ChargeTotalAmount",
+             ], flavour, isfloat=True)
+        total_tradeallowance = self.facturx_xpath_value(
             xml_root,
-            ["//ram:ApplicableHeaderTradeSettlement"
-             "/ram:SpecifiedTradeSettlementHeaderMonetarySummation"
-             "/ram:AllowanceTotalAmount",  # Factur-X
-             "//ram:ApplicableSupplyChainTradeSettlement"
-             "/ram:SpecifiedTradeSettlementMonetarySummation"
-             "/ram:AllowanceTotalAmount",  # ZUGFeRD
-             ], namespaces, isfloat=True)
-        amount_tax = self.multi_xpath_helper(
+            [FX_SUMMATION + "/ram:AllowanceTotalAmount",
+             ZF_SUMMATION + "/ram:AllowanceTotalAmount",
+             ], flavour, isfloat=True)
+        amount_tax = self.facturx_xpath_value(
             xml_root,
-            ["//ram:ApplicableHeaderTradeSettlement"
-             "/ram:SpecifiedTradeSettlementHeaderMonetarySummation"
-             "/ram:TaxTotalAmount",  # Factur-X
-             "//ram:ApplicableSupplyChainTradeSettlement"
-             "/ram:SpecifiedTradeSettlementMonetarySummation"
-             "/ram:TaxTotalAmount",  # ZUGFeRD
-             ], namespaces, isfloat=True)
+            [FX_SUMMATION + "/ram:TaxTotalAmount",
+             ZF_SUMMATION + "/ram:TaxTotalAmount",
+             ], flavour, isfloat=True)
         # Check coherence
         if total_line:
             check_total = total_line + total_charge - total_tradeallowance\
@@ -374,31 +462,37 @@ class AccountInvoiceImport(models.TransientModel):
                     % (amount_total, check_total))
 
         amount_untaxed = amount_total - amount_tax
-        payment_type_code = self.multi_xpath_helper(
+        payment_means = "/ram:SpecifiedTradeSettlementPaymentMeans"
+        payment_type_code = self.facturx_xpath_value(
             xml_root,
-            ["//ram:SpecifiedTradeSettlementPaymentMeans/ram:TypeCode"],
-            namespaces)  # ZUGFeRD and Factur-X
+            [FX_SETTLEMENT + payment_means + "/ram:TypeCode",
+             ZF_SETTLEMENT + payment_means + "/ram:TypeCode",
+             ], flavour)
         iban = bic = False
         if payment_type_code and payment_type_code in ('30', '31'):
-            iban = self.multi_xpath_helper(
+            iban = self.facturx_xpath_value(
                 xml_root,
-                ["//ram:SpecifiedTradeSettlementPaymentMeans"
-                 "/ram:PayeePartyCreditorFinancialAccount"
-                 "/ram:IBANID"], namespaces)  # ZUGFeRD and Factur-X
-            bic = self.multi_xpath_helper(
+                [FX_SETTLEMENT + payment_means +
+                 "/ram:PayeePartyCreditorFinancialAccount/ram:IBANID",
+                 ZF_SETTLEMENT + payment_means +
+                 "/ram:PayeePartyCreditorFinancialAccount/ram:IBANID",
+                 ], flavour)
+            bic = self.facturx_xpath_value(
                 xml_root,
-                ["//ram:SpecifiedTradeSettlementPaymentMeans"
+                [FX_SETTLEMENT + payment_means +
+                 "/ram:PayeeSpecifiedCreditorFinancialInstitution"
+                 "/ram:BICID",
+                 ZF_SETTLEMENT + payment_means +
                  "/ram:PayeeSpecifiedCreditorFinancialInstitution"
-                 "/ram:BICID"], namespaces)  # ZUGFeRD and Factur-X
+                 "/ram:BICID",
+                 ], flavour)
         # global_taxes only used as fallback when taxes are not detailed
         # on invoice lines (which is the case at Basic level)
-        global_taxes_xpath = self.raw_multi_xpath_helper(
+        global_taxes_xpath = self.facturx_xpath_nodes(
             xml_root,
-            ["//ram:ApplicableHeaderTradeSettlement"
-             "/ram:ApplicableTradeTax",  # Factur-X
-             "//ram:ApplicableSupplyChainTradeSettlement"
-             "/ram:ApplicableTradeTax",  # ZUGFeRD
-             ], namespaces)
+            [FX_SETTLEMENT + "/ram:ApplicableTradeTax",
+             ZF_SETTLEMENT + "/ram:ApplicableTradeTax",
+             ], flavour)
         global_taxes = self.parse_facturx_taxes(global_taxes_xpath, namespaces)
         logger.debug('global_taxes=%s', global_taxes)
         res_lines = []
@@ -408,8 +502,11 @@ class AccountInvoiceImport(models.TransientModel):
             'lines': 0.0,
             }
 
-        inv_line_xpath = self.raw_multi_xpath_helper(
-            xml_root, ["//ram:IncludedSupplyChainTradeLineItem"], namespaces)
+        inv_line_xpath = self.facturx_xpath_nodes(
+            xml_root,
+            [FX_TRANSACTION + "/ram:IncludedSupplyChainTradeLineItem",
+             ZF_TRANSACTION + "/ram:IncludedSupplyChainTradeLineItem",
+             ], flavour)
         for iline in inv_line_xpath:
             line_list = self.parse_facturx_invoice_line(
                 iline, global_taxes, ac_qty_dict, counters, namespaces)
@@ -429,13 +526,11 @@ class AccountInvoiceImport(models.TransientModel):
         # charges (<ram:ChargeIndicator> = TRUE, counted in ChargeTotalAmount)
         # and for allowance (<ram:ChargeIndicator> = False, counted in
         # AllowanceTotalAmount)
-        global_allowance_charge_xpath = self.raw_multi_xpath_helper(
+        global_allowance_charge_xpath = self.facturx_xpath_nodes(
             xml_root,
-            ["//ram:ApplicableHeaderTradeSettlement"
-             "/ram:SpecifiedTradeAllowanceCharge",  # Factur-X
-             "//ram:ApplicableSupplyChainTradeSettlement"
-             "/ram:SpecifiedTradeAllowanceCharge",  # ZUGFeRD
-             ], namespaces)
+            [FX_SETTLEMENT + "/ram:SpecifiedTradeAllowanceCharge",
+             ZF_SETTLEMENT + "/ram:SpecifiedTradeAllowanceCharge",
+             ], flavour)
         for ac_element in global_allowance_charge_xpath:
             acentry = self.parse_facturx_allowance_charge(
                 ac_element, global_taxes, _('Global'), ac_qty_dict, counters,
@@ -444,20 +539,20 @@ class AccountInvoiceImport(models.TransientModel):
 
         # These LogisticsServiceCharge lines don't seem to exist in Factur-X
         # but we keep them for ZUGFeRD
-        charge_line_xpath = self.raw_multi_xpath_helper(
+        charge_line_xpath = self.facturx_xpath_nodes(
             xml_root,
-            ["//ram:ApplicableSupplyChainTradeSettlement"
-             "/ram:SpecifiedLogisticsServiceCharge",  # ZUGFeRD
-             ], namespaces)
+            [False,
+             ZF_SETTLEMENT + "/ram:SpecifiedLogisticsServiceCharge",
+             ], flavour)
         for chline in charge_line_xpath:
-            name = self.multi_xpath_helper(
-                chline, ["ram:Description"], namespaces)\
+            name = self.facturx_xpath_value(
+                chline, "ram:Description", flavour)\
                 or _("Logistics Service")
-            price_unit = self.multi_xpath_helper(
-                chline, ["ram:AppliedAmount"], namespaces, isfloat=True)
+            price_unit = self.facturx_xpath_value(
+                chline, "ram:AppliedAmount", flavour, isfloat=True)
             counters['charges'] += price_unit
-            taxes_xpath = self.raw_multi_xpath_helper(
-                chline, ["ram:AppliedTradeTax"], namespaces)
+            taxes_xpath = self.facturx_xpath_nodes(
+                chline, "ram:AppliedTradeTax", flavour)
             taxes = self.parse_facturx_taxes(taxes_xpath, namespaces)
             vals = {
                 'name': name,
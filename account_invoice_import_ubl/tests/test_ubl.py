@@ -4,7 +4,11 @@
 from odoo import fields
 from odoo.tests.common import TransactionCase
 from odoo.tools import file_open, float_compare
+from odoo.exceptions import UserError
+from odoo.addons.base_ubl.models.ubl import UBL_NAMESPACES
+from lxml import etree
 import base64
+import hashlib
 
 
 class TestUbl(TransactionCase):
@@ -77,3 +81,160 @@ class TestUbl(TransactionCase):
                     precision_digits=precision),
                 0)
             invoices.unlink()
+
+    def test_import_invoice_files(self):
+        aiio = self.env['account.invoice.import']
+        invoice_files = []
+        for sample_file in [
+                'UBLKetentest_Referentiefactuur_20150100.xml',
+                'efff_BE0505890632_160421_Inv_16117778.xml',
+                ]:
+            with file_open(
+                    'account_invoice_import_ubl/tests/files/' + sample_file,
+                    'rb') as f:
+                invoice_files.append((sample_file, base64.b64encode(f.read())))
+        invoice_files.insert(
+            1, ('broken.xml', base64.b64encode(b'<Invoice><broken')))
+        res = aiio.import_invoice_files(invoice_files)
+        self.assertEqual(
+            [r['state'] for r in res], ['created', 'error', 'created'])
+        self.assertEqual(res[1]['filename'], 'broken.xml')
+        self.assertTrue(res[1]['message'])
+        invoices = self.env['account.invoice'].browse(
+            [res[0]['invoice_id'], res[2]['invoice_id']])
+        self.assertEqual(
+            invoices.mapped('reference'), ['20150101', '16117778'])
+        # the same files are detected as already imported
+        res = aiio.import_invoice_files(invoice_files)
+        self.assertEqual(
+            [r['state'] for r in res], ['exists', 'error', 'exists'])
+        self.assertEqual(
+            [res[0]['invoice_id'], res[2]['invoice_id']], invoices.ids)
+        self.assertEqual(
+            invoices[0].import_file_sha256,
+            hashlib.sha256(
+                base64.b64decode(invoice_files[0][1])).hexdigest())
+        # the wizard refuses the file before parsing it
+        wiz = aiio.create({
+            'invoice_file': invoice_files[0][1],
+            'invoice_filename': 'copy_of_%s' % invoice_files[0][0],
+            })
+        with self.assertRaises(UserError):
+            wiz.import_invoice()
+
+    def test_import_invoice_files_duplicate(self):
+        aiio = self.env['account.invoice.import']
+        with file_open(
+                'account_invoice_import_ubl/tests/files/'
+                'efff_BE0505890632_160421_Inv_16117778.xml', 'rb') as f:
+            invoice_file_b64 = base64.b64encode(f.read())
+        # the same file twice in the batch
+        res = aiio.import_invoice_files([
+            ('invoice.xml', invoice_file_b64),
+            ('copy_of_invoice.xml', invoice_file_b64),
+            ])
+        self.assertEqual([r['state'] for r in res], ['created', 'exists'])
+        self.assertEqual(res[0]['invoice_id'], res[1]['invoice_id'])
+
+    def test_import_ubl_invoice_attachment(self):
+        sample_file = 'UBLKetentest_Referentiefactuur_20150100.xml'
+        with file_open(
+                'account_invoice_import_ubl/tests/files/' + sample_file,
+                'rb') as f:
+            xml_file = f.read()
+        attach = self.env['ir.attachment'].create({
+            'name': sample_file,
+            'datas': base64.b64encode(xml_file),
+            'datas_fname': sample_file,
+            'res_model': 'account.invoice.import',
+            })
+        wiz = self.env['account.invoice.import'].create({
+            'invoice_attachment_id': attach.id,
+            'invoice_filename': sample_file,
+            })
+        wiz.import_invoice()
+        inv = self.env['account.invoice'].search([
+            ('state', '=', 'draft'),
+            ('type', '=', 'in_invoice'),
+            ('reference', '=', '20150101'),
+            ])
+        self.assertEqual(len(inv), 1)
+        self.assertEqual(
+            inv.import_file_sha256, hashlib.sha256(xml_file).hexdigest())
+        # the uploaded attachment is linked to the invoice, not copied
+        self.assertEqual(attach.res_model, 'account.invoice')
+        self.assertEqual(attach.res_id, inv.id)
+        self.assertEqual(self.env['ir.attachment'].search([
+            ('res_model', '=', 'account.invoice'),
+            ('res_id', '=', inv.id),
+            ]), attach)
+
+    def test_parse_ubl_invoice_lines(self):
+        aiio = self.env['account.invoice.import']
+        self.assertIs(aiio._ubl_xpath('cbc:ID'), aiio._ubl_xpath('cbc:ID'))
+        for sample_file in [
+                'UBLKetentest_Referentiefactuur_20150100.xml',
+                'efff_BE0505890632_160421_Inv_16117778.xml',
+                'UBLInvoice-multitankcard-line_adjust.xml',
+                ]:
+            with file_open(
+                    'account_invoice_import_ubl/tests/files/' + sample_file,
+                    'rb') as f:
+                xml_root = etree.fromstring(f.read())
+            parsed_inv = aiio.parse_ubl_invoice(xml_root)
+            ns = {'cac': UBL_NAMESPACES['cac'], 'cbc': UBL_NAMESPACES['cbc']}
+            line_amounts = [
+                float(amount) for amount in xml_root.xpath(
+                    "cac:InvoiceLine/cbc:LineExtensionAmount/text()",
+                    namespaces=ns)
+                if float(amount)]
+            self.assertEqual(
+                [line['price_subtotal'] for line in parsed_inv['lines']],
+                line_amounts)
+            for line in parsed_inv['lines']:
+                self.assertTrue(line['name'])
+                self.assertTrue(line['qty'])
+                self.assertIn('barcode', line['product'])
+
+    def test_import_ubl_invoice_stream(self):
+        icpo = self.env['ir.config_parameter']
+        # force the streaming mode and the creation of the lines 1 by 1
+        icpo.set_param('account_invoice_import.stream_min_file_size', '1')
+        icpo.set_param('account_invoice_import.stream_batch_size', '1')
+        sample_file = 'UBLKetentest_Referentiefactuur_20150100.xml'
+        with file_open(
+                'account_invoice_import_ubl/tests/files/' + sample_file,
+                'rb') as f:
+            xml_file = f.read()
+        attach = self.env['ir.attachment'].create({
+            'name': sample_file,
+            'datas': base64.b64encode(xml_file),
+            'datas_fname': sample_file,
+            'res_model': 'account.invoice.import',
+            })
+        parsed_inv = self.env['account.invoice.import'].\
+            parse_xml_invoice_stream(attach)
+        self.assertEqual(parsed_inv['invoice_number'], '20150101')
+        self.assertNotIn('lines', parsed_inv)
+        xml_root = etree.fromstring(xml_file)
+        self.assertEqual(
+            list(parsed_inv['lines_stream']),
+            self.env['account.invoice.import'].parse_ubl_invoice(
+                xml_root)['lines'])
+        wiz = self.env['account.invoice.import'].create({
+            'invoice_attachment_id': attach.id,
+            'invoice_filename': sample_file,
+            })
+        wiz.import_invoice()
+        inv = self.env['account.invoice'].search([
+            ('state', '=', 'draft'),
+            ('type', '=', 'in_invoice'),
+            ('reference', '=', '20150101'),
+            ])
+        self.assertEqual(len(inv), 1)
+        self.assertEqual(attach.res_id, inv.id)
+        precision = self.env['decimal.precision'].precision_get('Account')
+        self.assertFalse(float_compare(
+            inv.amount_untaxed, 420.0, precision_digits=precision))
+        self.assertFalse(float_compare(
+            inv.amount_total, 475.20, precision_digits=precision))
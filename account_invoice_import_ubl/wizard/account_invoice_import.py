@@ -6,10 +6,14 @@ from odoo.exceptions import UserError
 from odoo.tools import float_compare
 from datetime import datetime
 from lxml import etree
+from odoo.addons.base_ubl.models.ubl import UBL_CAC, UBL_CBC
 import logging
 
 logger = logging.getLogger(__name__)
 
+UBL_INVOICE_TAG_PREFIX =\
+    '{urn:oasis:names:specification:ubl:schema:xsd:Invoice'
+
 
 class AccountInvoiceImport(models.TransientModel):
     _name = 'account.invoice.import'
@@ -19,23 +23,96 @@ class AccountInvoiceImport(models.TransientModel):
     def parse_xml_invoice(self, xml_root):
         if (
                 xml_root.tag and
-                xml_root.tag.startswith(
-                '{urn:oasis:names:specification:ubl:schema:xsd:Invoice')):
+                xml_root.tag.startswith(UBL_INVOICE_TAG_PREFIX)):
             return self.parse_ubl_invoice(xml_root)
         else:
             return super().parse_xml_invoice(xml_root)
 
+    @api.model
+    def parse_xml_invoice_stream(self, attachment):
+        """The header of the invoice is read with a first pass that stops
+        at the first InvoiceLine. The lines are read by a second pass
+        when the lines_stream generator is consumed"""
+        bdio = self.env['business.document.import']
+        xml_root = None
+        with bdio._open_attachment_file(attachment) as file_data:
+            try:
+                for event, elem in etree.iterparse(
+                        file_data, events=('start', ), huge_tree=True):
+                    if xml_root is None:
+                        xml_root = elem
+                        if not elem.tag.startswith(UBL_INVOICE_TAG_PREFIX):
+                            break
+                    elif (
+                            elem.tag == UBL_CAC + 'InvoiceLine' and
+                            elem.getparent() is xml_root):
+                        break
+            except etree.LxmlError:
+                # not XML-compliant: the regular import will raise
+                # the appropriate error
+                return False
+        if (
+                xml_root is None or
+                not xml_root.tag.startswith(UBL_INVOICE_TAG_PREFIX)):
+            return super().parse_xml_invoice_stream(attachment)
+        # The first line may be partially read
+        for iline in xml_root.findall(UBL_CAC + 'InvoiceLine'):
+            xml_root.remove(iline)
+        # The XML schema is checked by the second pass, on the full file
+        res, total_line, ubl_version = self.parse_ubl_invoice_header(
+            xml_root, check_xml_schema=False)
+        res['lines_stream'] = self._ubl_iter_invoice_lines(
+            attachment, xml_root.nsmap, ubl_version, total_line)
+        logger.info('Result of UBL XML header parsing: %s', res)
+        return res
+
+    @api.model
+    def _ubl_iter_invoice_lines(
+            self, attachment, namespaces, ubl_version, total_line):
+        bdio = self.env['business.document.import']
+        prec = self.env['decimal.precision'].precision_get('Account')
+        schema = self._ubl_get_xml_schema('Invoice', version=ubl_version)
+        counters = {'lines': 0.0}
+        with bdio._open_attachment_file(attachment) as file_data:
+            try:
+                for event, iline in etree.iterparse(
+                        file_data, events=('end', ),
+                        tag=UBL_CAC + 'InvoiceLine', schema=schema,
+                        huge_tree=True):
+                    line_vals = self.parse_ubl_invoice_line(
+                        iline, counters, namespaces)
+                    # free the memory of the lines already read
+                    iline.clear()
+                    while iline.getprevious() is not None:
+                        del iline.getparent()[0]
+                    if line_vals is not False:
+                        yield line_vals
+            except etree.LxmlError as e:
+                # the file is too big to be written in the server logs
+                logger.warning(
+                    "The XML file %s is invalid against the XML Schema "
+                    "Definition: %s", attachment.name, e)
+                raise UserError(_(
+                    "The UBL XML file is not valid against the official "
+                    "XML Schema Definition. "
+                    "Here is the error, which may give you an idea on the "
+                    "cause of the problem : %s.") % str(e))
+        if float_compare(
+                total_line, counters['lines'], precision_digits=prec):
+            logger.warning(
+                "The gloabl LineExtensionAmount (%s) doesn't match the "
+                "sum of the amounts of each line (%s). It can "
+                "have a diff of a few cents due to sum of rounded values vs "
+                "rounded sum policies.", total_line, counters['lines'])
+
     def get_attachments(self, xml_root, namespaces):
-        attach_xpaths = xml_root.xpath(
-            "//cac:AdditionalDocumentReference", namespaces=namespaces)
         attachments = {}
-        for attach_xpath in attach_xpaths:
-            filename_xpath = attach_xpath.xpath(
-                "cbc:ID", namespaces=namespaces)
-            filename = filename_xpath and filename_xpath[0].text or False
-            data_xpath = attach_xpath.xpath(
-                "cac:Attachment/cbc:EmbeddedDocumentBinaryObject",
-                namespaces=namespaces)
+        for attach_node in self._ubl_xpath(
+                "/inv:Invoice/cac:AdditionalDocumentReference")(xml_root):
+            filename = self._ubl_xpath_text(attach_node, "cbc:ID")
+            data_xpath = self._ubl_xpath(
+                "cac:Attachment/cbc:EmbeddedDocumentBinaryObject")(
+                attach_node)
             data_base64 = data_xpath and data_xpath[0].text or False
             if filename and data_base64:
                 if (
@@ -47,63 +124,22 @@ class AccountInvoiceImport(models.TransientModel):
                 attachments[filename] = data_base64
         return attachments
 
-    def parse_ubl_invoice_line(self, iline, counters, namespaces):
-        price_unit_xpath = iline.xpath(
-            "cac:Price/cbc:PriceAmount", namespaces=namespaces)
-        qty_xpath = iline.xpath(
-            "cbc:InvoicedQuantity", namespaces=namespaces)
-        # Some UBL invoices don't have any InvoicedQuantity tag
-        # So we have a fallback on quantity = 1
-        qty = 1
-        uom = {}
-        if qty_xpath:
-            if float(qty_xpath[0].text):
-                qty = float(qty_xpath[0].text)
-            if qty_xpath[0].attrib and qty_xpath[0].attrib.get('unitCode'):
-                unece_uom = qty_xpath[0].attrib['unitCode']
-                if unece_uom == 'ZZ':
-                    unece_uom = 'C62'
-                uom = {'unece_code': unece_uom}
-        product_dict = self.ubl_parse_product(iline, namespaces)
-        name_xpath = iline.xpath(
-            "cac:Item/cbc:Description", namespaces=namespaces)
-        name = name_xpath and name_xpath[0].text or '-'
-        price_subtotal_xpath = iline.xpath(
-            "cbc:LineExtensionAmount", namespaces=namespaces)
-        price_subtotal = float(price_subtotal_xpath[0].text)
-        if not price_subtotal:
-            return False
-        if price_unit_xpath:
-            price_unit = float(price_unit_xpath[0].text)
-        else:
-            price_unit = price_subtotal / qty
-        counters['lines'] += price_subtotal
-        taxes_xpath = iline.xpath(
-            "cac:Item/cac:ClassifiedTaxCategory", namespaces=namespaces)
-        if not taxes_xpath:
-            taxes_xpath = iline.xpath(
-                "cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory",
-                namespaces=namespaces)
+    def parse_ubl_invoice_line_taxes(self, tax_nodes):
         taxes = []
-        for tax in taxes_xpath:
-            type_code_xpath = tax.xpath(
-                "cac:TaxScheme/cbc:ID[@schemeAgencyID='6']",
-                namespaces=namespaces)
-            type_code = type_code_xpath and type_code_xpath[0].text or 'VAT'
-            categ_code_xpath = tax.xpath(
-                "cbc:ID", namespaces=namespaces)
+        for tax in tax_nodes:
+            type_code = self._ubl_xpath_text(
+                tax, "cac:TaxScheme/cbc:ID[@schemeAgencyID='6']") or 'VAT'
+            categ_code_node = tax.find(UBL_CBC + 'ID')
             # TODO: Understand why sometimes they use H
-            categ_code = categ_code_xpath and categ_code_xpath[0].text or False
+            categ_code = categ_code_node is not None and\
+                categ_code_node.text or False
             if categ_code == 'H':
                 categ_code = 'S'
-            percent_xpath = tax.xpath(
-                "cbc:Percent", namespaces=namespaces)
-            if not percent_xpath:
-                percent_xpath = tax.xpath(
-                    "../cbc:Percent", namespaces=namespaces)
-            if percent_xpath:
-                percentage = percent_xpath[0].text and\
-                    float(percent_xpath[0].text)
+            percent_node = tax.find(UBL_CBC + 'Percent')
+            if percent_node is None:
+                percent_node = tax.getparent().find(UBL_CBC + 'Percent')
+            if percent_node is not None:
+                percentage = percent_node.text and float(percent_node.text)
             else:
                 percentage = 0.0
             tax_dict = {
@@ -113,6 +149,62 @@ class AccountInvoiceImport(models.TransientModel):
                 'unece_categ_code': categ_code,
                 }
             taxes.append(tax_dict)
+        return taxes
+
+    def parse_ubl_invoice_line(self, iline, counters, namespaces):
+        # The children of the line and of its item are read in one pass,
+        # instead of running one XPath query per field on each line
+        qty_node = price_unit_node = price_subtotal_node = None
+        item_node = None
+        tax_total_nodes = []
+        for child in iline.iterchildren(tag=etree.Element):
+            if child.tag == UBL_CBC + 'InvoicedQuantity':
+                qty_node = child
+            elif child.tag == UBL_CBC + 'LineExtensionAmount':
+                price_subtotal_node = child
+            elif child.tag == UBL_CAC + 'Price' and price_unit_node is None:
+                price_unit_node = child.find(UBL_CBC + 'PriceAmount')
+            elif child.tag == UBL_CAC + 'Item':
+                item_node = child
+            elif child.tag == UBL_CAC + 'TaxTotal':
+                tax_total_nodes.append(child)
+        name = False
+        tax_nodes = []
+        if item_node is not None:
+            for child in item_node.iterchildren(tag=etree.Element):
+                if child.tag == UBL_CBC + 'Description' and name is False:
+                    name = child.text
+                elif child.tag == UBL_CAC + 'ClassifiedTaxCategory':
+                    tax_nodes.append(child)
+            product_dict = self.ubl_parse_item_product(item_node)
+        else:
+            product_dict = {'barcode': False, 'code': False}
+        # Some UBL invoices don't have any InvoicedQuantity tag
+        # So we have a fallback on quantity = 1
+        qty = 1
+        uom = {}
+        if qty_node is not None:
+            if float(qty_node.text):
+                qty = float(qty_node.text)
+            if qty_node.attrib and qty_node.attrib.get('unitCode'):
+                unece_uom = qty_node.attrib['unitCode']
+                if unece_uom == 'ZZ':
+                    unece_uom = 'C62'
+                uom = {'unece_code': unece_uom}
+        name = name or '-'
+        price_subtotal = float(price_subtotal_node.text)
+        if not price_subtotal:
+            return False
+        if price_unit_node is not None:
+            price_unit = float(price_unit_node.text)
+        else:
+            price_unit = price_subtotal / qty
+        counters['lines'] += price_subtotal
+        if not tax_nodes:
+            for tax_total_node in tax_total_nodes:
+                tax_nodes += self._ubl_xpath(
+                    "cac:TaxSubtotal/cac:TaxCategory")(tax_total_node)
+        taxes = self.parse_ubl_invoice_line_taxes(tax_nodes)
 
         vals = {
             'product': product_dict,
@@ -128,22 +220,46 @@ class AccountInvoiceImport(models.TransientModel):
     @api.model
     def parse_ubl_invoice(self, xml_root):
         """Parse UBL Invoice XML file"""
+        res, total_line, ubl_version = self.parse_ubl_invoice_header(
+            xml_root)
+        prec = self.env['decimal.precision'].precision_get('Account')
+        namespaces = xml_root.nsmap
+        res_lines = []
+        counters = {'lines': 0.0}
+        for iline in xml_root.iterchildren(UBL_CAC + 'InvoiceLine'):
+            line_vals = self.parse_ubl_invoice_line(
+                iline, counters, namespaces)
+            if line_vals is False:
+                continue
+            res_lines.append(line_vals)
+
+        if float_compare(
+                total_line, counters['lines'], precision_digits=prec):
+            logger.warning(
+                "The gloabl LineExtensionAmount (%s) doesn't match the "
+                "sum of the amounts of each line (%s). It can "
+                "have a diff of a few cents due to sum of rounded values vs "
+                "rounded sum policies.", total_line, counters['lines'])
+        res['lines'] = res_lines
+        logger.info('Result of UBL XML parsing: %s', res)
+        return res
+
+    @api.model
+    def parse_ubl_invoice_header(self, xml_root, check_xml_schema=True):
+        """Parse all the UBL Invoice XML file except the lines.
+        Returns a tuple (parsed invoice, LineExtensionAmount, UBL version)"""
         namespaces = xml_root.nsmap
         inv_xmlns = namespaces.pop(None)
         namespaces['inv'] = inv_xmlns
         logger.debug('XML file namespaces=%s', namespaces)
-        xml_string = etree.tostring(
-            xml_root, pretty_print=True, encoding='UTF-8',
-            xml_declaration=True)
-        ubl_version_xpath = xml_root.xpath(
-            "//cbc:UBLVersionID", namespaces=namespaces)
-        ubl_version = ubl_version_xpath and ubl_version_xpath[0].text or '2.1'
+        ubl_version = self._ubl_xpath_text(
+            xml_root, "/inv:Invoice/cbc:UBLVersionID") or '2.1'
         # Check XML schema to avoid headaches trying to import invalid files
-        self._ubl_check_xml_schema(xml_string, 'Invoice', version=ubl_version)
-        prec = self.env['decimal.precision'].precision_get('Account')
-        doc_type_xpath = xml_root.xpath(
-            "/inv:Invoice/cbc:InvoiceTypeCode[@listAgencyID='6']",
-            namespaces=namespaces)
+        if check_xml_schema:
+            self._ubl_check_xml_tree(
+                xml_root, 'Invoice', version=ubl_version)
+        doc_type_xpath = self._ubl_xpath(
+            "/inv:Invoice/cbc:InvoiceTypeCode[@listAgencyID='6']")(xml_root)
         inv_type = 'in_invoice'
         if doc_type_xpath:
             inv_type_code = doc_type_xpath[0].text
@@ -153,93 +269,67 @@ class AccountInvoiceImport(models.TransientModel):
                     "(InvoiceTypeCode is %s") % inv_type_code)
             if inv_type_code == '381':
                 inv_type = 'in_refund'
-        inv_number_xpath = xml_root.xpath('//cbc:ID', namespaces=namespaces)
-        ord_number_xpath = xml_root.xpath('//cac:OrderReference/cbc:ID',
-                                          namespaces=namespaces)
-        origin = False
-        if ord_number_xpath:
-            origin = ord_number_xpath[0].text
-        supplier_xpath = xml_root.xpath(
-            '/inv:Invoice/cac:AccountingSupplierParty',
-            namespaces=namespaces)
+        inv_number_xpath = self._ubl_xpath('/inv:Invoice/cbc:ID')(xml_root)
+        origin = self._ubl_xpath_text(
+            xml_root, '/inv:Invoice/cac:OrderReference/cbc:ID')
+        supplier_xpath = self._ubl_xpath(
+            '/inv:Invoice/cac:AccountingSupplierParty')(xml_root)
         supplier_dict = self.ubl_parse_supplier_party(
             supplier_xpath[0], namespaces)
-        customer_xpath_party = xml_root.xpath(
-            '/inv:Invoice/cac:AccountingCustomerParty/cac:Party',
-            namespaces=namespaces)
+        customer_xpath_party = self._ubl_xpath(
+            '/inv:Invoice/cac:AccountingCustomerParty/cac:Party')(xml_root)
         company_dict_full = self.ubl_parse_party(
             customer_xpath_party[0], namespaces)
         company_dict = {}
         # We only take the "official references" for company_dict
         if company_dict_full.get('vat'):
             company_dict = {'vat': company_dict_full['vat']}
-        date_xpath = xml_root.xpath(
-            '/inv:Invoice/cbc:IssueDate', namespaces=namespaces)
+        date_xpath = self._ubl_xpath('/inv:Invoice/cbc:IssueDate')(xml_root)
         date_dt = datetime.strptime(date_xpath[0].text, '%Y-%m-%d')
-        date_due_xpath = xml_root.xpath(
-            "//cbc:PaymentDueDate", namespaces=namespaces)
+        date_due_xpath = self._ubl_xpath(
+            "/inv:Invoice/cac:PaymentMeans/cbc:PaymentDueDate|"
+            "/inv:Invoice/cac:PaymentTerms/cbc:PaymentDueDate")(xml_root)
         date_due_str = False
         if date_due_xpath:
             date_due_dt = datetime.strptime(date_due_xpath[0].text, '%Y-%m-%d')
             date_due_str = fields.Date.to_string(date_due_dt)
-        currency_iso_xpath = xml_root.xpath(
-            "/inv:Invoice/cbc:DocumentCurrencyCode", namespaces=namespaces)
-        total_untaxed_xpath = xml_root.xpath(
-            "/inv:Invoice/cac:LegalMonetaryTotal/cbc:TaxExclusiveAmount",
-            namespaces=namespaces)
+        currency_iso_xpath = self._ubl_xpath(
+            "/inv:Invoice/cbc:DocumentCurrencyCode")(xml_root)
+        total_untaxed_xpath = self._ubl_xpath(
+            "/inv:Invoice/cac:LegalMonetaryTotal/cbc:TaxExclusiveAmount")(
+            xml_root)
         amount_untaxed = float(total_untaxed_xpath[0].text)
-        total_line_xpath = xml_root.xpath(
-            "/inv:Invoice/cac:LegalMonetaryTotal/cbc:LineExtensionAmount",
-            namespaces=namespaces)
+        total_line_xpath = self._ubl_xpath(
+            "/inv:Invoice/cac:LegalMonetaryTotal/cbc:LineExtensionAmount")(
+            xml_root)
         if total_line_xpath:
             total_line = float(total_line_xpath[0].text)
         else:
             total_line = amount_untaxed
-        amount_total_xpath = xml_root.xpath(
-            "/inv:Invoice/cac:LegalMonetaryTotal/cbc:TaxInclusiveAmount",
-            namespaces=namespaces)
+        amount_total_xpath = self._ubl_xpath(
+            "/inv:Invoice/cac:LegalMonetaryTotal/cbc:TaxInclusiveAmount")(
+            xml_root)
         if amount_total_xpath:
             amount_total = float(amount_total_xpath[0].text)
         else:
-            payable_total = xml_root.xpath(
-                "/inv:Invoice/cac:LegalMonetaryTotal/cbc:PayableAmount",
-                namespaces=namespaces)
+            payable_total = self._ubl_xpath(
+                "/inv:Invoice/cac:LegalMonetaryTotal/cbc:PayableAmount")(
+                xml_root)
             amount_total = float(payable_total[0].text)
-        payment_type_code = xml_root.xpath(
+        payment_type_code = self._ubl_xpath(
             "/inv:Invoice/cac:PaymentMeans/"
-            "cbc:PaymentMeansCode[@listAgencyID='6']",
-            namespaces=namespaces)
+            "cbc:PaymentMeansCode[@listAgencyID='6']")(xml_root)
         iban_xpath = bic_xpath = False
         if payment_type_code and payment_type_code[0].text == '31':
-            iban_xpath = xml_root.xpath(
-                "//cac:PayeeFinancialAccount/cbc:ID[@schemeID='IBAN']",
-                namespaces=namespaces)
-            bic_xpath = xml_root.xpath(
-                "//cac:PayeeFinancialAccount"
+            iban_xpath = self._ubl_xpath(
+                "/inv:Invoice/cac:PaymentMeans/cac:PayeeFinancialAccount"
+                "/cbc:ID[@schemeID='IBAN']")(xml_root)
+            bic_xpath = self._ubl_xpath(
+                "/inv:Invoice/cac:PaymentMeans/cac:PayeeFinancialAccount"
                 "/cac:FinancialInstitutionBranch"
                 "/cac:FinancialInstitution"
-                "/cbc:ID[@schemeID='BIC']",
-                namespaces=namespaces)
+                "/cbc:ID[@schemeID='BIC']")(xml_root)
         attachments = self.get_attachments(xml_root, namespaces)
-        res_lines = []
-        counters = {'lines': 0.0}
-        inv_line_xpath = xml_root.xpath(
-            "/inv:Invoice/cac:InvoiceLine", namespaces=namespaces)
-        for iline in inv_line_xpath:
-            line_vals = self.parse_ubl_invoice_line(
-                iline, counters, namespaces)
-            if line_vals is False:
-                continue
-            res_lines.append(line_vals)
-
-        if float_compare(
-                total_line, counters['lines'], precision_digits=prec):
-            logger.warning(
-                "The gloabl LineExtensionAmount (%s) doesn't match the "
-                "sum of the amounts of each line (%s). It can "
-                "have a diff of a few cents due to sum of rounded values vs "
-                "rounded sum policies.", total_line, counters['lines'])
-
         res = {
             'type': inv_type,
             'partner': supplier_dict,
@@ -253,7 +343,6 @@ class AccountInvoiceImport(models.TransientModel):
             'amount_untaxed': amount_untaxed,
             'iban': iban_xpath and iban_xpath[0].text or False,
             'bic': bic_xpath and bic_xpath[0].text or False,
-            'lines': res_lines,
             'attachments': attachments,
             }
         # Hack for the sample UBL invoices that use an invalid VAT number
@@ -262,5 +351,4 @@ class AccountInvoiceImport(models.TransientModel):
         # and invalid IBAN
         if res['iban'] == 'NL23ABNA0123456789':
             res.pop('iban')
-        logger.info('Result of UBL XML parsing: %s', res)
-        return res
+        return res, total_line, ubl_version
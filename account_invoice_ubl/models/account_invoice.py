@@ -259,16 +259,59 @@ class AccountInvoice(models.Model):
         # not worth the additional code to handle the 2 langs
         xml_root = self.with_context(lang=lang).\
             generate_invoice_ubl_xml_etree(version=version)
+        self._ubl_check_xml_tree(xml_root, 'Invoice', version=version)
         xml_string = etree.tostring(
             xml_root, pretty_print=True, encoding='UTF-8',
             xml_declaration=True)
-        self._ubl_check_xml_schema(xml_string, 'Invoice', version=version)
         logger.debug(
             'Invoice UBL XML file generated for account invoice ID %d '
             '(state %s)', self.id, self.state)
         logger.debug(xml_string.decode('utf-8'))
         return xml_string
 
+    @api.multi
+    def _ubl_prefetch(self):
+        """Read in a few queries, for all the invoices of the recordset,
+        the related records that are used to generate their UBL XML file,
+        instead of reading them invoice per invoice"""
+        self.mapped('partner_id.commercial_partner_id.country_id')
+        if 'partner_shipping_id' in self._fields:
+            self.mapped('partner_shipping_id.country_id')
+        self.mapped('company_id.partner_id.country_id')
+        self.mapped('partner_bank_id.bank_id')
+        self.mapped('payment_mode_id.payment_method_id')
+        self.mapped('payment_term_id.line_ids')
+        self.mapped('tax_line_ids.tax_id.unece_type_id')
+        lines = self.mapped('invoice_line_ids')
+        lines.mapped('uom_id')
+        lines.mapped('invoice_line_tax_ids.unece_type_id')
+        lines.mapped('product_id.product_tmpl_id.taxes_id')
+        lines.mapped('product_id.attribute_value_ids')
+
+    @api.multi
+    def _ubl_prefetch_per_lang(self):
+        invoice_ids_by_lang = {}
+        for invoice in self:
+            invoice_ids_by_lang.setdefault(
+                invoice.get_ubl_lang(), []).append(invoice.id)
+        # The data is read in the lang used by generate_ubl_xml_string()
+        for lang, invoice_ids in invoice_ids_by_lang.items():
+            self.with_context(lang=lang).browse(invoice_ids)._ubl_prefetch()
+
+    @api.multi
+    def generate_ubl_xml_strings(self, version='2.1'):
+        """Generate the UBL XML files of several invoices. The related
+        data of the invoices is read once for the whole recordset, and
+        the Party block of the company is built once
+        (cf _ubl_add_company_party()).
+        Returns an iterator of (invoice, filename, xml_string)"""
+        self._ubl_prefetch_per_lang()
+        self = self.with_context(ubl_company_parties={})
+        for invoice in self:
+            xml_string = invoice.generate_ubl_xml_string(version=version)
+            filename = invoice.get_ubl_filename(version=version)
+            yield (invoice, filename, xml_string)
+
     @api.multi
     def get_ubl_filename(self, version='2.1'):
         """This method is designed to be inherited"""
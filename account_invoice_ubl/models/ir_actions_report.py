@@ -2,8 +2,12 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import logging
+
 from odoo import api, models
 
+logger = logging.getLogger(__name__)
+
 
 class IrActionsReport(models.Model):
     _inherit = "ir.actions.report"
@@ -27,9 +31,59 @@ class IrActionsReport(models.Model):
                 pdf_content = invoice.with_context(
                     no_embedded_pdf=True).embed_ubl_xml_in_pdf(
                     pdf_content=pdf_content)
+        elif (
+                len(self) == 1 and
+                self.report_name in invoice_reports and
+                self.attachment and
+                pdf_content and
+                res_ids and
+                len(res_ids) > 1 and
+                not self._context.get('no_embedded_ubl_xml')):
+            ubl_pdfs = self._ubl_batch_pdf(pdf_content, res_ids)
+            if ubl_pdfs:
+                # keep the PDF files prepared for the invoices of the
+                # companies that use another format
+                pdf_contents = dict(
+                    self._context.get('e_invoice_pdf_contents') or {})
+                pdf_contents.update(ubl_pdfs)
+                self = self.with_context(e_invoice_pdf_contents=pdf_contents)
         return super()._post_pdf(
             save_in_attachment, pdf_content=pdf_content, res_ids=res_ids)
 
+    @api.multi
+    def _ubl_batch_pdf(self, pdf_content, res_ids):
+        """Embed the UBL XML file of each invoice of a report rendered for
+        several invoices in its part of the PDF, with embed_ubl_xml_in_pdf()
+        like for a single invoice. The data of the invoices is read once
+        for all the XML files.
+        Returns a dict with key = invoice ID, value = PDF with UBL XML"""
+        self.ensure_one()
+        invoices = self.env['account.invoice'].browse(res_ids)
+        to_embed = [
+            i for (i, invoice) in enumerate(invoices)
+            if invoice.type in ('out_invoice', 'out_refund') and
+            invoice.state in ('open', 'paid') and
+            invoice.company_id.xml_format_in_pdf_invoice == 'ubl']
+        if not to_embed:
+            return {}
+        pdf_contents = self._split_pdf_per_record(pdf_content, len(res_ids))
+        if not pdf_contents:
+            return {}
+        ubl_invoices = invoices.browse([invoices[i].id for i in to_embed])
+        ubl_invoices._ubl_prefetch_per_lang()
+        # the Party block of the company is built once for the batch
+        invoices = invoices.with_context(ubl_company_parties={})
+        res = {}
+        for i in to_embed:
+            invoice = invoices[i]
+            res[invoice.id] = invoice.with_context(
+                no_embedded_pdf=True).embed_ubl_xml_in_pdf(
+                pdf_content=pdf_contents[i])
+        logger.info(
+            'UBL XML file embedded in the PDF of %d invoices for report %s',
+            len(res), self.report_name)
+        return res
+
     @classmethod
     def _get_invoice_reports_ubl(cls):
         return [
@@ -3,6 +3,11 @@
 # Copyright 2019 Onestein (<https://www.onestein.eu>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import base64
+from lxml import etree
+
+from odoo.exceptions import UserError
+
 from odoo.addons.account_tax_unece.tests.test_account_invoice import \
     TestAccountInvoice
 
@@ -27,6 +32,84 @@ class TestUblInvoice(TestAccountInvoice):
             invoice_filename = invoice.get_ubl_filename(version=version)
             self.assertTrue(invoice_filename in res)
 
+    def test_ubl_xml_schema_cache(self):
+        buo = self.env['base.ubl']
+        invoice = self.test_only_create_invoice()
+        version = '2.1'
+        xml_string = invoice.generate_ubl_xml_string(version=version)
+        schema = buo._ubl_get_xml_schema('Invoice', version=version)
+        self.assertIs(
+            schema, buo._ubl_get_xml_schema('Invoice', version=version))
+        self.assertTrue(buo._ubl_check_xml_schema(
+            xml_string, 'Invoice', version=version))
+        # an already parsed tree is validated without serialization
+        xml_root = etree.fromstring(xml_string)
+        self.assertTrue(buo._ubl_check_xml_tree(
+            xml_root, 'Invoice', version=version))
+        # InvoiceLine is mandatory
+        for iline in xml_root.xpath("*[local-name()='InvoiceLine']"):
+            xml_root.remove(iline)
+        with self.assertRaises(UserError):
+            buo._ubl_check_xml_tree(xml_root, 'Invoice', version=version)
+
+    def test_ubl_generate_multi(self):
+        invoices = self.test_only_create_invoice()
+        invoices |= self.test_only_create_invoice()
+        version = '2.1'
+        res = list(invoices.generate_ubl_xml_strings(version=version))
+        self.assertEqual([r[0] for r in res], list(invoices))
+        for (invoice, filename, xml_string) in res:
+            self.assertEqual(
+                filename, invoice.get_ubl_filename(version=version))
+            xml_root = etree.fromstring(xml_string)
+            self.assertEqual(
+                xml_root.xpath("*[local-name()='ID']")[0].text,
+                invoice.number)
+
+    def test_ubl_generate_multi_pdf(self):
+        buo = self.env['base.ubl']
+        invoices = self.test_only_create_invoice()
+        invoices |= self.test_only_create_invoice()
+        company = invoices[0].company_id
+        if company.xml_format_in_pdf_invoice != 'ubl':
+            company.xml_format_in_pdf_invoice = 'ubl'
+        inv_report = self.env.ref('account.account_invoices').with_context(
+            force_report_rendering=True)
+        inv_report.render_qweb_pdf(res_ids=invoices.ids)
+        for invoice in invoices:
+            attach = self.env['ir.attachment'].search([
+                ('res_model', '=', 'account.invoice'),
+                ('res_id', '=', invoice.id),
+                ('mimetype', '=', 'application/pdf'),
+                ])
+            self.assertEqual(len(attach), 1)
+            res = buo.get_xml_files_from_pdf(base64.b64decode(attach.datas))
+            xml_root = res.get(invoice.get_ubl_filename())
+            self.assertIsNotNone(xml_root)
+            self.assertEqual(
+                xml_root.xpath("*[local-name()='ID']")[0].text,
+                invoice.number)
+
+    def test_embed_xml_in_pdf_incremental(self):
+        buo = self.env['base.ubl']
+        ro = self.env.ref('account.account_invoices')
+        invoice = self.test_only_create_invoice()
+        pdf_content = ro.with_context(
+            no_embedded_ubl_xml=True,
+            force_report_rendering=True,
+        ).render_qweb_pdf(invoice.ids)[0]
+        xml_string = invoice.generate_ubl_xml_string()
+        filename = invoice.get_ubl_filename()
+        new_pdf_content = buo.embed_xml_in_pdf(
+            xml_string, filename, pdf_content=pdf_content)
+        # the pages are not rewritten, only the XML file is appended
+        self.assertTrue(new_pdf_content.startswith(pdf_content))
+        self.assertIn(filename, buo.get_xml_files_from_pdf(new_pdf_content))
+        full_pdf_content = buo.embed_xml_in_pdf(
+            xml_string, filename, pdf_content=pdf_content,
+            incremental=False)
+        self.assertIn(filename, buo.get_xml_files_from_pdf(full_pdf_content))
+
     def test_install_uninstall_hooks(self):
         set_xml_format_in_pdf_invoice_to_ubl(self.env.cr, None)
         self.assertTrue(self.env['res.company'].search([
@@ -40,3 +123,27 @@ class TestUblInvoice(TestAccountInvoice):
         self.assertTrue(self.env['res.company'].search([
             ('xml_format_in_pdf_invoice', '=', 'ubl')
         ]))
+
+    def test_ubl_company_party_memo(self):
+        invoices = self.test_only_create_invoice()
+        invoices |= self.test_only_create_invoice()
+        company = invoices[0].company_id
+        party_xpath = (
+            "*[local-name()='AccountingSupplierParty']"
+            "/*[local-name()='Party']")
+        xml_root = etree.fromstring(invoices[0].generate_ubl_xml_string())
+        party_string = etree.tostring(xml_root.xpath(party_xpath)[0])
+        # the Party block of the company is built once for the batch
+        for (invoice, filename, xml_string) in\
+                invoices.generate_ubl_xml_strings():
+            # the copied block doesn't add namespace declarations
+            self.assertEqual(xml_string.count(b'xmlns:cac='), 1)
+            party = etree.fromstring(xml_string).xpath(party_xpath)[0]
+            self.assertEqual(etree.tostring(party), party_string)
+            party_name = party.xpath(
+                "*[local-name()='PartyName']/*[local-name()='Name']")
+            self.assertEqual(party_name[0].text, company.partner_id.name)
+        # the next batch sees the modification of the company partner
+        company.partner_id.city = 'Test City UBL'
+        res = list(invoices[0].generate_ubl_xml_strings())
+        self.assertIn(b'Test City UBL', res[0][2])
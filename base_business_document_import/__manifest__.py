@@ -4,7 +4,7 @@
 
 {
     'name': 'Base Business Document Import',
-    'version': '12.0.1.0.0',
+    'version': '12.0.1.1.0',
     'category': 'Tools',
     'license': 'AGPL-3',
     'summary': 'Provides technical tools to import sale orders or supplier '
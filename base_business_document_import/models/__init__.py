@@ -1 +1,4 @@
 from . import business_document_import
+from . import res_currency
+from . import res_country
+from . import uom_uom
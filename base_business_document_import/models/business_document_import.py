@@ -2,22 +2,34 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from odoo import models, api, _
-from odoo.tools import float_compare
+from odoo import models, api, tools, _
+from odoo.tools import float_compare, float_round
 from odoo.addons.base_iban.models.res_partner_bank import validate_iban
 from odoo.exceptions import UserError
 from lxml import etree
 from io import BytesIO
+from bisect import bisect_left
+from fnmatch import fnmatch
+from contextlib import contextmanager
 import mimetypes
+import base64
+import mmap
+import os
 from urllib.parse import urlparse
 import logging
 logger = logging.getLogger(__name__)
 
 try:
     import PyPDF2
+    from PyPDF2.generic import IndirectObject
 except ImportError:
     logger.debug('Cannot import PyPDF2')
 
+# Names of the XML files embedded in PDF invoices by the e-invoice
+# standards (Factur-X, ZUGFeRD 1.0, UBL in PDF), in lowercase
+PDF_XML_FILENAME_PATTERNS = [
+    'factur-x.xml', 'zugferd-invoice.xml', 'ubl-invoice-*.xml']
+
 
 class BusinessDocumentImport(models.AbstractModel):
     _name = 'business.document.import'
@@ -42,9 +54,91 @@ class BusinessDocumentImport(models.AbstractModel):
             if match_dict.get('state_code'):
                 match_dict['state_code'] = match_dict['state_code'].upper()
 
+    @api.model
+    @tools.ormcache()
+    def _get_reference_data(self):
+        """Returns the lookup tables of the reference data:
+        {
+            'currency_iso': {iso_code: currency_id},
+            'currency_symbol': {symbol: [currency_id1, currency_id2]},
+            'country': {country_code: (country_id, currency_id)},
+            'state': {(country_id, state_code): state_id},
+            'uom_unece': {unece_code: uom_id},
+        }
+        These tables are small and rarely change, so they are read once
+        per process. Only this cache is invalidated when the related
+        records are created or unlinked, or when the fields used here
+        are written (cf res_currency.py, res_country.py and uom_uom.py)"""
+        sudo_env = self.sudo().with_context(active_test=True).env
+        currency_iso = {}
+        currency_symbol = {}
+        for cur in sudo_env['res.currency'].search_read(
+                [], ['name', 'symbol']):
+            currency_iso.setdefault(cur['name'], cur['id'])
+            if cur['symbol']:
+                currency_symbol.setdefault(cur['symbol'], []).append(
+                    cur['id'])
+        country = {}
+        for ctry in sudo_env['res.country'].search_read(
+                [], ['code', 'currency_id']):
+            if ctry['code']:
+                country.setdefault(ctry['code'], (
+                    ctry['id'],
+                    ctry['currency_id'] and ctry['currency_id'][0]))
+        state = {}
+        for cstate in sudo_env['res.country.state'].search_read(
+                [], ['code', 'country_id']):
+            state.setdefault(
+                (cstate['country_id'][0], cstate['code']), cstate['id'])
+        uom_unece = {}
+        for uom in sudo_env['uom.uom'].search_read(
+                [('unece_code', '!=', False)], ['unece_code']):
+            uom_unece.setdefault(uom['unece_code'], uom['id'])
+        return {
+            'currency_iso': currency_iso,
+            'currency_symbol': currency_symbol,
+            'country': country,
+            'state': state,
+            'uom_unece': uom_unece,
+            }
+
+    @api.model
+    @tools.ormcache('lang')
+    def _get_uom_names(self, lang):
+        """Returns the list of (lowercase name, uom_id) in the
+        order of uom.uom, with the name translated in lang"""
+        uoms = self.env['uom.uom'].sudo().with_context(
+            lang=lang, active_test=True).search_read([], ['name'])
+        return [(uom['name'].lower(), uom['id']) for uom in uoms]
+
+    @api.model
+    def _get_country_from_code(self, country_code):
+        country = self._get_reference_data()['country'].get(country_code)
+        return self.env['res.country'].browse(country and country[0])
+
+    @api.model
+    def _get_state_from_code(self, country, state_code):
+        state_id = self._get_reference_data()['state'].get(
+            (country.id, state_code))
+        return self.env['res.country.state'].browse(state_id)
+
+    @api.model
+    def _get_uom_from_name(self, name):
+        """Same result as search([('name', '=ilike', name + '%')], limit=1)"""
+        uuo = self.env['uom.uom']
+        if '%' in name or '_' in name:
+            return uuo.search([('name', '=ilike', name + '%')], limit=1)
+        name = name.lower()
+        for uom_name, uom_id in self._get_uom_names(
+                self._context.get('lang')):
+            if uom_name.startswith(name):
+                return uuo.browse(uom_id)
+        return uuo
+
     @api.model
     def _match_partner(
-            self, partner_dict, chatter_msg, partner_type='supplier'):
+            self, partner_dict, chatter_msg, partner_type='supplier',
+            speed_dict=None):
         """Example:
         partner_dict = {
             'country_code': 'FR',
@@ -58,6 +152,13 @@ class BusinessDocumentImport(models.AbstractModel):
             }
         The key 'phone' is used by the module
         base_phone_business_document_import
+
+        speed_dict is an optional dict that is used as a memo for the
+        duration of an import batch: a partner_dict with the same
+        identifiers is only matched once, and the chatter messages of
+        the first match are replayed. It is also used by
+        _prefetch_partners_vat() to store the result of its bulk queries.
+        Never keep it across transactions.
         """
         rpo = self.env['res.partner']
         self._strip_cleanup_dict(partner_dict)
@@ -65,6 +166,38 @@ class BusinessDocumentImport(models.AbstractModel):
             return partner_dict['recordset']
         if partner_dict.get('id'):
             return rpo.browse(partner_dict['id'])
+        if speed_dict is None:
+            return self._match_partner_search(
+                partner_dict, chatter_msg, partner_type=partner_type)
+        memo = speed_dict.setdefault('partner_memo', {})
+        memo_key = self._match_partner_memo_key(partner_dict, partner_type)
+        if memo_key not in memo:
+            match_msg = []
+            partner = self._match_partner_search(
+                partner_dict, match_msg, partner_type=partner_type,
+                speed_dict=speed_dict)
+            memo[memo_key] = (partner.id, match_msg)
+        partner_id, match_msg = memo[memo_key]
+        chatter_msg += match_msg
+        return rpo.browse(partner_id)
+
+    @api.model
+    def _match_partner_memo_key(self, partner_dict, partner_type):
+        company_id = self._context.get('force_company') or\
+            self.env.user.company_id.id
+        identifiers = []
+        for key, value in partner_dict.items():
+            if key in ('recordset', 'id'):
+                continue
+            if not isinstance(value, (str, int, float, bool, type(None))):
+                continue
+            if key == 'vat' and value:
+                value = value.replace(' ', '').upper()
+            identifiers.append((key, value))
+        return (company_id, partner_type, tuple(sorted(identifiers)))
+
+    @api.model
+    def _match_partner_domain(self, partner_type):
         company_id = self._context.get('force_company') or\
             self.env.user.company_id.id
         domain = [
@@ -78,10 +211,85 @@ class BusinessDocumentImport(models.AbstractModel):
             partner_type_label = _('customer')
         else:
             partner_type_label = _('partner')
+        return domain, partner_type_label
+
+    @api.model
+    def _match_partners(
+            self, partner_dicts, chatter_msgs, partner_type='supplier',
+            speed_dict=None):
+        """Match a list of partner_dict at once. chatter_msgs is a list
+        of chatter_msg lists (one per partner_dict). Returns the list
+        of matched partners, in the same order as partner_dicts.
+        The VAT numbers of all the partner_dicts are searched with one
+        query (cf _prefetch_partners_vat()), then each partner_dict goes
+        through _match_partner() with the same fallback order and chatter
+        messages as an isolated call."""
+        assert len(partner_dicts) == len(chatter_msgs)
+        if speed_dict is None:
+            speed_dict = {}
+        self._prefetch_partners_vat(
+            partner_dicts, partner_type=partner_type, speed_dict=speed_dict)
+        res = []
+        for partner_dict, chatter_msg in zip(partner_dicts, chatter_msgs):
+            res.append(self._match_partner(
+                partner_dict, chatter_msg, partner_type=partner_type,
+                speed_dict=speed_dict))
+        return res
+
+    @api.model
+    def _prefetch_partners_vat(
+            self, partner_dicts, partner_type='supplier', speed_dict=None):
+        """Search the partners of the VAT numbers of all the partner_dicts
+        with one query and store them in speed_dict, where
+        _match_partner() will find them. It doesn't raise when a partner
+        is not found, so it can be called for a batch of documents before
+        they are imported one by one"""
+        if speed_dict is None:
+            speed_dict = {}
+        rpo = self.env['res.partner']
+        for partner_dict in partner_dicts:
+            self._strip_cleanup_dict(partner_dict)
+        to_match = [
+            partner_dict for partner_dict in partner_dicts
+            if not partner_dict.get('recordset') and
+            not partner_dict.get('id')]
+        domain = self._match_partner_domain(partner_type)[0]
+        company_id = self._context.get('force_company') or\
+            self.env.user.company_id.id
+        vat_partners = speed_dict.setdefault('partner_vat', {})
+        vats = set()
+        for pdict in to_match:
+            if pdict.get('vat'):
+                vat = pdict['vat'].replace(' ', '').upper()
+                if (company_id, partner_type, vat) not in vat_partners:
+                    vats.add(vat)
+        if vats:
+            for vat in vats:
+                vat_partners[(company_id, partner_type, vat)] = []
+            # the order of search() is kept, so that the first partner
+            # of each list is the one that search(limit=1) would return
+            for partner in rpo.search(domain + [
+                    ('parent_id', '=', False),
+                    ('sanitized_vat', 'in', list(vats))]):
+                vat_partners[
+                    (company_id, partner_type, partner.sanitized_vat)].append(
+                    partner.id)
+        return speed_dict
+
+    @api.model
+    def _match_partner_search(
+            self, partner_dict, chatter_msg, partner_type='supplier',
+            speed_dict=None):
+        rpo = self.env['res.partner']
+        if speed_dict is None:
+            speed_dict = {}
+        company_id = self._context.get('force_company') or\
+            self.env.user.company_id.id
+        domain, partner_type_label = self._match_partner_domain(partner_type)
         country = False
+        state = False
         if partner_dict.get('country_code'):
-            country = self.env['res.country'].search([
-                ('code', '=', partner_dict['country_code'])], limit=1)
+            country = self._get_country_from_code(partner_dict['country_code'])
             if country:
                 domain += [
                     '|',
@@ -93,9 +301,8 @@ class BusinessDocumentImport(models.AbstractModel):
                     "country code. But there are no country with that code "
                     "in Odoo.") % partner_dict['country_code'])
         if country and partner_dict.get('state_code'):
-            state = self.env['res.country.state'].search([
-                ('code', '=', partner_dict['state_code']),
-                ('country_id', '=', country.id)], limit=1)
+            state = self._get_state_from_code(
+                country, partner_dict['state_code'])
             if state:
                 domain += [
                     '|',
@@ -103,11 +310,21 @@ class BusinessDocumentImport(models.AbstractModel):
                     ('state_id', '=', state.id)]
         if partner_dict.get('vat'):
             vat = partner_dict['vat'].replace(' ', '').upper()
-            # use base_vat_sanitized
-            partner = rpo.search(
-                domain + [
-                    ('parent_id', '=', False),
-                    ('sanitized_vat', '=', vat)], limit=1)
+            vat_partners = speed_dict.get('partner_vat', {})
+            vat_key = (company_id, partner_type, vat)
+            if vat_key in vat_partners:
+                partner = rpo.browse(vat_partners[vat_key]).filtered(
+                    lambda p: (
+                        (not country or not p.country_id or
+                         p.country_id == country) and
+                        (not state or not p.state_id or
+                         p.state_id == state)))[:1]
+            else:
+                # use base_vat_sanitized
+                partner = rpo.search(
+                    domain + [
+                        ('parent_id', '=', False),
+                        ('sanitized_vat', '=', vat)], limit=1)
             if partner:
                 return partner
             else:
@@ -225,8 +442,7 @@ class BusinessDocumentImport(models.AbstractModel):
         country = False
         parent_partner_matches = True
         if address_dict.get('country_code'):
-            country = self.env['res.country'].search([
-                ('code', '=', address_dict['country_code'])], limit=1)
+            country = self._get_country_from_code(address_dict['country_code'])
             if country:
                 domain += [
                     '|',
@@ -240,9 +456,8 @@ class BusinessDocumentImport(models.AbstractModel):
                     "country code. But there are no country with that code "
                     "in Odoo.") % address_dict['country_code'])
         if country and address_dict.get('state_code'):
-            state = self.env['res.country.state'].search([
-                ('code', '=', address_dict['state_code']),
-                ('country_id', '=', country.id)], limit=1)
+            state = self._get_state_from_code(
+                country, address_dict['state_code'])
             if state:
                 domain += [
                     '|',
@@ -336,12 +551,87 @@ class BusinessDocumentImport(models.AbstractModel):
                 % (iban, partner.id, partner.display_name))
 
     @api.model
-    def _match_product(self, product_dict, chatter_msg, seller=False):
+    def _prepare_product_speed_dict(self, product_dicts):
+        """Returns the index of the products that match the barcodes and
+        the codes of product_dicts (the lines of an import batch):
+        {
+            'barcode': {barcode: (rank, product_id)},
+            'code': {default_code: (rank, product_id)},
+            'seller_code': {(seller_id, product_code): product_id or False},
+        }
+        rank is the position of the product in the default order of
+        product.product, so that the result is the same as search(limit=1).
+        The index is built with 3 queries, whatever the number of lines"""
+        ppo = self.env['product.product']
+        company_id = self._context.get('force_company') or\
+            self.env.user.company_id.id
+        cdomain = [
+            '|', ('company_id', '=', False), ('company_id', '=', company_id)]
+        identifiers = set()
+        codes = set()
+        for product_dict in product_dicts:
+            self._strip_cleanup_dict(product_dict)
+            if product_dict.get('barcode'):
+                identifiers.add(product_dict['barcode'])
+            if product_dict.get('code'):
+                codes.add(product_dict['code'])
+        identifiers |= codes
+        speed_dict = {
+            'barcode': {},
+            'code': {},
+            'seller_code': {},
+            }
+        if not identifiers:
+            return speed_dict
+        products = ppo.search_read(cdomain + [
+            '|', ('barcode', 'in', list(identifiers)),
+            ('default_code', 'in', list(codes))],
+            ['barcode', 'default_code'])
+        for rank, product in enumerate(products):
+            if product['barcode']:
+                speed_dict['barcode'].setdefault(
+                    product['barcode'], (rank, product['id']))
+            if product['default_code']:
+                speed_dict['code'].setdefault(
+                    product['default_code'], (rank, product['id']))
+        if not codes:
+            return speed_dict
+        sinfo_tmpl = {}
+        sinfos = self.env['product.supplierinfo'].search_read(
+            cdomain + [('product_code', 'in', list(codes))],
+            ['name', 'product_code', 'product_tmpl_id'])
+        for sinfo in sinfos:
+            sinfo_tmpl.setdefault(
+                (sinfo['name'][0], sinfo['product_code']),
+                sinfo['product_tmpl_id'] and sinfo['product_tmpl_id'][0])
+        # WARNING: Won't work for multi-variant products
+        # because product.supplierinfo is attached to product template
+        tmpl_variants = {}
+        tmpl_ids = list(set([
+            tmpl_id for tmpl_id in sinfo_tmpl.values() if tmpl_id]))
+        if tmpl_ids:
+            for variant in ppo.search_read(
+                    [('product_tmpl_id', 'in', tmpl_ids)],
+                    ['product_tmpl_id']):
+                tmpl_variants.setdefault(
+                    variant['product_tmpl_id'][0], []).append(variant['id'])
+        for key, tmpl_id in sinfo_tmpl.items():
+            variant_ids = tmpl_variants.get(tmpl_id, [])
+            speed_dict['seller_code'][key] =\
+                len(variant_ids) == 1 and variant_ids[0]
+        return speed_dict
+
+    @api.model
+    def _match_product(
+            self, product_dict, chatter_msg, seller=False, speed_dict=None):
         """Example:
         product_dict = {
             'barcode': '5449000054227',
             'code': 'COCA1L',
             }
+        speed_dict is usefull to gain performance when you have to match
+        a lot of lines: it is the product index of the lines returned by
+        _prepare_product_speed_dict(), which avoids 3 queries per line
         """
         ppo = self.env['product.product']
         self._strip_cleanup_dict(product_dict)
@@ -349,6 +639,77 @@ class BusinessDocumentImport(models.AbstractModel):
             return product_dict['recordset']
         if product_dict.get('id'):
             return ppo.browse(product_dict['id'])
+        if speed_dict is not None:
+            product = self._match_product_speed_dict(
+                product_dict, speed_dict, seller=seller)
+            if product:
+                return product
+        else:
+            product = self._match_product_search(product_dict, seller=seller)
+            if product:
+                return product
+        raise self.user_error_wrap(_(
+            "Odoo couldn't find any product corresponding to the "
+            "following information extracted from the business document: "
+            "Barcode: %s\n"
+            "Product code: %s\n"
+            "Supplier: %s\n") % (
+                product_dict.get('barcode'),
+                product_dict.get('code'),
+                seller and seller.name or 'None'))
+
+    @api.model
+    def _match_product_lines(self, product_dicts, chatter_msg, seller=False):
+        """Match the products of all the lines of a document in one pass.
+        product_dicts is a list of product_dict (one per line), the result
+        is the list of the matched product recordsets (one per line).
+        A product_dict that is repeated on several lines is matched once."""
+        speed_dict = self._prepare_product_speed_dict(product_dicts)
+        matched = {}
+        res = []
+        for product_dict in product_dicts:
+            self._strip_cleanup_dict(product_dict)
+            if product_dict.get('recordset') or product_dict.get('id'):
+                key = None
+            else:
+                key = (product_dict.get('barcode'), product_dict.get('code'))
+            if key is None or key not in matched:
+                product = self._match_product(
+                    product_dict, chatter_msg, seller=seller,
+                    speed_dict=speed_dict)
+                if key is None:
+                    res.append(product)
+                    continue
+                matched[key] = product
+            res.append(matched[key])
+        return res
+
+    @api.model
+    def _match_product_speed_dict(
+            self, product_dict, speed_dict, seller=False):
+        ppo = self.env['product.product']
+        if product_dict.get('barcode'):
+            match = speed_dict['barcode'].get(product_dict['barcode'])
+            if match:
+                return ppo.browse(match[1])
+        if product_dict.get('code'):
+            matches = [
+                match for match in (
+                    speed_dict['barcode'].get(product_dict['code']),
+                    speed_dict['code'].get(product_dict['code']))
+                if match]
+            if matches:
+                return ppo.browse(min(matches)[1])
+            if seller:
+                product_id = speed_dict['seller_code'].get(
+                    (seller.id, product_dict['code']))
+                if product_id:
+                    return ppo.browse(product_id)
+        return ppo
+
+    @api.model
+    def _match_product_search(self, product_dict, seller=False):
+        ppo = self.env['product.product']
         company_id = self._context.get('force_company') or\
             self.env.user.company_id.id
         cdomain = [
@@ -379,15 +740,7 @@ class BusinessDocumentImport(models.AbstractModel):
                         sinfo.product_tmpl_id.product_variant_ids) == 1
                 ):
                     return sinfo.product_tmpl_id.product_variant_ids[0]
-        raise self.user_error_wrap(_(
-            "Odoo couldn't find any product corresponding to the "
-            "following information extracted from the business document: "
-            "Barcode: %s\n"
-            "Product code: %s\n"
-            "Supplier: %s\n") % (
-                product_dict.get('barcode'),
-                product_dict.get('code'),
-                seller and seller.name or 'None'))
+        return ppo
 
     @api.model
     def _match_currency(self, currency_dict, chatter_msg):
@@ -406,10 +759,10 @@ class BusinessDocumentImport(models.AbstractModel):
             return currency_dict['recordset']
         if currency_dict.get('id'):
             return rco.browse(currency_dict['id'])
+        ref_data = self._get_reference_data()
         if currency_dict.get('iso'):
             currency_iso = currency_dict['iso'].upper()
-            currency = rco.search(
-                [('name', '=', currency_iso)], limit=1)
+            currency = rco.browse(ref_data['currency_iso'].get(currency_iso))
             if currency:
                 return currency
             else:
@@ -418,8 +771,8 @@ class BusinessDocumentImport(models.AbstractModel):
                     "the currency ISO code. But there are no currency "
                     "with that code in Odoo.") % currency_iso)
         if currency_dict.get('symbol'):
-            currencies = rco.search(
-                [('symbol', '=', currency_dict['symbol'])])
+            currencies = rco.browse(
+                ref_data['currency_symbol'].get(currency_dict['symbol'], []))
             if len(currencies) == 1:
                 return currencies[0]
             else:
@@ -429,10 +782,11 @@ class BusinessDocumentImport(models.AbstractModel):
                     "currencies with that symbol in Odoo.")
                     % currency_dict['symbol'])
         if currency_dict.get('iso_or_symbol'):
-            currencies = rco.search([
-                '|',
-                ('name', '=', currency_dict['iso_or_symbol'].upper()),
-                ('symbol', '=', currency_dict['iso_or_symbol'])])
+            currencies = rco.browse(
+                ref_data['currency_symbol'].get(
+                    currency_dict['iso_or_symbol'], []))
+            currencies |= rco.browse(ref_data['currency_iso'].get(
+                currency_dict['iso_or_symbol'].upper()))
             if len(currencies) == 1:
                 return currencies[0]
             else:
@@ -443,11 +797,11 @@ class BusinessDocumentImport(models.AbstractModel):
                     % currency_dict['iso_or_symbol'])
         if currency_dict.get('country_code'):
             country_code = currency_dict['country_code']
-            country = self.env['res.country'].search([
-                ('code', '=', country_code)], limit=1)
+            country = self._get_country_from_code(country_code)
             if country:
-                if country.currency_id:
-                    return country.currency_id
+                currency_id = ref_data['country'][country_code][1]
+                if currency_id:
+                    return rco.browse(currency_id)
                 else:
                     raise self.user_error_wrap(_(
                         "The analysis of the business document returned '%s' "
@@ -492,8 +846,8 @@ class BusinessDocumentImport(models.AbstractModel):
             # Map NIU to Unit
             if uom_dict['unece_code'] == 'NIU':
                 uom_dict['unece_code'] = 'C62'
-            uom = uuo.search([
-                ('unece_code', '=', uom_dict['unece_code'])], limit=1)
+            uom = uuo.browse(self._get_reference_data()['uom_unece'].get(
+                uom_dict['unece_code']))
             if uom:
                 return uom
             else:
@@ -504,8 +858,7 @@ class BusinessDocumentImport(models.AbstractModel):
                     "check the configuration of the units of measures in "
                     "Odoo.") % uom_dict['unece_code'])
         if uom_dict.get('name'):
-            uom = uuo.search([
-                ('name', '=ilike', uom_dict['name'] + '%')], limit=1)
+            uom = self._get_uom_from_name(uom_dict['name'])
             if uom:
                 return uom
         if product:
@@ -523,19 +876,64 @@ class BusinessDocumentImport(models.AbstractModel):
     @api.model
     def _match_taxes(
             self, taxes_list, chatter_msg,
-            type_tax_use='purchase', price_include=False):
-        """taxes_list must be a list of tax_dict"""
+            type_tax_use='purchase', price_include=False, speed_dict=None):
+        """taxes_list must be a list of tax_dict
+        speed_dict is an optional dict used as a memo of the matched
+        taxes, cf _match_taxes_lines()"""
         taxes_recordset = self.env['account.tax'].browse(False)
         for tax_dict in taxes_list:
             taxes_recordset += self._match_tax(
                 tax_dict, chatter_msg, type_tax_use=type_tax_use,
-                price_include=price_include)
+                price_include=price_include, speed_dict=speed_dict)
         return taxes_recordset
 
+    @api.model
+    def _match_taxes_lines(
+            self, taxes_lists, chatter_msg,
+            type_tax_use='purchase', price_include=False):
+        """Match the taxes of all the lines of a document in one pass.
+        taxes_lists is a list of taxes_list (one per line), the result
+        is the list of the matched account.tax recordsets (one per line).
+        A tax_dict that is repeated on several lines is matched once."""
+        speed_dict = {}
+        res = []
+        for taxes_list in taxes_lists:
+            res.append(self._match_taxes(
+                taxes_list or [], chatter_msg, type_tax_use=type_tax_use,
+                price_include=price_include, speed_dict=speed_dict))
+        return res
+
+    @api.model
+    def _get_tax_table(self, company_id):
+        """Returns the taxes of the company:
+        {(amount_type, amount rounded to 4 digits): [(
+            id, type_tax_use, price_include, unece_type_code,
+            unece_categ_code, unece_due_date_code), ...]}
+        The lists are sorted by unece_due_date_code, like in _match_tax().
+        The table is read once per batch and kept in the speed_dict
+        of _match_tax()"""
+        table = {}
+        taxes = self.env['account.tax'].search_read(
+            [('company_id', '=', company_id)], [
+                'amount_type', 'amount', 'type_tax_use', 'price_include',
+                'unece_type_code', 'unece_categ_code', 'unece_due_date_code'],
+            order='unece_due_date_code, sequence, id')
+        for tax in taxes:
+            # 'amount' field : digits=(16, 4)
+            key = (
+                tax['amount_type'],
+                float_round(tax['amount'], precision_digits=4))
+            table.setdefault(key, []).append((
+                tax['id'], tax['type_tax_use'], tax['price_include'],
+                tax['unece_type_code'] or False,
+                tax['unece_categ_code'] or False,
+                tax['unece_due_date_code'] or False))
+        return table
+
     @api.model
     def _match_tax(
             self, tax_dict, chatter_msg,
-            type_tax_use='purchase', price_include=False):
+            type_tax_use='purchase', price_include=False, speed_dict=None):
         """Example:
         tax_dict = {
             'amount_type': 'percent',  # required param, 'fixed' or 'percent'
@@ -544,6 +942,10 @@ class BusinessDocumentImport(models.AbstractModel):
             'unece_categ_code': 'S',
             'unece_due_date_code': '72',
             }
+        With price_include=None, the tax won't depend on the value of
+        the price_include parameter.
+        speed_dict is an optional dict used as a memo of the matched taxes
+        and of the tax table of the company (cf _match_taxes_lines())
         """
         ato = self.env['account.tax']
         self._strip_cleanup_dict(tax_dict)
@@ -553,38 +955,53 @@ class BusinessDocumentImport(models.AbstractModel):
             return ato.browse(tax_dict['id'])
         company_id = self._context.get('force_company') or\
             self.env.user.company_id.id
-        domain = [('company_id', '=', company_id)]
-        if type_tax_use == 'purchase':
-            domain.append(('type_tax_use', '=', 'purchase'))
-        elif type_tax_use == 'sale':
-            domain.append(('type_tax_use', '=', 'sale'))
-        if price_include is False:
-            domain.append(('price_include', '=', False))
-        elif price_include is True:
-            domain.append(('price_include', '=', True))
-        # with the code above, if you set price_include=None, it will
-        # won't depend on the value of the price_include parameter
         assert tax_dict.get('amount_type') in ['fixed', 'percent'],\
             'bad tax type'
         assert 'amount' in tax_dict, 'Missing amount key in tax_dict'
-        domain.append(('amount_type', '=', tax_dict['amount_type']))
-        if tax_dict.get('unece_type_code'):
-            domain.append(
-                ('unece_type_code', '=', tax_dict['unece_type_code']))
-        if tax_dict.get('unece_categ_code'):
-            domain.append(
-                ('unece_categ_code', '=', tax_dict['unece_categ_code']))
-        if tax_dict.get('unece_due_date_code'):
-            domain += [
-                '|',
-                ('unece_due_date_code', '=', tax_dict['unece_due_date_code']),
-                ('unece_due_date_code', '=', False)]
-        taxes = ato.search(domain, order='unece_due_date_code')
-        for tax in taxes:
-            tax_amount = tax.amount  # 'amount' field : digits=(16, 4)
-            if not float_compare(
-                    tax_dict['amount'], tax_amount, precision_digits=4):
-                return tax
+        amount_key = float_round(tax_dict['amount'], precision_digits=4)
+        memo_key = (
+            company_id, type_tax_use, price_include,
+            tax_dict['amount_type'], amount_key,
+            tax_dict.get('unece_type_code') or False,
+            tax_dict.get('unece_categ_code') or False,
+            tax_dict.get('unece_due_date_code') or False)
+        if speed_dict is not None and memo_key in speed_dict:
+            return ato.browse(speed_dict[memo_key])
+        if speed_dict is None:
+            table = self._get_tax_table(company_id)
+        else:
+            table_key = ('tax_table', company_id)
+            if table_key not in speed_dict:
+                speed_dict[table_key] = self._get_tax_table(company_id)
+            table = speed_dict[table_key]
+        for (
+                tax_id, tax_type_tax_use, tax_price_include, type_code,
+                categ_code, due_date_code) in table.get(
+                (tax_dict['amount_type'], amount_key), []):
+            if (
+                    type_tax_use in ('purchase', 'sale') and
+                    tax_type_tax_use != type_tax_use):
+                continue
+            if (
+                    isinstance(price_include, bool) and
+                    tax_price_include != price_include):
+                continue
+            if (
+                    tax_dict.get('unece_type_code') and
+                    type_code != tax_dict['unece_type_code']):
+                continue
+            if (
+                    tax_dict.get('unece_categ_code') and
+                    categ_code != tax_dict['unece_categ_code']):
+                continue
+            if (
+                    tax_dict.get('unece_due_date_code') and
+                    due_date_code and
+                    due_date_code != tax_dict['unece_due_date_code']):
+                continue
+            if speed_dict is not None:
+                speed_dict[memo_key] = tax_id
+            return ato.browse(tax_id)
         raise self.user_error_wrap(_(
             "Odoo couldn't find any tax with 'Tax Application' = '%s' "
             "and 'Tax Included in Price' = '%s' which correspond to the "
@@ -650,6 +1067,7 @@ class BusinessDocumentImport(models.AbstractModel):
             qty_precision = dpo.precision_get('Product Unit of Measure')
         if price_precision is None:
             price_precision = dpo.precision_get('Product Price')
+        # key = product ID, value = existing line dict
         existing_lines_dict = {}
         for eline in existing_lines:
             if not eline.get('product'):
@@ -658,91 +1076,124 @@ class BusinessDocumentImport(models.AbstractModel):
                     "so <b>the lines haven't been updated</b>.")
                     % eline.get('name'))
                 return False
-            if eline['product'] in existing_lines_dict:
+            if eline['product'].id in existing_lines_dict:
                 chatter_msg.append(_(
                     "The product '%s' is used on several existing "
                     "lines, so <b>the lines haven't been updated</b>.")
                     % eline['product'].display_name)
                 return False
-            existing_lines_dict[eline['product']] = eline
-        unique_import_products = []
-        res = {
-            'to_remove': False,
-            'to_add': [],
-            'to_update': {},
-        }
+            existing_lines_dict[eline['product'].id] = eline
         for iline in import_lines:
             if not iline.get('product'):
                 chatter_msg.append(_(
                     "One of the imported lines doesn't have any product, "
                     "so <b>the lines haven't been updated</b>."))
                 return False
-            product = self._match_product(
-                iline['product'], chatter_msg, seller=seller)
-            uom = self._match_uom(iline.get('uom'), chatter_msg, product)
-            if product in unique_import_products:
+        # All the products are matched first, in one pass
+        products = self._match_product_lines(
+            [iline['product'] for iline in import_lines], chatter_msg,
+            seller=seller)
+        unique_import_products = set()
+        uoms = {}  # key = (uom_dict key, product ID), value = uom
+        res = {
+            'to_remove': False,
+            'to_add': [],
+            'to_update': {},
+        }
+        for iline, product in zip(import_lines, products):
+            if product.id in unique_import_products:
                 chatter_msg.append(_(
                     "The product '%s' is used on several imported lines, "
                     "so <b>the lines haven't been updated</b>.")
                     % product.display_name)
                 return False
-            unique_import_products.append(product)
-            if product in existing_lines_dict:
-                if uom != existing_lines_dict[product]['uom']:
+            unique_import_products.add(product.id)
+            uom_dict = iline.get('uom') or {}
+            uom_key = (
+                uom_dict.get('recordset'), uom_dict.get('id'),
+                uom_dict.get('unece_code'), uom_dict.get('name'),
+                product.id)
+            if uom_key not in uoms:
+                uoms[uom_key] = self._match_uom(
+                    iline.get('uom'), chatter_msg, product)
+            uom = uoms[uom_key]
+            if product.id in existing_lines_dict:
+                eline = existing_lines_dict[product.id]
+                if uom != eline['uom']:
                     chatter_msg.append(_(
                         "For product '%s', the unit of measure is %s on the "
                         "existing line, but it is %s on the imported line. "
                         "We don't support this scenario for the moment, so "
                         "<b>the lines haven't been updated</b>.") % (
                             product.display_name,
-                            existing_lines_dict[product]['uom'].name,
+                            eline['uom'].name,
                             uom.name,
                     ))
                     return False
                 # used for to_remove
-                existing_lines_dict[product]['import'] = True
-                oline = existing_lines_dict[product]['line']
+                eline['import'] = True
+                oline = eline['line']
                 res['to_update'][oline] = {}
                 if float_compare(
-                        iline['qty'],
-                        existing_lines_dict[product]['qty'],
+                        iline['qty'], eline['qty'],
                         precision_digits=qty_precision):
                     res['to_update'][oline]['qty'] = [
-                        existing_lines_dict[product]['qty'],
-                        iline['qty']]
+                        eline['qty'], iline['qty']]
                 if (
                         'price_unit' in iline and
                         float_compare(
-                            iline['price_unit'],
-                            existing_lines_dict[product]['price_unit'],
+                            iline['price_unit'], eline['price_unit'],
                             precision_digits=price_precision)):
                     res['to_update'][oline]['price_unit'] = [
-                        existing_lines_dict[product]['price_unit'],
-                        iline['price_unit']]
+                        eline['price_unit'], iline['price_unit']]
             else:
                 res['to_add'].append({
                     'product': product,
                     'uom': uom,
                     'import_line': iline,
                 })
-        for exiting_dict in existing_lines_dict.values():
-            if not exiting_dict.get('import'):
-                if res['to_remove']:
-                    res['to_remove'] += exiting_dict['line']
-                else:
-                    res['to_remove'] = exiting_dict['line']
+        to_remove_ids = [
+            exiting_dict['line'].id
+            for exiting_dict in existing_lines_dict.values()
+            if not exiting_dict.get('import')]
+        if to_remove_ids:
+            res['to_remove'] = existing_lines[0]['line'].browse(
+                to_remove_ids)
         return res
 
-    def _prepare_account_speed_dict(self):
+    @api.model
+    def _get_shortest_code_with_prefix(self, sorted_codes, prefix):
+        """Returns the shortest code of sorted_codes that starts with
+        prefix (the first one in the order of sorted_codes if there are
+        several), or False. The codes that start with prefix are
+        contiguous in sorted_codes: their range is found with bisect"""
+        start = bisect_left(sorted_codes, prefix)
+        end = bisect_left(
+            sorted_codes, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+        if start == end:
+            return False
+        return min(sorted_codes[start:end], key=len)
+
+    @api.model
+    def _get_company_code_index(self, model_name):
+        """Returns a tuple (codes, sorted_codes) for the accounts, analytic
+        accounts or journals of the company, where codes is a dict
+        {CODE: id} and sorted_codes is the sorted list of the codes,
+        used for prefix matching with bisect"""
         company_id = self._context.get('force_company') or\
             self.env.user.company_id.id
-        res = self.env['account.account'].search_read([
-            ('company_id', '=', company_id),
-            ('deprecated', '=', False)], ['code'])
-        speed_dict = {}
+        domain = [('company_id', '=', company_id)]
+        if model_name == 'account.account':
+            domain.append(('deprecated', '=', False))
+        res = self.env[model_name].search_read(domain, ['code'])
+        codes = {}
         for l in res:
-            speed_dict[l['code'].upper()] = l['id']
-        return speed_dict
+            if l['code']:
+                codes[l['code'].upper()] = l['id']
+        return codes, sorted(codes)
+
+    def _prepare_account_speed_dict(self):
+        return self._get_company_code_index('account.account')[0]
 
     @api.model
     def _match_account(self, account_dict, chatter_msg, speed_dict=None):
@@ -751,13 +1202,16 @@ class BusinessDocumentImport(models.AbstractModel):
             'code': '411100',
             }
         speed_dict is usefull to gain performance when you have a lot of
-        accounts to match
+        accounts to match. Without speed_dict, the account index of the
+        company is read (cf _get_company_code_index()).
         """
         if not account_dict:
             account_dict = {}
         aao = self.env['account.account']
+        sorted_codes = None
         if speed_dict is None:
-            speed_dict = self._prepare_account_speed_dict()
+            speed_dict, sorted_codes = self._get_company_code_index(
+                'account.account')
         self._strip_cleanup_dict(account_dict)
         if account_dict.get('recordset'):
             return account_dict['recordset']
@@ -777,28 +1231,25 @@ class BusinessDocumentImport(models.AbstractModel):
                     return aao.browse(speed_dict[acc_code_tmp])
             # Match when account_dict['code'] is shorter than Odoo's accounts
             # -> warns the user about this
-            for code, account_id in speed_dict.items():
-                if code.startswith(acc_code):
-                    chatter_msg.append(_(
-                        "Approximate match: account %s has been matched "
-                        "with account %s") % (account_dict['code'], code))
-                    return aao.browse(account_id)
+            if sorted_codes is not None:
+                code = self._get_shortest_code_with_prefix(
+                    sorted_codes, acc_code)
+            else:
+                code = self._get_shortest_code_with_prefix(
+                    sorted(speed_code for speed_code in speed_dict
+                           if speed_code.startswith(acc_code)), acc_code)
+            if code:
+                chatter_msg.append(_(
+                    "Approximate match: account %s has been matched "
+                    "with account %s") % (account_dict['code'], code))
+                return aao.browse(speed_dict[code])
         raise self.user_error_wrap(_(
             "Odoo couldn't find any account corresponding to the "
             "following information extracted from the business document: "
             "Account code: %s") % account_dict.get('code'))
 
     def _prepare_analytic_account_speed_dict(self):
-        company_id = self._context.get('force_company') or\
-            self.env.user.company_id.id
-        res = self.env['account.analytic.account'].search_read(
-            [('company_id', '=', company_id)],
-            ['code'])
-        speed_dict = {}
-        for l in res:
-            if l['code']:
-                speed_dict[l['code'].upper()] = l['id']
-        return speed_dict
+        return self._get_company_code_index('account.analytic.account')[0]
 
     @api.model
     def _match_analytic_account(
@@ -814,7 +1265,8 @@ class BusinessDocumentImport(models.AbstractModel):
             aaccount_dict = {}
         aaao = self.env['account.analytic.account']
         if speed_dict is None:
-            speed_dict = self._prepare_analytic_account_speed_dict()
+            speed_dict = self._get_company_code_index(
+                'account.analytic.account')[0]
         self._strip_cleanup_dict(aaccount_dict)
         if aaccount_dict.get('recordset'):
             return aaccount_dict['recordset']
@@ -830,14 +1282,7 @@ class BusinessDocumentImport(models.AbstractModel):
             "Analytic account code: %s") % aaccount_dict.get('code'))
 
     def _prepare_journal_speed_dict(self):
-        company_id = self._context.get('force_company') or\
-            self.env.user.company_id.id
-        res = self.env['account.journal'].search_read([
-            ('company_id', '=', company_id)], ['code'])
-        speed_dict = {}
-        for l in res:
-            speed_dict[l['code'].upper()] = l['id']
-        return speed_dict
+        return self._get_company_code_index('account.journal')[0]
 
     @api.model
     def _match_journal(self, journal_dict, chatter_msg, speed_dict=None):
@@ -852,7 +1297,7 @@ class BusinessDocumentImport(models.AbstractModel):
             journal_dict = {}
         ajo = self.env['account.journal']
         if speed_dict is None:
-            speed_dict = self._prepare_journal_speed_dict()
+            speed_dict = self._get_company_code_index('account.journal')[0]
         self._strip_cleanup_dict(journal_dict)
         if journal_dict.get('recordset'):
             return journal_dict['recordset']
@@ -920,45 +1365,150 @@ class BusinessDocumentImport(models.AbstractModel):
                     "Missing VAT number on company '%s'")
                     % company.display_name)
 
-    def get_xml_files_from_pdf(self, pdf_file):
-        """Returns a dict with key = filename, value = XML file obj"""
+    @api.model
+    def _get_pdf_file_reader(self, pdf_file):
+        """pdf_file is the PDF file as bytes or as a seekable binary file
+        object (such as the mmap given by _open_attachment_file()).
+        PyPDF2 only reads the cross-reference table when the reader is
+        created: the other objects are read from the file when they
+        are accessed."""
+        if isinstance(pdf_file, bytes):
+            pdf_file = BytesIO(pdf_file)
+        return PyPDF2.PdfFileReader(pdf_file, strict=False)
+
+    @api.model
+    @contextmanager
+    def _open_attachment_file(self, attachment):
+        """Context manager that gives a read-only binary file object on
+        the content of the attachment. When the attachment is stored in
+        the filestore, the file is memory-mapped, so only the parts of
+        the file that are read are loaded."""
+        if attachment.store_fname:
+            full_path = attachment._full_path(attachment.store_fname)
+            with open(full_path, 'rb') as f:
+                # an empty file cannot be memory-mapped
+                if os.fstat(f.fileno()).st_size:
+                    with mmap.mmap(
+                            f.fileno(), 0, access=mmap.ACCESS_READ) as mfile:
+                        yield mfile
+                    return
+        yield BytesIO(base64.b64decode(attachment.datas or b''))
+
+    @api.model
+    def _get_pdf_embedded_xml_filespecs(self, pdf_file):
+        """Returns the list of (filename, file specification object) of the
+        XML files embedded in the PDF. The embedded files are searched in
+        the /EmbeddedFiles name tree of the document catalog (including
+        its /Kids) and in the /AF array of associated files of PDF/A-3.
+        Only these dictionaries are read: the embedded streams are
+        not decompressed. The XML files with the well-known names of the
+        e-invoice standards (cf PDF_XML_FILENAME_PATTERNS) come first."""
+        pdf = self._get_pdf_file_reader(pdf_file)
+        pdf_root = pdf.trailer['/Root']
+        logger.debug('pdf_root=%s', pdf_root)
+        xmlfiles = []
+        # The same file specification is usually referenced both by the
+        # name tree and by /AF
+        seen = set()
+
+        def add_filespec(filename, filespec):
+            if isinstance(filespec, IndirectObject):
+                key = (filespec.idnum, filespec.generation)
+            else:
+                key = filename
+            if key in seen:
+                return
+            seen.add(key)
+            mime_res = mimetypes.guess_type(filename)
+            if mime_res and mime_res[0] in ['application/xml', 'text/xml']:
+                xmlfiles.append((filename, filespec))
+
+        def walk_name_tree(node, depth=0):
+            # The depth check protects against a malformed PDF
+            # whose /Kids have a loop
+            if depth > 32:
+                return
+            if '/Names' in node:
+                names = node['/Names']
+                for i in range(0, len(names) - 1, 2):
+                    add_filespec(str(names[i].getObject()), names[i + 1])
+            if '/Kids' in node:
+                for kid in node['/Kids']:
+                    walk_name_tree(kid.getObject(), depth + 1)
+
+        if '/Names' in pdf_root and '/EmbeddedFiles' in pdf_root['/Names']:
+            walk_name_tree(pdf_root['/Names']['/EmbeddedFiles'])
+        if '/AF' in pdf_root:
+            for filespec in pdf_root['/AF']:
+                filespec_dict = filespec.getObject()
+                filename = filespec_dict.get('/UF') or filespec_dict.get('/F')
+                if filename:
+                    add_filespec(str(filename.getObject()), filespec)
+
+        def priority(xmlfile):
+            filename = xmlfile[0].lower()
+            for i, pattern in enumerate(PDF_XML_FILENAME_PATTERNS):
+                if fnmatch(filename, pattern):
+                    return i
+            return len(PDF_XML_FILENAME_PATTERNS)
+        # sorted() is stable: the other files keep the order of the PDF
+        xmlfiles = sorted(xmlfiles, key=priority)
+        logger.debug('xmlfiles=%s', xmlfiles)
+        return xmlfiles
+
+    @api.model
+    def iter_xml_files_from_pdf(self, pdf_file):
+        """Generator that yields (filename, XML file obj) for each valid
+        XML file embedded in the PDF. The embedded files are extracted
+        and parsed one at a time, when the caller asks for the next one,
+        so the caller can stop at the first file that it accepts.
+        pdf_file is the PDF file as bytes or as a binary file object."""
         logger.info('Trying to find an embedded XML file inside PDF')
-        res = {}
         try:
-            fd = BytesIO(pdf_file)
-            pdf = PyPDF2.PdfFileReader(fd)
-            logger.debug('pdf.trailer=%s', pdf.trailer)
-            pdf_root = pdf.trailer['/Root']
-            logger.debug('pdf_root=%s', pdf_root)
-            # TODO add support for /Kids
-            embeddedfiles = pdf_root['/Names']['/EmbeddedFiles']['/Names']
-            i = 0
-            xmlfiles = {}  # key = filename, value = PDF obj
-            for embeddedfile in embeddedfiles[:-1]:
-                mime_res = mimetypes.guess_type(embeddedfile)
-                if mime_res and mime_res[0] in ['application/xml', 'text/xml']:
-                    xmlfiles[embeddedfile] = embeddedfiles[i + 1]
-                i += 1
-            logger.debug('xmlfiles=%s', xmlfiles)
-            for filename, xml_file_dict_obj in xmlfiles.items():
-                try:
-                    xml_file_dict = xml_file_dict_obj.getObject()
-                    logger.debug('xml_file_dict=%s', xml_file_dict)
-                    xml_string = xml_file_dict['/EF']['/F'].getData()
-                    xml_root = etree.fromstring(xml_string)
-                    logger.debug(
-                        'A valid XML file %s has been found in the PDF file',
-                        filename)
-                    res[filename] = xml_root
-                except Exception as e:
-                    continue
+            xmlfiles = self._get_pdf_embedded_xml_filespecs(pdf_file)
         except Exception as e:
-            pass
+            logger.debug('No embedded XML file found in PDF: %s', e)
+            return
+        for filename, xml_file_dict_obj in xmlfiles:
+            try:
+                xml_file_dict = xml_file_dict_obj.getObject()
+                logger.debug('xml_file_dict=%s', xml_file_dict)
+                ef_dict = xml_file_dict['/EF']
+                ef_key = '/F' in ef_dict and '/F' or '/UF'
+                xml_string = ef_dict[ef_key].getData()
+                xml_root = etree.fromstring(xml_string)
+            except Exception:
+                continue
+            logger.debug(
+                'A valid XML file %s has been found in the PDF file',
+                filename)
+            yield filename, xml_root
+
+    @api.model
+    def iter_xml_files_from_attachment(self, attachment):
+        """Same as iter_xml_files_from_pdf() for a PDF attachment,
+        without loading the full file in memory"""
+        with self._open_attachment_file(attachment) as pdf_file:
+            for xml_file in self.iter_xml_files_from_pdf(pdf_file):
+                yield xml_file
+
+    def get_xml_files_from_pdf(self, pdf_file):
+        """Returns a dict with key = filename, value = XML file obj"""
+        res = {}
+        for filename, xml_root in self.iter_xml_files_from_pdf(pdf_file):
+            res[filename] = xml_root
         logger.info('Valid XML files found in PDF: %s', list(res.keys()))
         return res
 
     @api.model
     def post_create_or_update(self, parsed_dict, record, doc_filename=None):
+        if parsed_dict.get('source_attachment'):
+            # The imported file is already stored in an attachment:
+            # link it to the record instead of copying the file
+            parsed_dict['source_attachment'].write({
+                'res_model': str(record._name),
+                'res_id': record.id,
+                })
         if parsed_dict.get('attachments'):
             for filename, data_base64 in\
                     parsed_dict['attachments'].items():
@@ -0,0 +1,70 @@
+# Copyright 2015-2019 Akretion France
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import models, api
+
+# Fields that are used to build the reference data of
+# business.document.import (cf _get_reference_data())
+COUNTRY_REFERENCE_FIELDS = ['code', 'currency_id']
+STATE_REFERENCE_FIELDS = ['code', 'country_id']
+
+
+class ResCountry(models.Model):
+    _inherit = 'res.country'
+
+    def _clear_reference_data_cache(self):
+        bdio = self.env['business.document.import']
+        bdio._get_reference_data.clear_cache(bdio)
+
+    # Invalidate the reference data of business.document.import
+    # (cf _get_reference_data()), which only contains the countries
+    # with a code
+    @api.model_create_multi
+    def create(self, vals_list):
+        countries = super(ResCountry, self).create(vals_list)
+        if any(countries.mapped('code')):
+            self._clear_reference_data_cache()
+        return countries
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResCountry, self).write(vals)
+        if any(field in vals for field in COUNTRY_REFERENCE_FIELDS):
+            self._clear_reference_data_cache()
+        return res
+
+    @api.multi
+    def unlink(self):
+        in_reference_data = any(self.mapped('code'))
+        res = super(ResCountry, self).unlink()
+        if in_reference_data:
+            self._clear_reference_data_cache()
+        return res
+
+
+class ResCountryState(models.Model):
+    _inherit = 'res.country.state'
+
+    def _clear_reference_data_cache(self):
+        bdio = self.env['business.document.import']
+        bdio._get_reference_data.clear_cache(bdio)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        states = super(ResCountryState, self).create(vals_list)
+        self._clear_reference_data_cache()
+        return states
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResCountryState, self).write(vals)
+        if any(field in vals for field in STATE_REFERENCE_FIELDS):
+            self._clear_reference_data_cache()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(ResCountryState, self).unlink()
+        self._clear_reference_data_cache()
+        return res
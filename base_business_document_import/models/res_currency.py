@@ -0,0 +1,42 @@
+# Copyright 2015-2019 Akretion France
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import models, api
+
+# Fields that are used to build the reference data of
+# business.document.import (cf _get_reference_data()): the rates are
+# not part of it
+CURRENCY_REFERENCE_FIELDS = ['name', 'symbol', 'active']
+
+
+class ResCurrency(models.Model):
+    _inherit = 'res.currency'
+
+    def _clear_reference_data_cache(self):
+        bdio = self.env['business.document.import']
+        bdio._get_reference_data.clear_cache(bdio)
+
+    # Invalidate the reference data of business.document.import
+    # (cf _get_reference_data()), which only contains the active currencies
+    @api.model_create_multi
+    def create(self, vals_list):
+        currencies = super(ResCurrency, self).create(vals_list)
+        if any(currencies.mapped('active')):
+            self._clear_reference_data_cache()
+        return currencies
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResCurrency, self).write(vals)
+        if any(field in vals for field in CURRENCY_REFERENCE_FIELDS):
+            self._clear_reference_data_cache()
+        return res
+
+    @api.multi
+    def unlink(self):
+        in_reference_data = any(self.mapped('active'))
+        res = super(ResCurrency, self).unlink()
+        if in_reference_data:
+            self._clear_reference_data_cache()
+        return res
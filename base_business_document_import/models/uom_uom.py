@@ -0,0 +1,44 @@
+# Copyright 2015-2019 Akretion France
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import models, api
+
+# Fields that are used to build the reference data and the list of unit
+# names of business.document.import (cf _get_reference_data() and
+# _get_uom_names())
+UOM_REFERENCE_FIELDS = ['unece_code', 'name', 'active']
+
+
+class UomUom(models.Model):
+    _inherit = 'uom.uom'
+
+    def _clear_reference_data_cache(self):
+        bdio = self.env['business.document.import']
+        bdio._get_reference_data.clear_cache(bdio)
+        bdio._get_uom_names.clear_cache(bdio)
+
+    # Invalidate the reference data of business.document.import
+    # (cf _get_reference_data() and _get_uom_names()), which only
+    # contains the active units
+    @api.model_create_multi
+    def create(self, vals_list):
+        uoms = super(UomUom, self).create(vals_list)
+        if any(uoms.mapped('active')):
+            self._clear_reference_data_cache()
+        return uoms
+
+    @api.multi
+    def write(self, vals):
+        res = super(UomUom, self).write(vals)
+        if any(field in vals for field in UOM_REFERENCE_FIELDS):
+            self._clear_reference_data_cache()
+        return res
+
+    @api.multi
+    def unlink(self):
+        in_reference_data = any(self.mapped('active'))
+        res = super(UomUom, self).unlink()
+        if in_reference_data:
+            self._clear_reference_data_cache()
+        return res
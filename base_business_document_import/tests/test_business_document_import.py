@@ -4,6 +4,11 @@
 
 from odoo.tests.common import TransactionCase
 from odoo.exceptions import UserError
+from io import BytesIO
+import base64
+import PyPDF2
+from PyPDF2.generic import ArrayObject, DecodedStreamObject,\
+    DictionaryObject, NameObject, createStringObject
 
 
 class TestBaseBusinessDocumentImport(TransactionCase):
@@ -31,6 +36,52 @@ class TestBaseBusinessDocumentImport(TransactionCase):
         res = bdio._match_partner(partner_dict, [], partner_type=False)
         self.assertEqual(res, partner1)
 
+    def test_match_partners(self):
+        rpo = self.env['res.partner']
+        bdio = self.env['business.document.import']
+        partner1 = rpo.create({
+            'name': 'Akretion France',
+            'supplier': True,
+            'vat': 'FR 86 792 377 731',
+            'country_id': self.env.ref('base.fr').id,
+        })
+        partner2 = rpo.create({
+            'name': 'Akretion Brazil',
+            'supplier': True,
+            'ref': 'AKBR',
+        })
+        partner_dicts = [
+            {'vat': 'FR86792377731', 'country_code': 'fr'},
+            {'ref': 'AKBR', 'country_code': 'ZZ'},
+            {'vat': 'FR86 792377731 ', 'country_code': 'FR'},
+            {'ref': 'AKBR', 'country_code': 'ZZ'},
+        ]
+        chatter_msgs = [[], [], [], []]
+        speed_dict = {}
+        res = bdio._match_partners(
+            partner_dicts, chatter_msgs, speed_dict=speed_dict)
+        self.assertEqual(res, [partner1, partner2, partner1, partner2])
+        self.assertFalse(chatter_msgs[0])
+        # unknown country code: the chatter message is replayed
+        self.assertEqual(len(chatter_msgs[1]), 1)
+        self.assertEqual(chatter_msgs[1], chatter_msgs[3])
+        # same result as the match without batch nor memo
+        for partner_dict, partner in zip(partner_dicts, res):
+            warn = []
+            self.assertEqual(
+                bdio._match_partner(dict(partner_dict), warn), partner)
+        # the memo is used for the next documents of the batch
+        memo_size = len(speed_dict['partner_memo'])
+        res = bdio._match_partner(
+            {'vat': 'FR86792377731', 'country_code': 'FR'}, [],
+            speed_dict=speed_dict)
+        self.assertEqual(res, partner1)
+        self.assertEqual(len(speed_dict['partner_memo']), memo_size)
+        with self.assertRaises(UserError):
+            bdio._match_partners(
+                [{'vat': 'FR86792377731', 'country_code': 'BE'}], [[]],
+                speed_dict=speed_dict)
+
     def test_match_shipping_partner(self):
         rpo = self.env['res.partner']
         bdio = self.env['business.document.import']
@@ -118,6 +169,37 @@ class TestBaseBusinessDocumentImport(TransactionCase):
         res = bdio._match_currency(currency_dict, [])
         self.assertEqual(res, self.env.ref('base.KRW'))
 
+    def test_reference_data_cache(self):
+        bdio = self.env['business.document.import']
+        ref_data = bdio._get_reference_data()
+        self.assertIs(ref_data, bdio._get_reference_data())
+        self.assertEqual(
+            bdio._get_country_from_code('FR'), self.env.ref('base.fr'))
+        self.assertFalse(bdio._get_country_from_code('ZZ'))
+        self.assertEqual(
+            bdio._get_state_from_code(self.env.ref('base.us'), 'CA'),
+            self.env.ref('base.state_us_5'))
+        # the cache is cleared when a currency is created or written
+        currency = self.env['res.currency'].create({
+            'name': 'ZZZ',
+            'symbol': 'Zz',
+        })
+        res = bdio._match_currency({'iso': 'zzz'}, [])
+        self.assertEqual(res, currency)
+        currency.symbol = 'Zz$'
+        res = bdio._match_currency({'symbol': 'Zz$'}, [])
+        self.assertEqual(res, currency)
+        res = bdio._match_currency({'iso_or_symbol': 'Zz$'}, [])
+        self.assertEqual(res, currency)
+        uom = self.env['uom.uom'].create({
+            'name': 'Pallet of 42',
+            'category_id': self.env.ref('uom.product_uom_categ_unit').id,
+            'factor_inv': 42,
+            'uom_type': 'bigger',
+        })
+        res = bdio._match_uom({'name': 'pallet of'}, [])
+        self.assertEqual(res, uom)
+
     def test_match_product(self):
         bdio = self.env['business.document.import']
         ppo = self.env['product.product']
@@ -149,6 +231,89 @@ class TestBaseBusinessDocumentImport(TransactionCase):
             pass
         self.assertTrue(raise_test)
 
+    def test_match_product_speed_dict(self):
+        bdio = self.env['business.document.import']
+        ppo = self.env['product.product']
+        seller = self.env.ref('base.res_partner_2')
+        product1 = ppo.create({
+            'name': 'Test Product',
+            'barcode': '9782203121102',
+            'seller_ids': [
+                (0, 0, {
+                    'name': seller.id,
+                    'product_code': 'TEST1242',
+                }),
+            ]
+        })
+        lines = [
+            ({'code': 'FURN_7777 '}, False),
+            ({'barcode': '9782203121102'}, False),
+            ({'code': '9782203121102'}, False),
+            ({'code': 'TEST1242'}, seller),
+            ]
+        # the index only contains the products of the lines
+        speed_dict = bdio._prepare_product_speed_dict(
+            [product_dict for (product_dict, product_seller) in lines])
+        self.assertEqual(
+            set([product_id for (rank, product_id) in list(
+                speed_dict['barcode'].values()) + list(
+                speed_dict['code'].values())]),
+            set([self.env.ref('product.product_delivery_01').id,
+                 product1.id]))
+        for product_dict, product_seller in lines:
+            res = bdio._match_product(
+                product_dict, [], seller=product_seller,
+                speed_dict=speed_dict)
+            self.assertEqual(res, bdio._match_product(
+                product_dict, [], seller=product_seller))
+        self.assertEqual(res, product1)
+        with self.assertRaises(UserError):
+            bdio._match_product(
+                {'code': 'TEST1242'}, [], speed_dict=speed_dict)
+        speed_dict = bdio._prepare_product_speed_dict([])
+        self.assertEqual(speed_dict, {
+            'barcode': {}, 'code': {}, 'seller_code': {}})
+
+    def test_compare_lines(self):
+        bdio = self.env['business.document.import']
+        unit = self.env.ref('uom.product_uom_unit')
+        products = self.env['product.product'].search(
+            [('uom_id', '=', unit.id)], limit=4)
+        self.assertEqual(len(products), 4)
+        existing_lines = [{
+            'product': product,
+            'name': product.name,
+            'qty': qty,
+            'price_unit': 10.0,
+            'uom': unit,
+            'line': product,  # any recordset can be used as line
+            } for (product, qty) in zip(products[:3], [1, 2, 3])]
+        import_lines = [
+            {'product': {'recordset': products[0]}, 'qty': 1,
+             'price_unit': 10.0, 'uom': {'unece_code': 'C62'}},
+            {'product': {'recordset': products[1]}, 'qty': 3,
+             'price_unit': 10.0, 'uom': {'unece_code': 'C62'}},
+            {'product': {'recordset': products[3]}, 'qty': 1,
+             'price_unit': 12.0, 'uom': {'unece_code': 'C62'}},
+            ]
+        res = bdio.compare_lines(existing_lines, import_lines, [])
+        self.assertEqual(res['to_update'], {
+            products[0]: {},
+            products[1]: {'qty': [2, 3]},
+            })
+        self.assertEqual(res['to_remove'], products[2])
+        self.assertEqual(len(res['to_add']), 1)
+        self.assertEqual(res['to_add'][0]['product'], products[3])
+        self.assertEqual(res['to_add'][0]['uom'], unit)
+        # the same product on several imported lines is not supported
+        chatter_msg = []
+        import_lines.append(
+            {'product': {'recordset': products[3]}, 'qty': 1,
+             'uom': {'unece_code': 'C62'}})
+        self.assertFalse(
+            bdio.compare_lines(existing_lines, import_lines, chatter_msg))
+        self.assertTrue(chatter_msg)
+
     def test_match_uom(self):
         bdio = self.env['business.document.import']
         uom_dict = {'unece_code': 'KGM'}
@@ -208,6 +373,34 @@ class TestBaseBusinessDocumentImport(TransactionCase):
         self.assertEqual(res, de_tax_21_ttc)
         res = bdio._match_taxes([tax_dict], [], type_tax_use='purchase')
         self.assertEqual(res, de_tax_21)
+        # 18.00001 is the same amount than 18 with 4 digits
+        tax_dict18 = {
+            'amount_type': 'percent',
+            'amount': 18.00001,
+            'unece_type_code': 'VAT',
+            'unece_categ_code': 'S',
+        }
+        res = bdio._match_taxes_lines(
+            [[tax_dict], [], [tax_dict18]], [],
+            type_tax_use='purchase', price_include=None)
+        self.assertEqual(res, [de_tax_21, self.env['account.tax'], de_tax_21])
+        # the tax table is read once per speed_dict
+        speed_dict = {}
+        res = bdio._match_taxes(
+            [tax_dict, tax_dict18], [], type_tax_use='purchase',
+            speed_dict=speed_dict)
+        self.assertEqual(res, de_tax_21)
+        self.assertIn(
+            ('tax_table', self.env.user.company_id.id), speed_dict)
+        # without speed_dict, the tax table is read again
+        de_tax_21_ttc.amount = 18.5
+        tax_dict18['amount'] = 18.5
+        res = bdio._match_tax(
+            tax_dict18, [], type_tax_use='purchase', price_include=None)
+        self.assertEqual(res, de_tax_21_ttc)
+        with self.assertRaises(UserError):
+            bdio._match_tax(
+                tax_dict18, [], type_tax_use='sale', price_include=None)
 
     def test_match_account_exact(self):
         bdio = self.env['business.document.import']
@@ -243,3 +436,108 @@ class TestBaseBusinessDocumentImport(TransactionCase):
         res = bdio._match_account({'code': '898999'}, chatter)
         self.assertEqual(acc, res)
         self.assertEqual(len(chatter), 1)
+
+    def test_match_account_index(self):
+        bdio = self.env['business.document.import']
+        aao = self.env['account.account']
+        acc_vals = {
+            'user_type_id':
+            self.env.ref('account.data_account_type_expenses').id,
+        }
+        acc1 = aao.create(dict(acc_vals, name='Test 8989991', code='8989991'))
+        aao.create(dict(acc_vals, name='Test 89899910', code='89899910'))
+        acc3 = aao.create(dict(acc_vals, name='Test 898998', code='898998'))
+        speed_dict = bdio._prepare_account_speed_dict()
+        for code in ['898998', '89899800', '898999', '89899']:
+            chatter = []
+            res = bdio._match_account({'code': code}, chatter)
+            legacy_chatter = []
+            legacy_res = bdio._match_account(
+                {'code': code}, legacy_chatter, speed_dict=speed_dict)
+            self.assertEqual(res, legacy_res)
+            self.assertEqual(chatter, legacy_chatter)
+        # shortest code that starts with 898999
+        self.assertEqual(bdio._match_account({'code': '898999'}, []), acc1)
+        # without speed_dict, the index is read on each call
+        acc3.code = '898997'
+        self.assertEqual(bdio._match_account({'code': '898997'}, []), acc3)
+        with self.assertRaises(UserError):
+            bdio._match_account({'code': '8989980'}, [])
+
+    def test_match_account_shortest_prefix(self):
+        bdio = self.env['business.document.import']
+        aao = self.env['account.account']
+        acc_vals = {
+            'user_type_id':
+            self.env.ref('account.data_account_type_expenses').id,
+        }
+        # 89799900 is before 8979991 in the sorted codes
+        aao.create(dict(acc_vals, name='Test 89799900', code='89799900'))
+        acc2 = aao.create(dict(acc_vals, name='Test 8979991', code='8979991'))
+        speed_dict = bdio._prepare_account_speed_dict()
+        self.assertEqual(bdio._match_account({'code': '897999'}, []), acc2)
+        self.assertEqual(bdio._match_account(
+            {'code': '897999'}, [], speed_dict=speed_dict), acc2)
+        self.assertFalse(bdio._get_shortest_code_with_prefix(
+            ['89799900', '8979991'], '897998'))
+
+    def _get_pdf_with_embedded_files(self):
+        """PDF with factur-x.xml in a /Kids of the /EmbeddedFiles name
+        tree and in /AF, and ubl-invoice-1.xml only in /AF"""
+        writer = PyPDF2.PdfFileWriter()
+        writer.addBlankPage(100, 100)
+        filespecs = {}
+        for filename in ['factur-x.xml', 'ubl-invoice-1.xml']:
+            ef_stream = DecodedStreamObject()
+            ef_stream.setData(b'<root><name>%s</name></root>' % (
+                filename.encode('ascii')))
+            ef_stream.update({
+                NameObject('/Type'): NameObject('/EmbeddedFile')})
+            filespecs[filename] = writer._addObject(DictionaryObject({
+                NameObject('/Type'): NameObject('/Filespec'),
+                NameObject('/F'): createStringObject(filename),
+                NameObject('/UF'): createStringObject(filename),
+                NameObject('/EF'): DictionaryObject({
+                    NameObject('/F'): writer._addObject(ef_stream)}),
+                }))
+        kid = writer._addObject(DictionaryObject({
+            NameObject('/Limits'): ArrayObject([
+                createStringObject('factur-x.xml'),
+                createStringObject('factur-x.xml')]),
+            NameObject('/Names'): ArrayObject([
+                createStringObject('factur-x.xml'),
+                filespecs['factur-x.xml']]),
+            }))
+        writer._root_object.update({
+            NameObject('/Names'): DictionaryObject({
+                NameObject('/EmbeddedFiles'): DictionaryObject({
+                    NameObject('/Kids'): ArrayObject([kid])})}),
+            NameObject('/AF'): ArrayObject([
+                filespecs['ubl-invoice-1.xml'], filespecs['factur-x.xml']]),
+            })
+        fd = BytesIO()
+        writer.write(fd)
+        return fd.getvalue()
+
+    def test_iter_xml_files_from_pdf(self):
+        bdio = self.env['business.document.import']
+        pdf_file = self._get_pdf_with_embedded_files()
+        res = [
+            (filename, xml_root.findtext('name'))
+            for filename, xml_root in bdio.iter_xml_files_from_pdf(pdf_file)]
+        self.assertEqual(res, [
+            ('factur-x.xml', 'factur-x.xml'),
+            ('ubl-invoice-1.xml', 'ubl-invoice-1.xml')])
+        # same result when reading the PDF from the filestore
+        attach = self.env['ir.attachment'].create({
+            'name': 'test.pdf',
+            'datas': base64.b64encode(pdf_file),
+            'datas_fname': 'test.pdf',
+            })
+        res = [
+            filename for filename, xml_root in
+            bdio.iter_xml_files_from_attachment(attach)]
+        self.assertEqual(res, ['factur-x.xml', 'ubl-invoice-1.xml'])
+        self.assertEqual(
+            sorted(bdio.get_xml_files_from_pdf(pdf_file).keys()),
+            ['factur-x.xml', 'ubl-invoice-1.xml'])
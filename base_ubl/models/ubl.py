@@ -6,17 +6,42 @@ from odoo.exceptions import UserError
 from odoo.tools import float_is_zero, float_round, file_open
 from lxml import etree
 from io import BytesIO
-from tempfile import NamedTemporaryFile
+from copy import deepcopy
 import mimetypes
+import threading
 import logging
 logger = logging.getLogger(__name__)
 
 try:
     from PyPDF2 import PdfFileWriter, PdfFileReader
-    from PyPDF2.generic import NameObject
+    from PyPDF2.generic import ArrayObject, DecodedStreamObject, \
+        DictionaryObject, IndirectObject, NameObject, NumberObject, \
+        createStringObject
 except ImportError:
     logger.debug('Cannot import PyPDF2')
 
+# Compiling the UBL XSD means parsing the full include tree of
+# base_ubl/data/xsd-*, so the compiled schemas are shared by all the
+# registries (databases) of the server process.
+# key = (document, version), value = etree.XMLSchema
+UBL_XML_SCHEMAS = {}
+UBL_XML_SCHEMAS_LOCK = threading.Lock()
+
+# The namespaces of the UBL components are the same for all the 2.x
+# versions of UBL (2.0, 2.1)
+UBL_NAMESPACES = {
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:'
+           'CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:'
+           'CommonBasicComponents-2',
+    'inv': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2',
+    }
+UBL_CAC = '{%s}' % UBL_NAMESPACES['cac']
+UBL_CBC = '{%s}' % UBL_NAMESPACES['cbc']
+# Compiled XPath used to parse UBL files, shared by all the registries
+# of the server process. key = xpath, value = etree.XPath
+UBL_XPATHS = {}
+
 
 class BaseUbl(models.AbstractModel):
     _name = 'base.ubl'
@@ -189,6 +214,26 @@ class BaseUbl(models.AbstractModel):
                 commercial_partner, party, ns, version='2.1')
         self._ubl_add_contact(partner, party, ns, version=version)
 
+    @api.model
+    def _ubl_add_company_party(
+            self, company, parent_node, ns, version='2.1'):
+        """Adds the Party block of the company, which is the same in all
+        the documents of the company. When several documents are
+        generated at once, the caller gives a dict in the context key
+        'ubl_company_parties': the block is then built for the first
+        document and copied in the others
+        (cf generate_ubl_xml_strings() of account.invoice)"""
+        memo = self._context.get('ubl_company_parties')
+        key = (company.id, version, self._context.get('lang') or 'en_US')
+        if memo is not None and key in memo:
+            parent_node.append(deepcopy(memo[key]))
+            return
+        self._ubl_add_party(
+            company.partner_id, company, 'Party', parent_node, ns,
+            version=version)
+        if memo is not None:
+            memo[key] = deepcopy(parent_node[-1])
+
     @api.model
     def _ubl_add_customer_party(
             self, partner, company, node_name, parent_node, ns, version='2.1'):
@@ -205,9 +250,13 @@ class BaseUbl(models.AbstractModel):
             customer_ref = etree.SubElement(
                 customer_party_root, ns['cbc'] + 'SupplierAssignedAccountID')
             customer_ref.text = partner.commercial_partner_id.ref
-        self._ubl_add_party(
-            partner, company, 'Party', customer_party_root, ns,
-            version=version)
+        if company and partner == company.partner_id:
+            self._ubl_add_company_party(
+                company, customer_party_root, ns, version=version)
+        else:
+            self._ubl_add_party(
+                partner, company, 'Party', customer_party_root, ns,
+                version=version)
         # TODO: rewrite support for AccountingContact + add DeliveryContact
         # Additional optional args
         if partner and not company and partner.parent_id:
@@ -245,9 +294,13 @@ class BaseUbl(models.AbstractModel):
             supplier_ref = etree.SubElement(
                 supplier_party_root, ns['cbc'] + 'CustomerAssignedAccountID')
             supplier_ref.text = partner.commercial_partner_id.ref
-        self._ubl_add_party(
-            partner, company, 'Party', supplier_party_root, ns,
-            version=version)
+        if company and partner == company.partner_id:
+            self._ubl_add_company_party(
+                company, supplier_party_root, ns, version=version)
+        else:
+            self._ubl_add_party(
+                partner, company, 'Party', supplier_party_root, ns,
+                version=version)
 
     @api.model
     def _ubl_add_delivery(
@@ -482,22 +535,50 @@ class BaseUbl(models.AbstractModel):
             }
         return nsmap, ns
 
+    @api.model
+    def _ubl_get_xml_schema(self, document, version='2.1'):
+        """Returns the compiled XML Schema of the UBL document. It is built
+        on first use and then kept for the lifetime of the process"""
+        key = (document, version)
+        official_schema = UBL_XML_SCHEMAS.get(key)
+        if official_schema is None:
+            with UBL_XML_SCHEMAS_LOCK:
+                official_schema = UBL_XML_SCHEMAS.get(key)
+                if official_schema is None:
+                    xsd_file = 'base_ubl/data/xsd-%s/maindoc/UBL-%s-%s.xsd' % (
+                        version, document, version)
+                    with file_open(xsd_file) as xsd_fd:
+                        xsd_etree_obj = etree.parse(xsd_fd)
+                    official_schema = etree.XMLSchema(xsd_etree_obj)
+                    UBL_XML_SCHEMAS[key] = official_schema
+                    logger.debug(
+                        'UBL XML Schema %s %s compiled and cached',
+                        document, version)
+        return official_schema
+
     @api.model
     def _ubl_check_xml_schema(self, xml_string, document, version='2.1'):
         """Validate the XML file against the XSD"""
-        xsd_file = 'base_ubl/data/xsd-%s/maindoc/UBL-%s-%s.xsd' % (
-            version, document, version)
-        xsd_etree_obj = etree.parse(file_open(xsd_file))
-        official_schema = etree.XMLSchema(xsd_etree_obj)
         try:
-            t = etree.parse(BytesIO(xml_string))
-            official_schema.assertValid(t)
+            xml_root = etree.fromstring(xml_string)
+        except Exception as e:
+            raise UserError(_(
+                "The UBL XML file is not XML-compliant. Error: %s") % e)
+        return self._ubl_check_xml_tree(xml_root, document, version=version)
+
+    @api.model
+    def _ubl_check_xml_tree(self, xml_root, document, version='2.1'):
+        """Validate an XML file that has already been parsed against
+        the XSD"""
+        official_schema = self._ubl_get_xml_schema(document, version=version)
+        try:
+            official_schema.assertValid(xml_root)
         except Exception as e:
             # if the validation of the XSD fails, we arrive here
             logger = logging.getLogger(__name__)
             logger.warning(
                 "The XML file is invalid against the XML Schema Definition")
-            logger.warning(xml_string)
+            logger.warning(etree.tostring(xml_root, encoding='UTF-8'))
             logger.warning(e)
             raise UserError(_(
                 "The UBL XML file is not valid against the official "
@@ -508,9 +589,110 @@ class BaseUbl(models.AbstractModel):
                 % str(e))
         return True
 
+    @api.model
+    def _pdf_embedded_file_update(self, pdf_stream, xml_string, xml_filename):
+        """Returns the incremental update (PDF spec 7.5.6) that adds the
+        XML file as an embedded file of the PDF: the new objects, an xref
+        section for them and a trailer, to be appended to the original
+        bytes. The page objects are not rewritten, so the cost depends on
+        the size of the XML file, not on the size of the PDF.
+        Returns False when the PDF can't be updated incrementally
+        (encrypted PDF or cross-reference stream)"""
+        pdf_stream.seek(0, 2)
+        pdf_size = pdf_stream.tell()
+        pdf_stream.seek(max(pdf_size - 1024, 0))
+        tail = pdf_stream.read()
+        pos = tail.rfind(b'startxref')
+        if pos < 0:
+            return False
+        try:
+            startxref = int(tail[pos + len(b'startxref'):].split()[0])
+        except (IndexError, ValueError):
+            return False
+        pdf_stream.seek(startxref)
+        if pdf_stream.read(4) != b'xref':
+            return False
+        reader = PdfFileReader(pdf_stream)
+        if reader.isEncrypted:
+            return False
+        trailer = reader.trailer
+        root_ref = trailer.raw_get('/Root')
+        catalog = trailer['/Root']
+        names = DictionaryObject()
+        if '/Names' in catalog:
+            # keep the other name trees, such as /Dests
+            old_names = catalog['/Names']
+            names.update({key: old_names.raw_get(key) for key in old_names})
+        next_id = int(trailer['/Size'])
+        file_id, filespec_id, embedded_files_id, names_id = range(
+            next_id, next_id + 4)
+        file_entry = DecodedStreamObject()
+        file_entry.setData(xml_string)
+        file_entry.update({
+            NameObject("/Type"): NameObject("/EmbeddedFile"),
+            })
+        filespec = DictionaryObject({
+            NameObject("/Type"): NameObject("/Filespec"),
+            NameObject("/F"): createStringObject(xml_filename),
+            NameObject("/EF"): DictionaryObject({
+                NameObject("/F"): IndirectObject(file_id, 0, None),
+                }),
+            })
+        embedded_files = DictionaryObject({
+            NameObject("/Names"): ArrayObject([
+                createStringObject(xml_filename),
+                IndirectObject(filespec_id, 0, None),
+                ]),
+            })
+        names[NameObject("/EmbeddedFiles")] = IndirectObject(
+            embedded_files_id, 0, None)
+        new_catalog = DictionaryObject(
+            {key: catalog.raw_get(key) for key in catalog})
+        new_catalog.update({
+            NameObject("/Names"): IndirectObject(names_id, 0, None),
+            # show attachments when opening PDF
+            NameObject("/PageMode"): NameObject("/UseAttachments"),
+            })
+        objects = [
+            (root_ref.idnum, root_ref.generation, new_catalog),
+            (file_id, 0, file_entry),
+            (filespec_id, 0, filespec),
+            (embedded_files_id, 0, embedded_files),
+            (names_id, 0, names),
+            ]
+        update = BytesIO()
+        if not tail.endswith((b'\n', b'\r')):
+            update.write(b'\n')
+        xref = []
+        for idnum, generation, obj in objects:
+            xref.append((idnum, generation, pdf_size + update.tell()))
+            update.write(b'%d %d obj\n' % (idnum, generation))
+            obj.writeToStream(update, None)
+            update.write(b'\nendobj\n')
+        xref_offset = pdf_size + update.tell()
+        # the subsection of object 0 (head of the list of free objects)
+        # is repeated, as some readers expect the section to start with it
+        update.write(b'xref\n0 1\n0000000000 65535 f \n')
+        for idnum, generation, offset in xref:
+            update.write(b'%d 1\n%010d %05d n \n' % (
+                idnum, offset, generation))
+        new_trailer = DictionaryObject({
+            NameObject("/Size"): NumberObject(names_id + 1),
+            NameObject("/Root"): root_ref,
+            NameObject("/Prev"): NumberObject(startxref),
+            })
+        for key in ('/Info', '/ID'):
+            if key in trailer:
+                new_trailer[NameObject(key)] = trailer.raw_get(key)
+        update.write(b'trailer\n')
+        new_trailer.writeToStream(update, None)
+        update.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref_offset)
+        return update.getvalue()
+
     @api.model
     def embed_xml_in_pdf(
-            self, xml_string, xml_filename, pdf_content=None, pdf_file=None):
+            self, xml_string, xml_filename, pdf_content=None, pdf_file=None,
+            incremental=True):
         """
         2 possible uses:
         a) use the pdf_content argument, which has the binary of the PDF
@@ -520,9 +702,32 @@ class BaseUbl(models.AbstractModel):
         original PDF file
         -> it will re-write this file with the new PDF
         (used for py3o reports, *_ubl_py3o modules in this repo)
+        With incremental=True, the XML file is appended to the original
+        PDF as an incremental update. Otherwise, or when the PDF can't be
+        updated incrementally, all the pages are copied in a new PDF.
         """
         assert pdf_content or pdf_file, 'Missing pdf_file or pdf_content'
         logger.debug('Starting to embed %s in PDF file', xml_filename)
+        if incremental:
+            if pdf_file:
+                with open(pdf_file, 'rb') as f:
+                    update = self._pdf_embedded_file_update(
+                        f, xml_string, xml_filename)
+                if update:
+                    with open(pdf_file, 'ab') as f:
+                        f.write(update)
+                    logger.info(
+                        '%s file added to PDF (incremental update)',
+                        xml_filename)
+                    return pdf_content
+            else:
+                update = self._pdf_embedded_file_update(
+                    BytesIO(pdf_content), xml_string, xml_filename)
+                if update:
+                    logger.info(
+                        '%s file added to PDF (incremental update)',
+                        xml_filename)
+                    return pdf_content + update
         if pdf_file:
             original_pdf_file = pdf_file
         elif pdf_content:
@@ -542,91 +747,93 @@ class BaseUbl(models.AbstractModel):
             f.close()
             new_pdf_content = pdf_content
         elif pdf_content:
-            with NamedTemporaryFile(prefix='odoo-ubl-', suffix='.pdf') as f:
-                new_pdf_filestream.write(f)
-                f.seek(0)
-                new_pdf_content = f.read()
-                f.close()
+            new_pdf_stream = BytesIO()
+            new_pdf_filestream.write(new_pdf_stream)
+            new_pdf_content = new_pdf_stream.getvalue()
         logger.info('%s file added to PDF', xml_filename)
         return new_pdf_content
 
     # ==================== METHODS TO PARSE UBL files
 
+    @api.model
+    def _ubl_xpath(self, xpath):
+        """Returns the etree.XPath object of the xpath, compiled once
+        per process with the UBL namespaces (prefixes cac, cbc and inv)"""
+        compiled_xpath = UBL_XPATHS.get(xpath)
+        if compiled_xpath is None:
+            compiled_xpath = UBL_XPATHS[xpath] = etree.XPath(
+                xpath, namespaces=UBL_NAMESPACES)
+        return compiled_xpath
+
+    @api.model
+    def _ubl_xpath_text(self, node, xpath):
+        """Returns the text of the first node matching the xpath
+        or False"""
+        xpath_res = self._ubl_xpath(xpath)(node)
+        return xpath_res and xpath_res[0].text or False
+
+    # The ns argument of the ubl_parse_* methods is kept for compatibility:
+    # the XPath are compiled with the UBL namespaces (cf _ubl_xpath())
+
     @api.model
     def ubl_parse_customer_party(self, customer_party_node, ns):
-        ref_xpath = customer_party_node.xpath(
-            'cac:SupplierAssignedAccountID', namespaces=ns)
-        party_node = customer_party_node.xpath('cac:Party', namespaces=ns)[0]
+        party_node = self._ubl_xpath('cac:Party')(customer_party_node)[0]
         partner_dict = self.ubl_parse_party(party_node, ns)
-        partner_dict['ref'] = ref_xpath and ref_xpath[0].text or False
+        partner_dict['ref'] = self._ubl_xpath_text(
+            customer_party_node, 'cac:SupplierAssignedAccountID')
         return partner_dict
 
     @api.model
     def ubl_parse_supplier_party(self, customer_party_node, ns):
-        ref_xpath = customer_party_node.xpath(
-            'cac:CustomerAssignedAccountID', namespaces=ns)
-        party_node = customer_party_node.xpath('cac:Party', namespaces=ns)[0]
+        party_node = self._ubl_xpath('cac:Party')(customer_party_node)[0]
         partner_dict = self.ubl_parse_party(party_node, ns)
-        partner_dict['ref'] = ref_xpath and ref_xpath[0].text or False
+        partner_dict['ref'] = self._ubl_xpath_text(
+            customer_party_node, 'cac:CustomerAssignedAccountID')
         return partner_dict
 
     @api.model
     def ubl_parse_party(self, party_node, ns):
-        partner_name_xpath = party_node.xpath(
-            'cac:PartyName/cbc:Name', namespaces=ns)
-        vat_xpath = party_node.xpath(
-            'cac:PartyTaxScheme/cbc:CompanyID', namespaces=ns)
-        email_xpath = party_node.xpath(
-            'cac:Contact/cbc:ElectronicMail', namespaces=ns)
-        phone_xpath = party_node.xpath(
-            'cac:Contact/cbc:Telephone', namespaces=ns)
-        website_xpath = party_node.xpath(
-            'cbc:WebsiteURI', namespaces=ns)
         partner_dict = {
-            'vat': vat_xpath and vat_xpath[0].text or False,
-            'name': partner_name_xpath[0].text,
-            'email': email_xpath and email_xpath[0].text or False,
-            'website': website_xpath and website_xpath[0].text or False,
-            'phone': phone_xpath and phone_xpath[0].text or False,
+            'vat': self._ubl_xpath_text(
+                party_node, 'cac:PartyTaxScheme/cbc:CompanyID'),
+            'name': self._ubl_xpath('cac:PartyName/cbc:Name')(
+                party_node)[0].text,
+            'email': self._ubl_xpath_text(
+                party_node, 'cac:Contact/cbc:ElectronicMail'),
+            'website': self._ubl_xpath_text(party_node, 'cbc:WebsiteURI'),
+            'phone': self._ubl_xpath_text(
+                party_node, 'cac:Contact/cbc:Telephone'),
             }
-        address_xpath = party_node.xpath('cac:PostalAddress', namespaces=ns)
-        if address_xpath:
-            address_dict = self.ubl_parse_address(address_xpath[0], ns)
+        address_node = party_node.find(UBL_CAC + 'PostalAddress')
+        if address_node is not None:
+            address_dict = self.ubl_parse_address(address_node, ns)
             partner_dict.update(address_dict)
         return partner_dict
 
     @api.model
     def ubl_parse_address(self, address_node, ns):
-        country_code_xpath = address_node.xpath(
-            'cac:Country/cbc:IdentificationCode',
-            namespaces=ns)
-        country_code = country_code_xpath and country_code_xpath[0].text\
-            or False
-        state_code_xpath = address_node.xpath(
-            'cbc:CountrySubentityCode', namespaces=ns)
-        state_code = state_code_xpath and state_code_xpath[0].text or False
-        zip_xpath = address_node.xpath('cbc:PostalZone', namespaces=ns)
-        zip = zip_xpath and zip_xpath[0].text and\
-            zip_xpath[0].text.replace(' ', '') or False
+        zip = self._ubl_xpath_text(address_node, 'cbc:PostalZone')
         address_dict = {
-            'zip': zip,
-            'state_code': state_code,
-            'country_code': country_code,
+            'zip': zip and zip.replace(' ', '') or False,
+            'state_code': self._ubl_xpath_text(
+                address_node, 'cbc:CountrySubentityCode'),
+            'country_code': self._ubl_xpath_text(
+                address_node, 'cac:Country/cbc:IdentificationCode'),
             }
         return address_dict
 
     @api.model
     def ubl_parse_delivery(self, delivery_node, ns):
-        party_xpath = delivery_node.xpath('cac:DeliveryParty', namespaces=ns)
-        if party_xpath:
-            partner_dict = self.ubl_parse_party(party_xpath[0], ns)
+        party_node = delivery_node.find(UBL_CAC + 'DeliveryParty')
+        if party_node is not None:
+            partner_dict = self.ubl_parse_party(party_node, ns)
         else:
             partner_dict = {}
-        delivery_address_xpath = delivery_node.xpath(
-            'cac:DeliveryLocation/cac:Address', namespaces=ns)
+        delivery_address_xpath = self._ubl_xpath(
+            'cac:DeliveryLocation/cac:Address')(delivery_node)
         if not delivery_address_xpath:
-            delivery_address_xpath = delivery_node.xpath(
-                'cac:DeliveryAddress', namespaces=ns)
+            delivery_address_xpath = self._ubl_xpath(
+                'cac:DeliveryAddress')(delivery_node)
         if delivery_address_xpath:
             address_dict = self.ubl_parse_address(
                 delivery_address_xpath[0], ns)
@@ -639,21 +846,25 @@ class BaseUbl(models.AbstractModel):
         return delivery_dict
 
     def ubl_parse_incoterm(self, delivery_term_node, ns):
-        incoterm_xpath = delivery_term_node.xpath("cbc:ID", namespaces=ns)
-        if incoterm_xpath:
-            incoterm_dict = {'code': incoterm_xpath[0].text}
+        incoterm = self._ubl_xpath_text(delivery_term_node, 'cbc:ID')
+        if incoterm:
+            incoterm_dict = {'code': incoterm}
             return incoterm_dict
         return {}
 
     def ubl_parse_product(self, line_node, ns):
-        barcode_xpath = line_node.xpath(
-            "cac:Item/cac:StandardItemIdentification/cbc:ID[@schemeID='GTIN']",
-            namespaces=ns)
-        code_xpath = line_node.xpath(
-            "cac:Item/cac:SellersItemIdentification/cbc:ID", namespaces=ns)
+        item_node = line_node.find(UBL_CAC + 'Item')
+        if item_node is None:
+            return {'barcode': False, 'code': False}
+        return self.ubl_parse_item_product(item_node)
+
+    def ubl_parse_item_product(self, item_node):
         product_dict = {
-            'barcode': barcode_xpath and barcode_xpath[0].text or False,
-            'code': code_xpath and code_xpath[0].text or False,
+            'barcode': self._ubl_xpath_text(
+                item_node,
+                "cac:StandardItemIdentification/cbc:ID[@schemeID='GTIN']"),
+            'code': self._ubl_xpath_text(
+                item_node, "cac:SellersItemIdentification/cbc:ID"),
             }
         return product_dict
 
@@ -663,29 +874,67 @@ class BaseUbl(models.AbstractModel):
     # models/business_document_import.py
     # Because we don't depend on this module
     def get_xml_files_from_pdf(self, pdf_file):
-        """Returns a dict with key = filename, value = XML file obj"""
+        """Returns a dict with key = filename, value = XML file obj.
+        The embedded files are searched in the /EmbeddedFiles name tree
+        of the document catalog (including its /Kids) and in the /AF
+        array of associated files of PDF/A-3"""
         logger.info('Trying to find an embedded XML file inside PDF')
         res = {}
         try:
             fd = BytesIO(pdf_file)
-            pdf = PdfFileReader(fd)
+            pdf = PdfFileReader(fd, strict=False)
             logger.debug('pdf.trailer=%s', pdf.trailer)
             pdf_root = pdf.trailer['/Root']
             logger.debug('pdf_root=%s', pdf_root)
-            embeddedfiles = pdf_root['/Names']['/EmbeddedFiles']['/Names']
-            i = 0
-            xmlfiles = {}  # key = filename, value = PDF obj
-            for embeddedfile in embeddedfiles[:-1]:
-                mime_res = mimetypes.guess_type(embeddedfile)
-                if mime_res and mime_res[0] in ['application/xml', 'text/xml']:
-                    xmlfiles[embeddedfile] = embeddedfiles[i+1]
-                i += 1
+            xmlfiles = []  # list of (filename, PDF obj)
+            # The same file specification is usually referenced both by
+            # the name tree and by /AF
+            seen = set()
+
+            def add_filespec(filename, filespec):
+                if isinstance(filespec, IndirectObject):
+                    key = (filespec.idnum, filespec.generation)
+                else:
+                    key = filename
+                if key in seen:
+                    return
+                seen.add(key)
+                mime_res = mimetypes.guess_type(filename)
+                if mime_res and mime_res[0] in [
+                        'application/xml', 'text/xml']:
+                    xmlfiles.append((filename, filespec))
+
+            def walk_name_tree(node, depth=0):
+                # The depth check protects against a malformed PDF
+                # whose /Kids have a loop
+                if depth > 32:
+                    return
+                if '/Names' in node:
+                    names = node['/Names']
+                    for i in range(0, len(names) - 1, 2):
+                        add_filespec(str(names[i].getObject()), names[i + 1])
+                if '/Kids' in node:
+                    for kid in node['/Kids']:
+                        walk_name_tree(kid.getObject(), depth + 1)
+
+            if '/Names' in pdf_root and\
+                    '/EmbeddedFiles' in pdf_root['/Names']:
+                walk_name_tree(pdf_root['/Names']['/EmbeddedFiles'])
+            if '/AF' in pdf_root:
+                for filespec in pdf_root['/AF']:
+                    filespec_dict = filespec.getObject()
+                    filename = filespec_dict.get('/UF') or\
+                        filespec_dict.get('/F')
+                    if filename:
+                        add_filespec(str(filename.getObject()), filespec)
             logger.debug('xmlfiles=%s', xmlfiles)
-            for filename, xml_file_dict_obj in xmlfiles.items():
+            for filename, xml_file_dict_obj in xmlfiles:
                 try:
                     xml_file_dict = xml_file_dict_obj.getObject()
                     logger.debug('xml_file_dict=%s', xml_file_dict)
-                    xml_string = xml_file_dict['/EF']['/F'].getData()
+                    ef_dict = xml_file_dict['/EF']
+                    ef_key = '/F' in ef_dict and '/F' or '/UF'
+                    xml_string = ef_dict[ef_key].getData()
                     xml_root = etree.fromstring(xml_string)
                     logger.debug(
                         'A valid XML file %s has been found in the PDF file',
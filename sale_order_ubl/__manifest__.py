@@ -3,7 +3,7 @@
 
 {
     'name': 'Sale Order UBL',
-    'version': '12.0.1.0.0',
+    'version': '12.0.1.0.1',
     'category': 'Sales',
     'license': 'AGPL-3',
     'summary': 'Embed UBL XML file inside the PDF quotation',
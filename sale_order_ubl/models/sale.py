@@ -148,10 +148,10 @@ class SaleOrder(models.Model):
             xml_root = self.with_context(lang=lang).\
                 generate_order_response_simple_ubl_xml_etree(version=version)
             document = 'OrderResponseSimple'
+        self._ubl_check_xml_tree(xml_root, document, version=version)
         xml_string = etree.tostring(
             xml_root, pretty_print=True, encoding='UTF-8',
             xml_declaration=True)
-        self._ubl_check_xml_schema(xml_string, document, version=version)
         logger.debug(
             '%s UBL XML file generated for sale order ID %d (state %s)',
             doc_type, self.id, self.state)